@@ -0,0 +1,278 @@
+from FMIndex import FMIndex
+from IndexFile import IndexWriter, IndexReader
+
+class BidirectionalFMIndex:
+  '''
+  FM Index over a text and over its reverse, with synchronized intervals,
+  so that a match can be extended one character at a time on either side
+  A pattern P is represented by the interval (forward_start, reverse_start, size):
+    [forward_start, forward_start + size) are the rows of the suffixes of the text that start with P
+    [reverse_start, reverse_start + size) are the rows of the suffixes of the reversed text that start with reverse(P)
+  Extending P to cP is a backward search step on the BWT of the text. In the reversed text, the rows of reverse(P)c
+  come after those of reverse(P)b for every b < c, i.e. after the occurrences of bP, which are counted with the ranks
+  of every character at both ends of the forward interval. Extending to Pc is the same step with the roles swapped.
+  Either extension costs O(Σ) ranks (two getRankAll calls), whatever the length of the match
+  Public methods:
+    getInterval(pattern) -> interval of the pattern. getInterval('') is the interval of the empty match
+    extendLeft(interval,char), extendRight(interval,char) -> interval of cP or Pc, of size 0 if it does not occur
+    extendLeftAll(interval), extendRightAll(interval) -> {char: interval} for every character that extends the match
+    locate(interval) -> sorted text positions of the matches of an interval
+    findMatchCount(pattern), findApproximateMatchCount(pattern,max_mismatches), locateApproximate(pattern,max_mismatches)
+  Example use:
+  index = BidirectionalFMIndex('acacaac$',character_set="$ac")
+  seed = index.getInterval('ca')
+  index.extendRight(index.extendLeft(seed,'a'),'c') <-> index.getInterval('acac')
+
+  Space: two rank structures. Only the forward index keeps suffix array and inverse suffix array samples
+  '''
+  def __init__(self,text:str,character_set:str,**kwargs):
+    '''
+      :param text: text to index, terminated by the smallest character in the set (see FMIndex)
+      :param str character_set: an ordered string of all possible characters
+      :param kwargs: passed on to the FMIndex constructor of both directions
+    '''
+    # The reversed text keeps the terminator at its end. It is taken first, a bytearray text is consumed by the build
+    reverse_text = text[-2::-1] + text[-1:]
+    self._forward = FMIndex(text,character_set,**kwargs)
+    del text
+    # The reverse index is only used for its ranks: it keeps no suffix array or inverse suffix array samples
+    reverse_options = dict(kwargs,sa_sample_rate=None,isa_sample_rate=None,cache_size=0)
+    self._reverse = FMIndex(reverse_text,character_set,**reverse_options)
+
+  def save(self,path:str):
+    '''
+    Write both directions to path in the binary format of IndexFile
+    '''
+    writer = IndexWriter()
+    writer.write(path,{"forward": self._forward.serialize(writer), "reverse": self._reverse.serialize(writer)})
+
+  @classmethod
+  def load(cls,path:str,cache_size:int = 0):
+    '''
+    Load an index written by save(). The file is memory-mapped as in FMIndex.load
+    '''
+    reader = IndexReader(path)
+    index = cls.__new__(cls)
+    index._forward = FMIndex.deserialize(reader.state["forward"],reader,cache_size)
+    index._reverse = FMIndex.deserialize(reader.state["reverse"],reader)
+    return index
+
+  @property
+  def forward(self) -> FMIndex:
+    '''
+    The FMIndex of the text, for the queries of a single direction
+    '''
+    return self._forward
+
+  @property
+  def text_size(self):
+    return self._forward.text_size
+
+  @property
+  def character_set(self):
+    return self._forward.character_set
+
+  @staticmethod
+  def _extendAll(index:FMIndex,start:int,size:int):
+    '''
+    Backward search step of every character over the rows [start,start + size) of index
+    returns: list of (charIdx, start of the new rows in index, their offset in the other direction, their number)
+    The offset of c is the number of rows of the interval whose BWT character is smaller than c
+    '''
+    start_ranks = index._waveletTree.getRankAll(start)
+    end_ranks = index._waveletTree.getRankAll(start + size)
+    extensions = []
+    smaller = 0
+    for charIdx,(start_rank,end_rank) in enumerate(zip(start_ranks,end_ranks)):
+      count = end_rank - start_rank
+      if count:
+        extensions.append((charIdx,index._skip_count[charIdx] + start_rank,smaller,count))
+      smaller += count
+    return extensions
+
+  @staticmethod
+  def _extend(index:FMIndex,start:int,size:int,charIdx:int):
+    '''
+    Backward search step of one character, see _extendAll
+    returns: (start of the new rows in index, their offset in the other direction, their number)
+    '''
+    start_ranks = index._waveletTree.getRankAll(start)
+    end_ranks = index._waveletTree.getRankAll(start + size)
+    count = end_ranks[charIdx] - start_ranks[charIdx]
+    smaller = sum(end_ranks[:charIdx]) - sum(start_ranks[:charIdx])
+    return index._skip_count[charIdx] + start_ranks[charIdx],smaller,count
+
+  def _extendLeftIdx(self,interval:tuple,charIdx:int):
+    forward_start,reverse_start,size = interval
+    start,offset,count = self._extend(self._forward,forward_start,size,charIdx)
+    return (start,reverse_start + offset,count) if count else (0,0,0)
+
+  def _extendRightIdx(self,interval:tuple,charIdx:int):
+    forward_start,reverse_start,size = interval
+    start,offset,count = self._extend(self._reverse,reverse_start,size,charIdx)
+    return (forward_start + offset,start,count) if count else (0,0,0)
+
+  def getInterval(self,pattern:str = ''):
+    '''
+    Interval (forward_start, reverse_start, size) of the pattern, found by extending the empty match to the left
+    '''
+    interval = (0,0,self._forward.text_size)
+    for c in reversed(pattern):
+      interval = self.extendLeft(interval,c)
+      if not interval[2]:
+        break
+    return interval
+
+  def extendLeft(self,interval:tuple,char:str):
+    '''
+    Interval of char + P, given the interval of P
+    '''
+    charIdx = self._forward._charToIdx.get(char)
+    if charIdx is None or not interval[2]:
+      return (0,0,0)
+    return self._extendLeftIdx(interval,charIdx)
+
+  def extendRight(self,interval:tuple,char:str):
+    '''
+    Interval of P + char, given the interval of P
+    '''
+    charIdx = self._forward._charToIdx.get(char)
+    if charIdx is None or not interval[2]:
+      return (0,0,0)
+    return self._extendRightIdx(interval,charIdx)
+
+  def _extendAllIdx(self,interval:tuple,right:bool):
+    '''
+    List of (charIdx, interval) of the extensions of the interval by every character but the terminator
+    '''
+    forward_start,reverse_start,size = interval
+    if right:
+      return [(charIdx,(forward_start + offset,start,count))
+              for charIdx,start,offset,count in self._extendAll(self._reverse,reverse_start,size) if charIdx]
+    return [(charIdx,(start,reverse_start + offset,count))
+            for charIdx,start,offset,count in self._extendAll(self._forward,forward_start,size) if charIdx]
+
+  def extendLeftAll(self,interval:tuple):
+    '''
+    {c: interval of c + P} for every character c that occurs before P, the terminator excluded
+    '''
+    if not interval[2]:
+      return {}
+    characters = self.character_set
+    return {characters[charIdx]: extension for charIdx,extension in self._extendAllIdx(interval,False)}
+
+  def extendRightAll(self,interval:tuple):
+    '''
+    {c: interval of P + c} for every character c that occurs after P, the terminator excluded
+    '''
+    if not interval[2]:
+      return {}
+    characters = self.character_set
+    return {characters[charIdx]: extension for charIdx,extension in self._extendAllIdx(interval,True)}
+
+  def iterLocate(self,interval:tuple):
+    '''
+    Lazily yield the text positions of the matches of an interval, in suffix order
+    '''
+    forward_start,_,size = interval
+    for row in range(forward_start,forward_start + size):
+      yield self._forward._getSuffixArrayEntry(row)
+
+  def locate(self,interval:tuple):
+    '''
+    Sorted list of the text positions of the matches of an interval
+    '''
+    return sorted(self.iterLocate(interval))
+
+  def findMatchCount(self,pattern:str):
+    '''
+    Number of occurences of the given pattern on the static text
+    '''
+    return self.getInterval(pattern)[2]
+
+  def _extendApproximate(self,codes:list,interval:tuple,start:int,end:int,mismatches:int,max_mismatches:int,pieces:list = ()):
+    '''
+    Yield (interval, mismatches) for every extension of the interval of pattern[start:end] to the whole pattern
+    with at most max_mismatches in total. Extends to the right up to the end of the pattern, then to the left
+    pieces: (piece start, piece end) of the pieces left of start that must hold at least one mismatch each
+    The smallest character (the text terminator) is never substituted in
+    '''
+    m = len(codes)
+    # required[i] = pieces that lie inside pattern[:i]
+    required = [sum(piece_end <= i for _,piece_end in pieces) for i in range(start + 1)]
+    piece_starts = {piece_start for piece_start,_ in pieces}
+    piece_ends = {piece_end for _,piece_end in pieces}
+    # (interval, matched start, matched end, mismatches, mismatches when the current left piece was entered)
+    stack = [(interval,start,end,mismatches,mismatches)]
+    while stack:
+      interval,start,end,mismatches,piece_mismatches = stack.pop()
+      right = end < m
+      if right:
+        i = end
+      elif start:
+        i = start - 1
+        if start in piece_ends:
+          piece_mismatches = mismatches
+      else:
+        yield interval,mismatches
+        continue
+      patternIdx = codes[i]
+      if mismatches < max_mismatches:
+        extensions = self._extendAllIdx(interval,right)
+      elif patternIdx is not None:
+        # No mismatches left: only the pattern character can extend the match
+        extend = self._extendRightIdx if right else self._extendLeftIdx
+        extensions = [(patternIdx,extend(interval,patternIdx))]
+      else:
+        continue
+      for charIdx,next_interval in extensions:
+        if not next_interval[2]:
+          continue
+        next_mismatches = mismatches + (charIdx != patternIdx)
+        if right:
+          if next_mismatches + required[start] <= max_mismatches:
+            stack.append((next_interval,start,end + 1,next_mismatches,piece_mismatches))
+          continue
+        if i in piece_starts and next_mismatches == piece_mismatches:
+          # The piece is complete without a mismatch
+          continue
+        # Every piece left of i still needs its own mismatch, and so does the current one if it has none yet
+        pending = required[i] + (i not in piece_starts and next_mismatches == piece_mismatches)
+        if next_mismatches + pending <= max_mismatches:
+          stack.append((next_interval,i,end,next_mismatches,piece_mismatches))
+
+  def _approximateSearch(self,pattern:str,max_mismatches:int):
+    '''
+    Yield (interval, mismatches) for every string within max_mismatches substitutions of the pattern that occurs in the text
+    The intervals are disjoint. Pigeonhole search scheme: the pattern is cut into max_mismatches + 1 pieces, one of which
+    matches exactly. For every piece p: match it exactly, extend to the right end of the pattern, then to the left end
+    with at least one mismatch in every piece before p, so that every match is found from its first exact piece only
+    '''
+    m = len(pattern)
+    codes = [self._forward._charToIdx.get(c) for c in pattern]
+    if max_mismatches >= m:
+      # Every piece could mismatch: search the whole pattern with backtracking
+      yield from self._extendApproximate(codes,self.getInterval(),0,0,0,max_mismatches)
+      return
+    num_pieces = max_mismatches + 1
+    bounds = [m * p // num_pieces for p in range(num_pieces + 1)]
+    for p in range(num_pieces):
+      interval = self.getInterval(pattern[bounds[p]:bounds[p + 1]])
+      if not interval[2]:
+        continue
+      pieces = list(zip(bounds[:p],bounds[1:p + 1]))
+      yield from self._extendApproximate(codes,interval,bounds[p],bounds[p + 1],0,max_mismatches,pieces)
+
+  def findApproximateMatchCount(self,pattern:str,max_mismatches:int = 1):
+    '''
+    Number of text positions where the pattern occurs with at most max_mismatches substituted characters
+    '''
+    return sum(interval[2] for interval,_ in self._approximateSearch(pattern,max_mismatches))
+
+  def locateApproximate(self,pattern:str,max_mismatches:int = 1):
+    '''
+    Sorted list of (text position, mismatches) of the occurrences of the pattern
+    with at most max_mismatches substituted characters
+    '''
+    return sorted((position,mismatches) for interval,mismatches in self._approximateSearch(pattern,max_mismatches)
+                  for position in self.iterLocate(interval))
@@ -0,0 +1,289 @@
+from array import array
+from bisect import bisect_right
+try:
+  import numpy as np
+except ImportError: # numpy is only needed for the batched rank queries
+  np = None
+from constants import BIT_PACK_SIZE, DEFAULT_SUPERBLOCK_SIZE, MAX_SUPERBLOCK_SIZE
+from utils import selectInWord
+
+# Maps 0/1 byte values to the ASCII digits '0'/'1'
+_BIT_CHARS = bytes.maketrans(b'\x00\x01', b'01')
+
+def _popcount(words):
+  '''
+  Number of 1s in every uint64 of a numpy array
+  Falls back to a byte lookup table on numpy versions without bitwise_count
+  '''
+  if hasattr(np,'bitwise_count'):
+    return np.bitwise_count(words)
+  return _POPCOUNT_TABLE[words.view(np.uint8)].reshape(-1,8).sum(axis=1,dtype=np.uint8)
+
+_POPCOUNT_TABLE = None if np is None else np.array([bin(b).count('1') for b in range(256)],dtype=np.uint8)
+
+def _superblockTypecode(size: int) -> str:
+  '''
+  Typecode of the absolute superblock ranks of a bitvector of size bits
+  '''
+  return 'I' if size < 1 << 32 else 'Q'
+
+class BitVector:
+    '''
+    Succinct bitvector supporting O(1) rank queries
+    Bits are packed into 64-bit words: bit i lives in word i // 64 at position i % 64
+    The rank directory has two levels:
+      - superblock ranks: number of 1s before every superblock (absolute, 32 bits below 2^32 bits, else 64)
+      - block ranks: number of 1s before every word, relative to its superblock
+    rank1(i) = superblock rank + block rank + popcount of the partial word
+    select1(k) binary searches the superblock ranks, scans the block ranks of one superblock
+    and selects inside one word, so it costs O(lg(n / superblock_size) + superblock_size / 64)
+    Space: n + n/superblock_size * (32 or 64) + n/64 * (8 or 16) bits, 1.25n with the default 256-bit superblocks
+    '''
+    def __init__(self,bits = (),superblock_size: int = None) -> None:
+      '''
+        :param bits: iterable of 0s and 1s (or booleans)
+        :param int superblock_size: bits per absolute rank sample, rounded up to a multiple of 64
+      '''
+      self._setSuperblockSize(superblock_size)
+      digits = bytes(bits).translate(_BIT_CHARS)
+      self._size = len(digits)
+      # One trailing zero word so that rank1(size) never reads past the end
+      self._words = array('Q',[int(digits[k:k + BIT_PACK_SIZE][::-1],2) for k in range(0,self._size,BIT_PACK_SIZE)])
+      self._words.append(0)
+      self._buildRankDirectory()
+      self._numpy_views = None
+
+    @classmethod
+    def fromNumpy(cls,bits,superblock_size: int = None):
+      '''
+      Build a BitVector from a numpy boolean array
+      Bits are packed with np.packbits and the rank directory is computed with cumulative sums
+      '''
+      bit_vector = cls.__new__(cls)
+      bit_vector._setSuperblockSize(superblock_size)
+      bit_vector._size = len(bits)
+      num_words = len(bits) // BIT_PACK_SIZE + 1 + (len(bits) % BIT_PACK_SIZE > 0)
+      packed = np.zeros(num_words * 8,dtype=np.uint8)
+      packed[:(len(bits) + 7) // 8] = np.packbits(bits,bitorder='little')
+      words = packed.view('<u8').astype(np.uint64)
+
+      counts = _popcount(words).astype(np.int64)
+      ranks = np.cumsum(counts) - counts
+      superblock_ranks = ranks[::bit_vector._words_per_superblock]
+      block_ranks = ranks - np.repeat(superblock_ranks,bit_vector._words_per_superblock)[:num_words]
+
+      bit_vector._words = array('Q',words.tobytes())
+      bit_vector._superblock_ranks = array(_superblockTypecode(bit_vector._size))
+      bit_vector._superblock_ranks.frombytes(superblock_ranks.astype(np.uint32 if bit_vector._superblock_ranks.itemsize == 4 else np.uint64).tobytes())
+      bit_vector._block_ranks = array(bit_vector._block_typecode)
+      bit_vector._block_ranks.frombytes(block_ranks.astype(np.uint8 if bit_vector._block_typecode == 'B' else np.uint16).tobytes())
+      bit_vector._numpy_views = None
+      return bit_vector
+
+    def _setSuperblockSize(self,superblock_size: int = None):
+      if superblock_size is None:
+        superblock_size = DEFAULT_SUPERBLOCK_SIZE
+      superblock_size = max(1,-(-superblock_size // BIT_PACK_SIZE)) * BIT_PACK_SIZE
+      if superblock_size > MAX_SUPERBLOCK_SIZE:
+        raise ValueError(f"Superblock size can be at most {MAX_SUPERBLOCK_SIZE} bits")
+      self._words_per_superblock = superblock_size // BIT_PACK_SIZE
+      # Relative ranks inside a superblock fit in a byte for superblocks of up to 256 bits
+      self._block_typecode = 'B' if superblock_size <= 256 else 'H'
+
+    def _buildRankDirectory(self):
+      '''
+      Pre-compute the absolute superblock ranks and the relative block ranks
+      '''
+      superblock_ranks = array(_superblockTypecode(self._size))
+      block_ranks = array(self._block_typecode)
+      rank = 0
+      relative = 0
+      for w, word in enumerate(self._words):
+        if not w % self._words_per_superblock:
+          superblock_ranks.append(rank)
+          relative = 0
+        block_ranks.append(relative)
+        count = word.bit_count()
+        rank += count
+        relative += count
+      self._superblock_ranks = superblock_ranks
+      self._block_ranks = block_ranks
+
+    def __len__(self) -> int:
+      return self._size
+
+    def __repr__(self) -> str:
+      return ''.join(str(self.access(i)) for i in range(self._size))
+
+    @property
+    def ones(self) -> int:
+      return self.rank1(self._size)
+
+    def access(self,i: int) -> int:
+      '''
+      Bit at index i
+      '''
+      if i < 0 or i >= self._size:
+        raise IndexError(f'Cannot get bit at index {i}. Max index is {self._size - 1}')
+      return (self._words[i // BIT_PACK_SIZE] >> (i % BIT_PACK_SIZE)) & 1
+
+    def rank1(self,i: int) -> int:
+      '''
+      Number of 1s in bits[0:i]
+      '''
+      w = i // BIT_PACK_SIZE
+      rank = self._superblock_ranks[w // self._words_per_superblock] + self._block_ranks[w]
+      offset = i % BIT_PACK_SIZE
+      if offset:
+        rank += (self._words[w] & ((1 << offset) - 1)).bit_count()
+      return rank
+
+    def rank1Pair(self,i: int,j: int):
+      '''
+      (rank1(i), rank1(j)), sharing the directory lookups when i and j fall in the same word
+      '''
+      w = i // BIT_PACK_SIZE
+      base = self._superblock_ranks[w // self._words_per_superblock] + self._block_ranks[w]
+      word = self._words[w]
+      rank_i = base + (word & ((1 << (i % BIT_PACK_SIZE)) - 1)).bit_count()
+      if j // BIT_PACK_SIZE == w:
+        return rank_i,base + (word & ((1 << (j % BIT_PACK_SIZE)) - 1)).bit_count()
+      return rank_i,self.rank1(j)
+
+    def rank0(self,i: int) -> int:
+      '''
+      Number of 0s in bits[0:i]
+      '''
+      return i - self.rank1(i)
+
+    def _select(self,k: int,bit: int) -> int:
+      '''
+      Position of the k-th bit equal to bit (counting from 0)
+      '''
+      total = self.ones if bit else self._size - self.ones
+      if k < 0 or k >= total:
+        raise ValueError(f'Cannot select {bit} number {k}. There are only {total} {bit}s')
+      superblock_bits = self._words_per_superblock * BIT_PACK_SIZE
+      if bit:
+        before_superblock = lambda s: self._superblock_ranks[s]
+        before_word = lambda w: self._block_ranks[w]
+      else:
+        before_superblock = lambda s: s * superblock_bits - self._superblock_ranks[s]
+        before_word = lambda w: (w % self._words_per_superblock) * BIT_PACK_SIZE - self._block_ranks[w]
+      if bit:
+        superblock = bisect_right(self._superblock_ranks,k) - 1
+      else:
+        superblock = bisect_right(range(len(self._superblock_ranks)),k,key=before_superblock) - 1
+      k -= before_superblock(superblock)
+      first = superblock * self._words_per_superblock
+      last = min(first + self._words_per_superblock,len(self._words))
+      w = bisect_right(range(first,last),k,key=before_word) - 1 + first
+      word = self._words[w] if bit else ~self._words[w] & 0xFFFFFFFFFFFFFFFF
+      return w * BIT_PACK_SIZE + selectInWord(word,k - before_word(w))
+
+    def select1(self,k: int) -> int:
+      '''
+      Position of the k-th 1 (counting from 0), the i with bits[i] = 1 and rank1(i) = k
+      '''
+      return self._select(k,1)
+
+    def select0(self,k: int) -> int:
+      '''
+      Position of the k-th 0 (counting from 0)
+      '''
+      return self._select(k,0)
+
+    def serialize(self,writer) -> dict:
+      '''
+      Register the words and rank directory with an IndexWriter and describe the rest
+      '''
+      return {
+        "type": "plain",
+        "size": self._size,
+        "words_per_superblock": self._words_per_superblock,
+        "words": writer.addBuffer(self._words),
+        "superblock_ranks": writer.addBuffer(self._superblock_ranks),
+        "block_ranks": writer.addBuffer(self._block_ranks),
+      }
+
+    @classmethod
+    def deserialize(cls,state: dict,reader):
+      '''
+      Rebuild a BitVector over the memory-mapped buffers of an IndexReader
+      '''
+      bit_vector = cls.__new__(cls)
+      bit_vector._size = state["size"]
+      bit_vector._words_per_superblock = state["words_per_superblock"]
+      bit_vector._words = reader.getBuffer(state["words"])
+      bit_vector._superblock_ranks = reader.getBuffer(state["superblock_ranks"])
+      bit_vector._block_ranks = reader.getBuffer(state["block_ranks"])
+      bit_vector._numpy_views = None
+      return bit_vector
+
+    def _getNumpyViews(self):
+      '''
+      Zero-copy numpy views of the words and the rank directory, created on first use
+      '''
+      if self._numpy_views is None:
+        if np is None:
+          raise ImportError("numpy is required for batched rank queries")
+        self._numpy_views = (
+          np.frombuffer(self._words,dtype=np.uint64),
+          np.frombuffer(self._superblock_ranks,dtype=np.uint32 if self._superblock_ranks.itemsize == 4 else np.int64).astype(np.int64),
+          np.frombuffer(self._block_ranks,dtype=np.uint8 if self._block_ranks.itemsize == 1 else np.uint16),
+        )
+      return self._numpy_views
+
+    def rank1Many(self,idxs):
+      '''
+      Vectorized rank1 over a numpy array of positions
+      '''
+      words,superblock_ranks,block_ranks = self._getNumpyViews()
+      w = idxs // BIT_PACK_SIZE
+      masks = (np.left_shift(np.uint64(1),(idxs % BIT_PACK_SIZE).astype(np.uint64)) - np.uint64(1))
+      partial = _popcount(words[w] & masks)
+      return superblock_ranks[w // self._words_per_superblock] + block_ranks[w] + partial
+
+    def rank0Many(self,idxs):
+      '''
+      Vectorized rank0 over a numpy array of positions
+      '''
+      return idxs - self.rank1Many(idxs)
+
+    def getSpaceUsage(self) -> dict:
+      '''
+      Report the space used in bits by the payload and the rank directory
+      '''
+      payload_bits = len(self._words) * self._words.itemsize * 8
+      directory_bits = len(self._superblock_ranks) * self._superblock_ranks.itemsize * 8 + len(self._block_ranks) * self._block_ranks.itemsize * 8
+      return {
+        "bits": self._size,
+        "payload_bits": payload_bits,
+        "directory_bits": directory_bits,
+      }
+
+from RRRBitVector import RRRBitVector
+from RunLengthBitVector import RunLengthBitVector
+
+# Bitvector encodings that can back the wavelet nodes and levels. They share BitVector's interface
+BIT_VECTOR_TYPES = {
+  'plain': BitVector,
+  'rrr': RRRBitVector,
+  'runlength': RunLengthBitVector,
+}
+
+def get_bit_vector_type(name: str):
+  """
+  name: key in BIT_VECTOR_TYPES
+  returns: the bitvector class
+  """
+  try:
+    return BIT_VECTOR_TYPES[name]
+  except KeyError:
+    raise ValueError(f"Unknown bitvector type '{name}'. Choose one of: {', '.join(BIT_VECTOR_TYPES)}")
+
+def deserialize_bit_vector(state: dict,reader):
+  """
+  Rebuild a bitvector of any type from its serialized state. States without a type are plain BitVectors
+  """
+  return get_bit_vector_type(state.get("type","plain")).deserialize(state,reader)
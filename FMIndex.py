@@ -1,72 +1,556 @@
+from array import array
+from bisect import bisect_right
+try:
+  import numpy as np
+except ImportError: # numpy is only needed for findMatchCounts
+  np = None
 from WaveletTree import WaveletTree
-from utils import timer_func
-from SuffixArray import suffix_array_best
+from WaveletMatrix import WaveletMatrix
+from RunLengthBWT import RunLengthBWT
+from utils import encodeText, getPeakRSS
+from SuffixArray import get_suffix_array_builder
+from BitVector import get_bit_vector_type, deserialize_bit_vector
+from IndexFile import IndexWriter, IndexReader
+from TextReader import read_text
+from IntervalCache import IntervalCache
+from KmerTable import KmerTable
+
+# Structures that can answer rank queries over the BWT
+WAVELET_BACKENDS = {
+  'tree': WaveletTree,
+  'matrix': WaveletMatrix,
+  'runlength': RunLengthBWT,
+}
+# A psi step (one select) costs about as much as this many LF steps (one rank) on every backend
+PSI_STEP_COST = 8
 
 class FMIndex:
   '''
   Class to build an FM Index based on the BWT of the text
-  Stores the Wavelet tree built over the BWT, 
+  Stores the Wavelet tree (or Wavelet matrix) built over the BWT, 
   the "skip counts" for each character in the charcater set,
   and the mapping from each character to its index in the sorted order of characters
-  Space: O(|WaveletTree| + 2Σ )
+  To locate matches, the suffix array is sampled at every k-th text position:
+  a bitvector marks the sampled BWT rows and the samples are stored in row order
+  To extract text, the inverse suffix array is sampled at every j-th text position (the row of that suffix),
+  so the index is self-contained and the text can be discarded after the build
+  Space: O(|WaveletTree| + 2Σ + n + (n/k)lg(n) + (n/j)lg(n)). Without samples (sa_sample_rate and isa_sample_rate None)
+  the index only counts, in O(|WaveletTree| + 2Σ) space, O(r) with the run-length backend for a BWT of r runs
+  The build runs on typed buffers: one byte per symbol for the text and the BWT,
+  and 4 bytes per position for the suffix array (8 past 2^31 characters).
+  The peak RSS after every build phase is kept, see getBuildStats()
   '''
-  @timer_func
-  def __init__(self,text:str,character_set:str,block_size:int = 1,debug:bool = False):
+  def __init__(self,text:str,character_set:str,block_size:int = None,sa_algorithm:str = 'sais',backend:str = 'tree',sa_sample_rate:int = 32,isa_sample_rate:int = 32,build_workers:int = None,cache_size:int = 0,kmer_length:int = None,tree_shape:str = 'balanced',bitvector:str = 'plain',debug:bool = False):
+    '''
+      :param text: text to index, terminated by the smallest character in the set.
+        A str, or bytes-like with one latin-1 character per byte. A bytearray is encoded in place and consumed
+      :param str character_set: an ordered string of all possible characters
+      :param int block_size: bits per superblock of the rank directory of every bitvector of the rank structure,
+        rounded up to a whole 64-bit word. It counts bits of a bitvector, not characters of the text. Smaller values
+        make ranks cheaper and the directory larger (64 bits per superblock). None uses the default of the bitvector
+        encoding: DEFAULT_SUPERBLOCK_SIZE (256) bits for 'plain', about 1.25 bits per bit in total
+      :param str sa_algorithm: suffix array construction backend, 'sais' (linear time) or 'doubling' (reference)
+      :param str backend: rank structure built over the BWT, 'tree' (WaveletTree), 'matrix' (WaveletMatrix)
+        or 'runlength' (RunLengthBWT, O(r) space for a BWT of r runs, for highly repetitive texts)
+      :param int sa_sample_rate: keep the suffix array entry of every k-th text position. Larger values use less memory but make locate slower.
+        None keeps no samples: the index cannot locate, and with the 'runlength' backend its space is proportional to the number of runs
+      :param int isa_sample_rate: keep the row of every j-th text position. Larger values use less memory but make extract slower.
+        None keeps no samples: the index cannot extract
+      :param int build_workers: build the rank structure with numpy over this many processes. None uses the pure Python build
+      :param int cache_size: keep the BWT intervals of up to this many recent patterns in an LRU cache. 0 disables the cache
+      :param int kmer_length: build a table with the interval of every k-mer of this length, so that
+        searches skip their first k steps. None disables the table
+      :param str tree_shape: shape of the WaveletTree backend, 'balanced' or 'huffman' (shaped by the character frequencies of the BWT)
+      :param str bitvector: encoding of the rank structure's bitvectors, 'plain', 'rrr' (compressed) or 'runlength' (for repetitive texts)
+      :param bool debug: print the peak RSS of the build
+    '''
+    if backend not in WAVELET_BACKENDS:
+      raise ValueError(f"Unknown backend '{backend}'. Choose one of: {', '.join(WAVELET_BACKENDS)}")
+    if tree_shape != 'balanced' and backend != 'tree':
+      raise ValueError("Only the 'tree' backend can be shaped by character frequencies")
+    if sa_sample_rate is not None and sa_sample_rate < 1:
+      raise ValueError("Suffix array sample rate must be at least 1")
+    if isa_sample_rate is not None and isa_sample_rate < 1:
+      raise ValueError("Inverse suffix array sample rate must be at least 1")
+    self._build_stats = {"n": len(text), "peak_rss": {"start": getPeakRSS()}}
     self._text_size = len(text)
+    self._backend = backend
+    self._sa_sample_rate = sa_sample_rate
+    self._isa_sample_rate = isa_sample_rate
+    self._cache = IntervalCache(cache_size) if cache_size else None
+    self._kmer_length = kmer_length
     # Stores the mapping: character -> character index in the lexicographically ordered set
     self._charToIdx = dict(zip(character_set,range(len(character_set))))
 
-    # Stores a dictionary of where each character in the character set is first seen
+    # Stores where each character in the character set is first seen
     # among all the sorted suffixes
     self._skip_count = [0] * len(character_set)
-    bwt = self._buildBWTandSkipCounts(text)
-    self._waveletTree = WaveletTree(bwt,character_set,block_size=block_size)
 
-  def _buildBWTandSkipCounts(self,text:str):
+    # The text is only needed as character indexes from here on
+    try:
+      codes = encodeText(text,character_set)
+    except ValueError:
+      raise SyntaxError("pattern includes at least one character that's not in the character set of the FM Index")
+    del text
+    self._recordPeakRSS('encode')
+    # The sampled rows are sparse. Indexes built for space store them compressed
+    sampled_rows_bitvector = 'plain' if bitvector == 'plain' and backend != 'runlength' else 'rrr'
+    bwt = self._buildBWTandSkipCounts(codes,sa_algorithm,sampled_rows_bitvector)
+    del codes
+    shape_options = {"shape": tree_shape} if backend == 'tree' else {}
+    self._waveletTree = WAVELET_BACKENDS[backend](bwt,character_set,block_size=block_size,workers=build_workers,bitvector=bitvector,**shape_options)
+    self._recordPeakRSS('rank_structure')
+    if debug:
+      peak_rss = self._build_stats["peak_rss"]
+      if peak_rss["start"] is not None:
+        print(f'Build peak RSS: {peak_rss["rank_structure"] / 2**20:.1f} MB ({(peak_rss["rank_structure"] - peak_rss["start"]) / max(self._text_size,1):.1f} bytes per character over the start)')
+
+  def _recordPeakRSS(self,phase:str):
+    self._build_stats["peak_rss"][phase] = getPeakRSS()
+
+  def getBuildStats(self):
+    '''
+    Peak RSS of the process, in bytes, at the start of the build and after each phase:
+    encode, suffix_array, bwt, sa_sampling and rank_structure. The peak never goes down,
+    so the phase where it grows the most is the one that sets the peak
+    None for an index that was loaded, or where the RSS cannot be measured
     '''
-    Builds the BWT for the given text using its Suffix Array
+    if self._build_stats is None or self._build_stats["peak_rss"]["start"] is None:
+      return None
+    return {"n": self._build_stats["n"], "peak_rss": dict(self._build_stats["peak_rss"])}
+
+  @classmethod
+  def fromStream(cls,source,fasta:bool = True,meta_char:str = '$',max_lines:int = None,**kwargs):
+    '''
+    Build an index from a file path or an iterable of str/bytes chunks
+    The text is streamed into one bytearray, FASTA headers and newlines are filtered out
+    and the character set is inferred in the same pass (see TextReader.read_text)
+    Build memory, in bytes per text character (measured on DNA with the default backends):
+      reading: 1 for the text buffer, plus one chunk. It is then encoded in place
+      suffix array: ~20 at the peak of SA-IS, 4 for the finished suffix array (8 past 2^31 characters)
+      BWT: 1 more, after which the suffix array is released
+      wavelet build: ~2 at the peak of the pure Python WaveletTree build, so SA-IS sets the peak
+    getBuildStats() reports the measured peak RSS of a build
+    :param kwargs: passed on to the FMIndex constructor
+    '''
+    text,character_set = read_text(source,fasta=fasta,meta_char=meta_char,max_lines=max_lines)
+    return cls(text,character_set,**kwargs)
+
+  def _buildBWTandSkipCounts(self,codes,sa_algorithm:str = 'sais',sampled_rows_bitvector:str = 'plain'):
+    '''
+    Builds the BWT for the encoded text using its Suffix Array
     Also populates the skip counts in the process
+    The suffix array is built over the integer-encoded text with the chosen backend
+    and sampled, with the sampled rows marked in a bitvector of the given type
     '''
-    sa = suffix_array_best(text)
-    seen = set()
-    bwt = ['']*len(sa)
-    for i in range(len(sa)):
-      try:
-        currCharIdx = self._charToIdx[text[sa[i]]]
-      except:
-        raise SyntaxError("pattern includes at least one character that's not in the character set of the FM Index")
-      currBWTChar = text[sa[i]-1]
-      bwt[i] = currBWTChar
-      if currCharIdx not in seen:
-        self._skip_count[currCharIdx] = i
-        seen.add(currCharIdx)
-    return "".join(bwt)
-
-  @timer_func
-  def findMatchCount(self,pattern:str):
+    build_suffix_array = get_suffix_array_builder(sa_algorithm)
+    sa = build_suffix_array(codes)
+    self._recordPeakRSS('suffix_array')
+    bwt = self.bwtFromSuffixArray(codes,sa)
+    self._recordPeakRSS('bwt')
+
+    # Suffixes starting with the c-th character come after all suffixes starting with a smaller one
+    running = 0
+    for charIdx in range(len(self._skip_count)):
+      self._skip_count[charIdx] = running
+      running += codes.count(charIdx)
+
+    self._sampleSuffixArray(sa,sampled_rows_bitvector)
+    self._sampleInverseSuffixArray(sa)
+    self._kmer_table = KmerTable(codes,sa,self._kmer_length,len(self._skip_count)) if self._kmer_length else None
+    self._recordPeakRSS('sa_sampling')
+    return bwt
+
+  @staticmethod
+  def bwtFromSuffixArray(codes,sa):
+    '''
+    BWT[i] is the character before the i-th smallest suffix (the last one for the first suffix)
+    One byte per character, or a 32-bit array for character sets of more than 256 characters
+    '''
+    bwt = bytearray(len(sa)) if isinstance(codes,(bytes,bytearray)) else array('I',bytes(4 * len(sa)))
+    for i,pos in enumerate(sa):
+      bwt[i] = codes[pos-1]
+    return bwt
+
+  def _sampleSuffixArray(self,sa:list[int],bitvector:str = 'plain'):
+    '''
+    Keep the suffix array entries that point to a multiple of the sample rate
+    The entry for text position 0 is always sampled, so every LF walk ends at a sample
+    '''
+    k = self._sa_sample_rate
+    if k is None:
+      self._sampled_rows = self._sa_samples = None
+      return
+    self._sampled_rows = get_bit_vector_type(bitvector)(bytearray(not pos % k for pos in sa))
+    self._sa_samples = array('I' if len(sa) < 1 << 32 else 'Q',(pos for pos in sa if not pos % k))
+
+  def _sampleInverseSuffixArray(self,sa):
+    '''
+    _isa_samples[t] is the row of the suffix that starts at text position t * j
     '''
-    Use backward matching on the BWT to find the
-    number of occurences of the given pattern on the static text
+    j = self._isa_sample_rate
+    if j is None:
+      self._isa_samples = None
+      return
+    self._isa_samples = array('I' if len(sa) < 1 << 32 else 'Q',[0]) * -(-len(sa) // j)
+    for row,pos in enumerate(sa):
+      if not pos % j:
+        self._isa_samples[pos // j] = row
+
+  def save(self,path:str):
+    '''
+    Write the index to path in the versioned binary format of IndexFile
+    Covers the rank structure, the skip counts, the character map, the suffix array
+    and inverse suffix array samples and the k-mer table
+    '''
+    writer = IndexWriter()
+    writer.write(path,self.serialize(writer))
+
+  def serialize(self,writer) -> dict:
+    return {
+      "text_size": self._text_size,
+      "character_set": "".join(self._charToIdx),
+      "skip_count": self._skip_count,
+      "backend": self._backend,
+      "sa_sample_rate": self._sa_sample_rate,
+      "sampled_rows": None if self._sampled_rows is None else self._sampled_rows.serialize(writer),
+      "sa_samples": None if self._sa_samples is None else writer.addBuffer(self._sa_samples),
+      "isa_sample_rate": self._isa_sample_rate,
+      "isa_samples": None if self._isa_samples is None else writer.addBuffer(self._isa_samples),
+      "rank_structure": self._waveletTree.serialize(writer),
+      "kmer_table": None if self._kmer_table is None else self._kmer_table.serialize(writer),
+    }
+
+  @classmethod
+  def load(cls,path:str,cache_size:int = 0):
+    '''
+    Load an index written by save()
+    The file is memory-mapped, so loading does no rebuilding and
+    processes that load the same file share one copy of its pages
+    The interval cache is not persisted. cache_size enables a new, empty one
+    '''
+    reader = IndexReader(path)
+    return cls.deserialize(reader.state,reader,cache_size)
+
+  @classmethod
+  def deserialize(cls,state:dict,reader,cache_size:int = 0):
+    index = cls.__new__(cls)
+    index._text_size = state["text_size"]
+    index._charToIdx = dict(zip(state["character_set"],range(len(state["character_set"]))))
+    index._skip_count = state["skip_count"]
+    index._backend = state["backend"]
+    index._sa_sample_rate = state["sa_sample_rate"]
+    index._cache = IntervalCache(cache_size) if cache_size else None
+    index._sampled_rows = None if state["sampled_rows"] is None else deserialize_bit_vector(state["sampled_rows"],reader)
+    index._sa_samples = None if state["sa_samples"] is None else reader.getBuffer(state["sa_samples"])
+    # Files saved before extract was added have no inverse suffix array samples
+    index._isa_sample_rate = state.get("isa_sample_rate")
+    index._isa_samples = None if state.get("isa_samples") is None else reader.getBuffer(state["isa_samples"])
+    index._waveletTree = WAVELET_BACKENDS[index._backend].deserialize(state["rank_structure"],reader)
+    index._kmer_table = None if state["kmer_table"] is None else KmerTable.deserialize(state["kmer_table"],reader)
+    index._kmer_length = None if index._kmer_table is None else index._kmer_table.k
+    index._build_stats = None
+    return index
+
+  @property
+  def text_size(self):
+    '''
+    Length of the indexed text, terminator included
+    '''
+    return self._text_size
+
+  @property
+  def character_set(self):
+    return "".join(self._charToIdx)
+
+  def getCacheStats(self):
+    '''
+    Counters of the interval cache, or None if the index has no cache
+    '''
+    return None if self._cache is None else self._cache.getStats()
+
+  def _backwardSearch(self,pattern:str):
+    '''
+    Find the interval [sp,ep) of sorted suffixes that start with the pattern
+    The search resumes from the interval of the longest cached suffix of the pattern,
+    or from the k-mer table interval of its last k characters if that covers more of it
     '''
     m = len(pattern)
-    sp = 0
-    ep = self._text_size
-    for i in range(m - 1,-1,-1):
+    end,sp,ep = m,0,self._text_size
+    if self._cache is not None and m:
+      cached = self._cache.getLongestSuffix(pattern)
+      if cached is not None:
+        end,(sp,ep) = cached
+        if not end:
+          return sp,ep
+
+    k = self._kmer_length
+    if k and k <= m and end > m - k:
+      try:
+        kmer = [self._charToIdx[c] for c in pattern[m - k:]]
+      except KeyError:
+        # current character is not in the character set
+        return 0,0
+      end = m - k
+      sp,ep = self._kmer_table.getInterval(kmer)
+
+    interval = self._extendBackward(pattern,end,sp,ep)
+    if self._cache is not None and m:
+      self._cache.put(pattern,interval)
+    return interval
+
+  def _extendBackward(self,pattern:str,end:int,sp:int,ep:int):
+    '''
+    Use backward matching on the BWT to extend the
+    interval [sp,ep) of the suffixes starting with pattern[end:] to those starting with the pattern
+    '''
+    for i in range(end - 1,-1,-1):
       try:
         currCharIdx = self._charToIdx[pattern[i]]
       except:
         # current character is not in the character set
-        return 0
-      start_rank = self._waveletTree.getRank(currCharIdx,sp)
-      end_rank = self._waveletTree.getRank(currCharIdx,ep)
+        return 0,0
+      start_rank,end_rank = self._waveletTree.getRankPair(currCharIdx,sp,ep)
 
       # If the current character in the pattern
-      # has a rank of zero at the end of the current bwt interval being scanned
+      # does not occur in the current bwt interval being scanned
       # we can be sure that the pattern has no matches in the string
-      if end_rank == 0:
-        return 0
+      if end_rank == start_rank:
+        return 0,0
 
       skip = self._skip_count[currCharIdx]
       sp = start_rank + skip
       ep = end_rank + skip
-    return ep - sp
\ No newline at end of file
+    return sp,ep
+
+  def findMatchCount(self,pattern:str):
+    '''
+    Number of occurences of the given pattern on the static text
+    '''
+    sp,ep = self._backwardSearch(pattern)
+    return ep - sp
+
+  def findMatchCounts(self,patterns:list[str],debug: bool = False):
+    '''
+    Batched findMatchCount: numpy array with the number of occurences of every pattern
+    The (sp,ep) intervals of all patterns move backward together. At every step the active
+    patterns are grouped by their current character and the ranks of a group are computed
+    with one vectorized query per wavelet level
+    '''
+    if np is None:
+      raise ImportError("numpy is required for batched pattern counting")
+    num_patterns = len(patterns)
+    lengths = np.fromiter((len(pattern) for pattern in patterns),dtype=np.int64,count=num_patterns)
+    max_length = int(lengths.max()) if num_patterns else 0
+
+    # codes[k,j] = index of the j-th character from the end of the k-th pattern
+    # Patterns with a character outside the character set have no matches
+    codes = np.zeros((num_patterns,max_length),dtype=np.int64)
+    alive = np.ones(num_patterns,dtype=bool)
+    for k,pattern in enumerate(patterns):
+      try:
+        codes[k,:len(pattern)] = [self._charToIdx[c] for c in reversed(pattern)]
+      except KeyError:
+        alive[k] = False
+
+    sp = np.zeros(num_patterns,dtype=np.int64)
+    ep = np.full(num_patterns,self._text_size,dtype=np.int64)
+    for j in range(max_length):
+      active = alive & (lengths > j)
+      if not active.any():
+        break
+      step_codes = codes[:,j]
+      for charIdx in np.unique(step_codes[active]).tolist():
+        group = np.flatnonzero(active & (step_codes == charIdx))
+        ranks = self._waveletTree.getRanks(charIdx,np.concatenate((sp[group],ep[group])))
+        skip = self._skip_count[charIdx]
+        sp[group] = ranks[:len(group)] + skip
+        ep[group] = ranks[len(group):] + skip
+      # An empty interval stays empty, so those patterns can be dropped
+      alive &= ep > sp
+    return np.where(alive,ep - sp,0)
+
+  def _lf(self,row:int):
+    '''
+    LF-mapping: row of the suffix that starts one text position before the suffix at row
+    '''
+    charIdx,rank = self._waveletTree.getCharAndRank(row)
+    return self._skip_count[charIdx] + rank
+
+  def _psi(self,row:int):
+    '''
+    Forward LF: the row of the suffix that follows the one of the given row in the text, SA[psi(i)] = SA[i] + 1
+    The first character of row i is the c with C[c] <= i, and psi(i) is the (i - C[c])-th c in the BWT
+    Characters that do not occur share C[c] with the next one, so the last c with C[c] <= i is taken
+    '''
+    charIdx = bisect_right(self._skip_count,row) - 1
+    return self._waveletTree.select(charIdx,row - self._skip_count[charIdx])
+
+  def _getSuffixArrayEntry(self,row:int):
+    '''
+    Recover SA[row] by walking LF steps until a sampled row is reached
+    Takes at most sa_sample_rate - 1 steps
+    '''
+    if self._sa_samples is None:
+      raise ValueError("This index has no suffix array samples. Rebuild it with a sa_sample_rate to locate matches")
+    steps = 0
+    while not self._sampled_rows.access(row):
+      row = self._lf(row)
+      steps += 1
+    return self._sa_samples[self._sampled_rows.rank1(row)] + steps
+
+  def extract(self,start:int,length:int):
+    '''
+    text[start:start + length], rebuilt from the index alone
+    Backward: starts at the row of the first sampled position p at or after start + length (the row of position 0
+    stands for the end of the text, whose BWT character is the last one) and walks LF steps back to start.
+    Every step reads BWT[row] = text[p - 1] and moves to the row of p - 1 in one descent of the rank structure,
+    so it costs length + isa_sample_rate - 1 steps at most
+    Forward: starts at the row of the last sampled position at or before start and walks psi steps up to start + length.
+    Every step reads the first character of the row from the skip counts. A psi step is a select, slower than an LF step,
+    so the forward walk is only taken when it is cheaper, for short extracts that start just after a sample
+    '''
+    if start < 0 or length < 0 or start + length > self._text_size:
+      raise ValueError(f"Cannot extract [{start},{start + length}). The text has {self._text_size} characters")
+    if self._isa_samples is None:
+      raise ValueError("This index has no inverse suffix array samples. Rebuild it to extract text")
+    if not length:
+      return ''
+    j = self._isa_sample_rate
+    sample = -(-(start + length) // j)
+    position = sample * j
+    if position >= self._text_size:
+      sample,position = 0,self._text_size
+    forward_position = start // j * j
+    if (start + length - forward_position) * PSI_STEP_COST < position - start:
+      codes = self._extractForward(forward_position,start + length)
+      del codes[:start - forward_position]
+    else:
+      row = self._isa_samples[sample]
+      codes = bytearray(position - start) if len(self._skip_count) <= 256 else [0] * (position - start)
+      for k in range(position - start - 1,-1,-1):
+        charIdx,rank = self._waveletTree.getCharAndRank(row)
+        codes[k] = charIdx
+        row = self._skip_count[charIdx] + rank
+      del codes[length:]
+    characters = self.character_set
+    if isinstance(codes,bytearray) and all(ord(c) < 256 for c in characters):
+      # Map the character indexes back to latin-1 bytes in one pass
+      return codes.translate(bytes(map(ord,characters)).ljust(256,b'\0')).decode('latin-1')
+    return ''.join(characters[c] for c in codes)
+
+  def _extractForward(self,start:int,end:int):
+    '''
+    Character indexes of text[start:end], walking psi steps from the row of start, a sampled position
+    '''
+    row = self._isa_samples[start // self._isa_sample_rate]
+    codes = bytearray(end - start) if len(self._skip_count) <= 256 else [0] * (end - start)
+    for k in range(end - start):
+      codes[k] = bisect_right(self._skip_count,row) - 1
+      if k < end - start - 1:
+        row = self._psi(row)
+    return codes
+
+  def iterLocate(self,pattern:str):
+    '''
+    Lazily yield the text positions where the pattern occurs, in suffix order
+    '''
+    sp,ep = self._backwardSearch(pattern)
+    for row in range(sp,ep):
+      yield self._getSuffixArrayEntry(row)
+
+  def locate(self,pattern:str,debug: bool = False):
+    '''
+    Sorted list of the text positions where the pattern occurs
+    '''
+    return sorted(self.iterLocate(pattern))
+
+  def _getMismatchBounds(self,pattern:str):
+    '''
+    bounds[i] = lower bound on the mismatches of any match of pattern[:i]
+    Backward search splits the pattern, from its end, into pieces that do not occur in the text
+    (the last piece may occur). Every piece that lies inside pattern[:i] needs its own mismatch
+    '''
+    m = len(pattern)
+    piece_starts = []
+    sp,ep = 0,self._text_size
+    for i in range(m - 1,-1,-1):
+      charIdx = self._charToIdx.get(pattern[i])
+      if charIdx is not None:
+        start_rank,end_rank = self._waveletTree.getRankPair(charIdx,sp,ep)
+        skip = self._skip_count[charIdx]
+        sp,ep = start_rank + skip,end_rank + skip
+      if charIdx is None or ep == sp:
+        piece_starts.append(i)
+        sp,ep = 0,self._text_size
+    # Every piece ends where the previous one started
+    piece_ends = ([m] + piece_starts)[:len(piece_starts)]
+    bounds = [0] * (m + 1)
+    for end in piece_ends:
+      for i in range(end,m + 1):
+        bounds[i] += 1
+    return bounds
+
+  def _approximateSearch(self,pattern:str,max_mismatches:int):
+    '''
+    Yield (sp,ep,mismatches) for every string within max_mismatches substitutions of the pattern
+    that occurs in the text, where [sp,ep) is its interval of sorted suffixes. The intervals are disjoint
+    Backtracks over the backward search: at every step the interval is extended by every character
+    that occurs in it, and a branch is dropped as soon as its mismatches plus the lower bound
+    for the rest of the pattern exceed max_mismatches
+    The smallest character (the text terminator) is never substituted in
+    '''
+    bounds = self._getMismatchBounds(pattern)
+    if bounds[len(pattern)] > max_mismatches:
+      return
+    character_size = len(self._skip_count)
+    codes = [self._charToIdx.get(c) for c in pattern]
+    stack = [(len(pattern),0,self._text_size,0)]
+    while stack:
+      end,sp,ep,mismatches = stack.pop()
+      if end == 0:
+        yield sp,ep,mismatches
+        continue
+      i = end - 1
+      patternIdx = codes[i]
+      if mismatches == max_mismatches:
+        # No mismatches left: only the pattern character can extend the match
+        if patternIdx is None:
+          continue
+        start_rank,end_rank = self._waveletTree.getRankPair(patternIdx,sp,ep)
+        if end_rank > start_rank:
+          skip = self._skip_count[patternIdx]
+          stack.append((i,start_rank + skip,end_rank + skip,mismatches))
+        continue
+      start_ranks = self._waveletTree.getRankAll(sp)
+      end_ranks = self._waveletTree.getRankAll(ep)
+      for charIdx in range(1,character_size):
+        if end_ranks[charIdx] == start_ranks[charIdx]:
+          continue
+        next_mismatches = mismatches + (charIdx != patternIdx)
+        if next_mismatches + bounds[i] > max_mismatches:
+          continue
+        skip = self._skip_count[charIdx]
+        stack.append((i,start_ranks[charIdx] + skip,end_ranks[charIdx] + skip,next_mismatches))
+
+  def findApproximateMatchCount(self,pattern:str,max_mismatches:int = 1):
+    '''
+    Number of text positions where the pattern occurs with at most max_mismatches substituted characters
+    '''
+    return sum(ep - sp for sp,ep,_ in self._approximateSearch(pattern,max_mismatches))
+
+  def iterLocateApproximate(self,pattern:str,max_mismatches:int = 1):
+    '''
+    Lazily yield (text position, mismatches) for every occurrence of the pattern
+    with at most max_mismatches substituted characters
+    '''
+    for sp,ep,mismatches in self._approximateSearch(pattern,max_mismatches):
+      for row in range(sp,ep):
+        yield self._getSuffixArrayEntry(row),mismatches
+
+  def locateApproximate(self,pattern:str,max_mismatches:int = 1):
+    '''
+    Sorted list of (text position, mismatches) of the occurrences of the pattern
+    with at most max_mismatches substituted characters
+    '''
+    return sorted(self.iterLocateApproximate(pattern,max_mismatches))
@@ -0,0 +1,352 @@
+import glob
+import json
+import os
+from concurrent.futures import Future, ProcessPoolExecutor
+from threading import Condition, RLock
+from FMIndex import FMIndex
+
+MANIFEST_NAME = 'manifest.json'
+
+def _findAll(text: str, pattern: str):
+    position = text.find(pattern)
+    while position != -1:
+        yield position
+        position = text.find(pattern, position + 1)
+
+def _countPart(part: tuple, pattern: str) -> int:
+    '''
+    Matches that lie entirely inside the prefix of a segment belong to the segments before it
+    '''
+    segment, searcher = part
+    if isinstance(searcher, FMIndex):
+        count = searcher.findMatchCount(pattern)
+    else:
+        count = sum(1 for _ in _findAll(searcher, pattern))
+    return count - sum(1 for _ in _findAll(segment["prefix"], pattern))
+
+def _locatePart(part: tuple, pattern: str) -> list[int]:
+    '''
+    Corpus positions of the matches of a segment that end past its prefix
+    '''
+    segment, searcher = part
+    positions = searcher.iterLocate(pattern) if isinstance(searcher, FMIndex) else _findAll(searcher, pattern)
+    first = len(segment["prefix"]) - len(pattern) + 1
+    start = segment["offset"] - len(segment["prefix"])
+    return [start + position for position in positions if position >= first]
+
+def _buildSegmentFile(path: str, text: str, meta_char: str, index_options: dict):
+    character_set = ''.join(sorted(set(text).union(meta_char)))
+    tmp_path = f'{path}.{os.getpid()}.tmp'
+    FMIndex(text + meta_char, character_set, **index_options).save(tmp_path)
+    os.replace(tmp_path, path)
+
+def _mergeSegmentFiles(path: str, prefix: str, spans: list[tuple], meta_char: str, index_options: dict):
+    '''
+    Extract the text of consecutive segments from their indexes and index it as one segment
+    :param spans: (path, start, length) of the text of every segment, after its prefix
+    '''
+    texts = [prefix]
+    for segment_path, start, length in spans:
+        texts.append(FMIndex.load(segment_path).extract(start, length))
+    _buildSegmentFile(path, ''.join(texts), meta_char, index_options)
+
+class IncrementalIndex:
+    '''
+    Counts and locates patterns over a corpus that grows by appending text, without rebuilding it
+    Log-structured: appended text is kept in a memtable that is searched by scanning. Once it holds flush_size
+    characters, it is frozen and indexed as a new segment in the background. Segments of the same tier are merged,
+    fanout at a time, into one segment of the next tier, by extracting their text and indexing it again.
+    A character is indexed O(log_fanout(n / flush_size)) times, and a query searches at most fanout - 1 segments
+    per tier plus the memtable. Every segment also indexes the overlap characters before it, so patterns of up to
+    overlap + 1 characters are found across segment boundaries. A match is reported by the segment where it ends
+    Builds and merges run in worker processes. A finished segment is swapped in under a lock, and queries run
+    on a snapshot of the segments taken when they start, so they never wait for a merge
+    Segments are saved to a directory with a JSON manifest, rewritten after every swap. Text that has not been
+    indexed yet is only kept in memory: close() flushes it. One process at a time may append to a directory
+    Public methods:
+      append(text), flush() -> add text to the end of the corpus, index the memtable now
+      count(pattern), locate(pattern) -> results over the whole corpus, the memtable included
+      wait() -> block until every build and merge is done
+    '''
+    def __init__(self, directory: str, overlap: int = 1000, flush_size: int = 1 << 20, fanout: int = 4, workers: int = 1, meta_char: str = '$', cache_size: int = 0, **index_options) -> None:
+        '''
+        :param str directory: directory of the segments. It is created, or reopened if it has a manifest
+        :param int overlap: characters before every segment that are indexed with it. Patterns of up to
+          overlap + 1 characters are found across segment boundaries. Read from the manifest of an existing directory
+        :param int flush_size: characters of the memtable that are indexed as a new segment
+        :param int fanout: segments of one tier that are merged into one segment of the next tier
+        :param int workers: number of build processes. 0 builds in the calling thread
+        :param str meta_char: terminator of every segment, it must sort before every character of the corpus.
+          Read from the manifest of an existing directory
+        :param int cache_size: size of the interval cache of every segment
+        :param index_options: passed on to the FMIndex constructor
+        '''
+        if overlap < 0:
+            raise ValueError("Overlap cannot be negative")
+        if flush_size < 1:
+            raise ValueError("Flush size must be at least 1")
+        if fanout < 2:
+            raise ValueError("Fanout must be at least 2")
+        if "isa_sample_rate" in index_options and index_options["isa_sample_rate"] is None:
+            raise ValueError("Segments are merged by extracting their text, so isa_sample_rate cannot be None")
+        self._directory = directory
+        self._flush_size = flush_size
+        self._fanout = fanout
+        self._cache_size = cache_size
+        self._index_options = index_options
+        self._lock = RLock()
+        self._idle = Condition(self._lock)
+        self._pending_jobs = 0
+        self._merging = set()
+        self._errors = []
+
+        os.makedirs(directory, exist_ok=True)
+        manifest_path = os.path.join(directory, MANIFEST_NAME)
+        if os.path.isfile(manifest_path):
+            with open(manifest_path) as f:
+                manifest = json.load(f)
+            overlap = manifest["overlap"]
+            meta_char = manifest["meta_char"]
+            segments = manifest["segments"]
+            self._next_id = manifest["next_id"]
+        else:
+            segments = []
+            self._next_id = 0
+        self._overlap = overlap
+        self._meta_char = meta_char
+        # Immutable list of (segment, FMIndex) for indexed segments, or (segment, prefix + text) for frozen memtables
+        self._parts = [(segment, self._loadSegment(segment)) for segment in segments]
+        # Files of segments that are not in the manifest were left by an interrupted build or merge
+        listed = {os.path.join(directory, segment["path"]) for segment in segments}
+        for path in glob.glob(os.path.join(directory, 'segment-*.fmi*')):
+            if path not in listed:
+                os.remove(path)
+
+        self._memtable = []
+        self._memtable_size = 0
+        self._memtable_offset = 0
+        self._tail = ''
+        if segments:
+            last = segments[-1]
+            self._memtable_offset = last["offset"] + last["length"]
+            size = len(last["prefix"]) + last["length"]
+            self._tail = self._parts[-1][1].extract(size - min(overlap, size), min(overlap, size))
+        self._executor = ProcessPoolExecutor(max_workers=workers) if workers else None
+        self._writeManifest()
+        with self._lock:
+            self._scheduleMerges()
+
+    def _loadSegment(self, segment: dict) -> FMIndex:
+        return FMIndex.load(os.path.join(self._directory, segment["path"]), cache_size=self._cache_size)
+
+    def _newSegment(self, offset: int, length: int, prefix: str, tier: int) -> dict:
+        segment = {"id": self._next_id, "path": f'segment-{self._next_id:06d}.fmi', "offset": offset, "length": length, "prefix": prefix, "tier": tier}
+        self._next_id += 1
+        return segment
+
+    def _writeManifest(self):
+        '''
+        List the indexed segments up to the first one that is still being built, so the manifest has no gaps
+        '''
+        segments = []
+        for segment, searcher in self._parts:
+            if not isinstance(searcher, FMIndex):
+                break
+            segments.append(segment)
+        manifest = {
+            "overlap": self._overlap,
+            "meta_char": self._meta_char,
+            "next_id": self._next_id,
+            "segments": segments,
+        }
+        tmp_path = os.path.join(self._directory, f'{MANIFEST_NAME}.{os.getpid()}.tmp')
+        with open(tmp_path, 'w') as f:
+            json.dump(manifest, f)
+        os.replace(tmp_path, os.path.join(self._directory, MANIFEST_NAME))
+
+    def _submit(self, fn, args: tuple, replaced: list[dict], segment: dict):
+        '''
+        Run a build in the background. When it is done, segment replaces the replaced segments
+        Called with the lock held
+        '''
+        self._pending_jobs += 1
+        if self._executor is not None:
+            future = self._executor.submit(fn, *args)
+        else:
+            future = Future()
+            try:
+                fn(*args)
+                future.set_result(None)
+            except Exception as e:
+                future.set_exception(e)
+        future.add_done_callback(lambda future: self._finishJob(future, replaced, segment))
+
+    def _finishJob(self, future: Future, replaced: list[dict], segment: dict):
+        obsolete = []
+        with self._lock:
+            self._pending_jobs -= 1
+            ids = {old["id"] for old in replaced}
+            self._merging.difference_update(ids)
+            error = future.exception()
+            if error is not None:
+                # The replaced segments stay searchable as they are
+                self._errors.append(error)
+            else:
+                part = (segment, self._loadSegment(segment))
+                parts = []
+                for old in self._parts:
+                    if old[0]["id"] not in ids:
+                        parts.append(old)
+                    elif old[0]["id"] == replaced[0]["id"]:
+                        parts.append(part)
+                self._parts = parts
+                self._writeManifest()
+                obsolete = [os.path.join(self._directory, old["path"]) for old in replaced if old["id"] != segment["id"]]
+                self._scheduleMerges()
+            self._idle.notify_all()
+        # Queries that took their snapshot before the swap keep their mappings of the removed files
+        for path in obsolete:
+            os.remove(path)
+
+    def _scheduleMerges(self):
+        '''
+        Merge the first fanout segments of every run of indexed segments of the same tier
+        Builds and merges finish out of order. A segment that lands behind a higher tier is never merged again,
+        since only adjacent segments merge, so tiers are kept non-increasing in corpus order: a segment being
+        built counts as tier 0, one being merged as the tier it is merged into, and a merge past them must not
+        produce a higher tier. Once every job is done, there are at most fanout - 1 segments per tier
+        Called with the lock held
+        '''
+        ceiling = None # lowest tier of the segments being built or merged so far
+        run = []
+        for segment, searcher in self._parts:
+            if not isinstance(searcher, FMIndex) or segment["id"] in self._merging:
+                tier = segment["tier"] + (segment["id"] in self._merging)
+                ceiling = tier if ceiling is None else min(ceiling, tier)
+                run = []
+                continue
+            if run and run[0]["tier"] != segment["tier"]:
+                run = []
+            run.append(segment)
+            if len(run) == self._fanout:
+                if ceiling is None or run[0]["tier"] < ceiling:
+                    self._merge(run)
+                run = []
+
+    def _merge(self, run: list[dict]):
+        self._merging.update(segment["id"] for segment in run)
+        segment = self._newSegment(run[0]["offset"], sum(old["length"] for old in run), run[0]["prefix"], run[0]["tier"] + 1)
+        spans = [(os.path.join(self._directory, old["path"]), len(old["prefix"]), old["length"]) for old in run]
+        args = (os.path.join(self._directory, segment["path"]), run[0]["prefix"], spans, self._meta_char, self._index_options)
+        self._submit(_mergeSegmentFiles, args, run, segment)
+
+    @property
+    def text_size(self) -> int:
+        '''
+        Length of the corpus, not counting terminators
+        '''
+        return self._memtable_offset + self._memtable_size
+
+    @property
+    def segments(self) -> list[dict]:
+        '''
+        Offset, length, tier and state ('indexed', 'merging' or 'building') of every segment, in corpus order
+        '''
+        with self._lock:
+            return [{
+                "offset": segment["offset"],
+                "length": segment["length"],
+                "tier": segment["tier"],
+                "state": 'building' if not isinstance(searcher, FMIndex) else 'merging' if segment["id"] in self._merging else 'indexed',
+            } for segment, searcher in self._parts]
+
+    def append(self, text: str):
+        '''
+        Add text to the end of the corpus. It can be searched as soon as this returns
+        '''
+        if not text:
+            return
+        if min(text) <= self._meta_char:
+            raise ValueError(f"Meta character {self._meta_char!r} must sort before every character of the text")
+        with self._lock:
+            self._memtable.append(text)
+            self._memtable_size += len(text)
+            if self._memtable_size >= self._flush_size:
+                self.flush()
+
+    def flush(self):
+        '''
+        Freeze the memtable and index it as a new segment in the background
+        '''
+        with self._lock:
+            if not self._memtable_size:
+                return
+            text = ''.join(self._memtable)
+            segment = self._newSegment(self._memtable_offset, len(text), self._tail, 0)
+            self._parts = self._parts + [(segment, self._tail + text)]
+            self._memtable = []
+            self._memtable_size = 0
+            self._memtable_offset += len(text)
+            self._tail = (self._tail + text)[-self._overlap:] if self._overlap else ''
+            args = (os.path.join(self._directory, segment["path"]), segment["prefix"] + text, self._meta_char, self._index_options)
+            self._submit(_buildSegmentFile, args, [segment], segment)
+
+    def _snapshot(self) -> list[tuple]:
+        '''
+        The segments and the memtable as they are now. Later swaps and appends do not change it
+        '''
+        with self._lock:
+            if not self._memtable_size:
+                return self._parts
+            # Keep the memtable joined, so repeated queries do not join it again
+            self._memtable = [''.join(self._memtable)]
+            memtable = {"offset": self._memtable_offset, "length": self._memtable_size, "prefix": self._tail}
+            return self._parts + [(memtable, self._tail + self._memtable[0])]
+
+    def _checkPattern(self, pattern: str):
+        if not pattern:
+            raise ValueError("Pattern cannot be empty")
+        if len(pattern) > self._overlap + 1:
+            raise ValueError(f"Patterns can be at most {self._overlap + 1} characters long, the segment overlap plus one")
+        if self._meta_char in pattern:
+            raise ValueError(f"Pattern cannot contain the meta character {self._meta_char!r}")
+
+    def count(self, pattern: str) -> int:
+        '''
+        Number of occurrences of the pattern in the corpus
+        '''
+        self._checkPattern(pattern)
+        return sum(_countPart(part, pattern) for part in self._snapshot())
+
+    def locate(self, pattern: str) -> list[int]:
+        '''
+        Sorted list of the corpus positions where the pattern occurs
+        '''
+        self._checkPattern(pattern)
+        positions = []
+        for part in self._snapshot():
+            positions.extend(_locatePart(part, pattern))
+        return sorted(positions)
+
+    def wait(self, timeout: float = None):
+        '''
+        Block until every build and merge is done, including the merges they lead to
+        Raises the first error of a failed build, if any
+        '''
+        with self._idle:
+            if not self._idle.wait_for(lambda: not self._pending_jobs, timeout):
+                raise TimeoutError("Builds and merges are still running")
+            if self._errors:
+                raise self._errors[0]
+
+    def close(self):
+        '''
+        Index the memtable and wait for every build and merge, so the directory holds the whole corpus
+        '''
+        try:
+            self.flush()
+            self.wait()
+        finally:
+            # The worker processes are stopped even when a build or merge failed
+            if self._executor is not None:
+                self._executor.shutdown(wait=True)
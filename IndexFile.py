@@ -0,0 +1,89 @@
+import json
+import mmap
+import struct
+import sys
+from array import array
+
+INDEX_MAGIC = b'FMIX'
+INDEX_FORMAT_VERSION = 1
+
+# magic, format version, length of the JSON header in bytes
+_PREAMBLE = struct.Struct('<4sIQ')
+_ALIGNMENT = 8
+
+def _padding(offset: int) -> int:
+  return -offset % _ALIGNMENT
+
+class IndexWriter:
+    '''
+    Collects the typed buffers of an index and writes them to a single file
+    File layout (version 1):
+      preamble: magic, format version, header length
+      header:   JSON document with the index state and a table of buffers
+      data:     the raw buffers, each aligned to 8 bytes, in native byte order
+    Structures call addBuffer() while building their state and store the returned reference in it
+    '''
+    def __init__(self) -> None:
+      self._buffers = []
+
+    def addBuffer(self,buffer: array) -> int:
+      '''
+      Register an array to be written and return its reference in the buffer table
+      Typed memoryviews, such as the buffers of an IndexReader, are accepted too, so a loaded index can be saved again
+      '''
+      self._buffers.append(buffer)
+      return len(self._buffers) - 1
+
+    def write(self,path: str,state: dict) -> None:
+      table = []
+      offset = 0
+      for buffer in self._buffers:
+        typecode = buffer.format if isinstance(buffer,memoryview) else buffer.typecode
+        table.append({"offset": offset, "typecode": typecode, "length": len(buffer)})
+        offset += len(buffer) * buffer.itemsize
+        offset += _padding(offset)
+      header = json.dumps({"byteorder": sys.byteorder, "buffers": table, "state": state}).encode('utf-8')
+      header += b' ' * _padding(_PREAMBLE.size + len(header))
+
+      with open(path,'wb') as f:
+        f.write(_PREAMBLE.pack(INDEX_MAGIC,INDEX_FORMAT_VERSION,len(header)))
+        f.write(header)
+        for buffer in self._buffers:
+          data = buffer.tobytes()
+          f.write(data)
+          f.write(b'\0' * _padding(len(data)))
+
+class IndexReader:
+    '''
+    Memory-maps an index file written by IndexWriter
+    Buffers are returned as memoryviews over the shared mapping, so nothing is copied
+    and processes that load the same file share its pages
+    '''
+    def __init__(self,path: str) -> None:
+      with open(path,'rb') as f:
+        self._mmap = mmap.mmap(f.fileno(),0,access=mmap.ACCESS_READ)
+      magic,version,header_size = _PREAMBLE.unpack_from(self._mmap,0)
+      if magic != INDEX_MAGIC:
+        raise ValueError(f"{path} is not an FM Index file")
+      if version != INDEX_FORMAT_VERSION:
+        raise ValueError(f"Unsupported index format version {version}. Expected version {INDEX_FORMAT_VERSION}")
+      header = json.loads(self._mmap[_PREAMBLE.size:_PREAMBLE.size + header_size])
+      if header["byteorder"] != sys.byteorder:
+        raise ValueError(f"Index was written on a {header['byteorder']}-endian machine")
+      self._data_offset = _PREAMBLE.size + header_size
+      self._buffers = header["buffers"]
+      self._state = header["state"]
+      self._view = memoryview(self._mmap)
+
+    @property
+    def state(self) -> dict:
+      return self._state
+
+    def getBuffer(self,ref: int) -> memoryview:
+      '''
+      Typed, read-only view of the buffer registered under ref
+      '''
+      entry = self._buffers[ref]
+      start = self._data_offset + entry["offset"]
+      size = entry["length"] * array(entry["typecode"]).itemsize
+      return self._view[start:start + size].cast(entry["typecode"])
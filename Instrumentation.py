@@ -0,0 +1,399 @@
+'''
+Runtime-switchable instrumentation of builds and queries
+Nothing is measured until enable() is called: it replaces the instrumented methods on their classes
+with timing wrappers, and disable() puts the original methods back, so a disabled index runs the
+exact same code as an uninstrumented one
+Recorded metrics:
+  operations: latency histogram of every public query method (count, mean, p50, p99, max)
+  rank: per rank query method, the number of queries, the bitvector ranks they made (one per visited
+    wavelet node or matrix level) and the bits they scanned past the rank directories. A rank query made
+    by another one is counted as part of the outer query only
+  build: latency histogram of every build phase, with the duration of the last build
+Example use:
+  Instrumentation.enable()
+  index = FMIndex(text,character_set)
+  index.findMatchCount('ACG')
+  Instrumentation.getMetrics()
+'''
+from functools import wraps
+from threading import Lock, local
+from time import perf_counter_ns
+import FMIndex as FMIndexModule
+import SuffixArray
+from BitVector import BIT_VECTOR_TYPES
+from constants import BIT_PACK_SIZE, RRR_BLOCK_SIZE
+from FMIndex import FMIndex
+from KmerTable import KmerTable
+from RunLengthBWT import RunLengthBWT
+from WaveletMatrix import WaveletMatrix
+from WaveletTree import WaveletTree
+
+# (class, method name) pairs whose calls are timed as query operations
+OPERATIONS = [
+  (FMIndex,'findMatchCount'),
+  (FMIndex,'findMatchCounts'),
+  (FMIndex,'locate'),
+  (FMIndex,'findApproximateMatchCount'),
+  (FMIndex,'locateApproximate'),
+]
+# Rank queries are timed, and also count the bitvector ranks they make
+RANK_QUERIES = [
+  (WaveletTree,'getRank'),
+  (WaveletTree,'getRankPair'),
+  (WaveletTree,'getRankAll'),
+  (WaveletTree,'getCharAndRank'),
+  (WaveletMatrix,'getRank'),
+  (WaveletMatrix,'getRankPair'),
+  (WaveletMatrix,'getRankAll'),
+  (WaveletMatrix,'getCharAndRank'),
+  (RunLengthBWT,'getRank'),
+  (RunLengthBWT,'getRankPair'),
+  (RunLengthBWT,'getRankAll'),
+  (RunLengthBWT,'getCharAndRank'),
+]
+# WaveletTree query -> its copy that counts the ranks of the flat layout
+FLAT_QUERIES = {
+  'getRank': WaveletTree._getRankCounted,
+  'getRankPair': WaveletTree._getRankPairCounted,
+  'getRankAll': WaveletTree._getRankAllCounted,
+  'getCharAndRank': WaveletTree._getCharAndRankCounted,
+}
+# Bitvector type -> bits a rank scans after its directory lookups: the partial word of a plain
+# BitVector, the decoded block of an RRRBitVector. Run-length ranks binary search instead (i % 1 == 0)
+SCANNED_BITS = {
+  'plain': BIT_PACK_SIZE,
+  'rrr': RRR_BLOCK_SIZE,
+  'runlength': 1,
+}
+# Build phase -> (class or module, attribute) that runs it
+BUILD_PHASES = {
+  'total': (FMIndex,'__init__'),
+  'load': (FMIndex,'load'),
+  'encode': (FMIndexModule,'encodeText'),
+  'bwt': (FMIndex,'bwtFromSuffixArray'),
+  'sa_sampling': (FMIndex,'_sampleSuffixArray'),
+  'kmer_table': (KmerTable,'__init__'),
+  'rank_structure_tree': (WaveletTree,'__init__'),
+  'rank_structure_matrix': (WaveletMatrix,'__init__'),
+  'rank_structure_runlength': (RunLengthBWT,'__init__'),
+}
+
+class LatencyHistogram:
+    '''
+    Log-scale histogram of durations in nanoseconds
+    Every power of two is split into 2^SUB_BUCKET_BITS buckets, so a percentile is
+    reported as the upper bound of its bucket, at most 25% above the true value
+    '''
+    SUB_BUCKET_BITS = 2
+
+    def __init__(self) -> None:
+      self._buckets = {}
+      self._count = 0
+      self._total_ns = 0
+      self._max_ns = 0
+      self._last_ns = 0
+
+    @property
+    def count(self) -> int:
+      return self._count
+
+    def record(self,ns: int):
+      shift = max(ns.bit_length() - self.SUB_BUCKET_BITS - 1,0)
+      key = (shift,ns >> shift)
+      self._buckets[key] = self._buckets.get(key,0) + 1
+      self._count += 1
+      self._total_ns += ns
+      self._last_ns = ns
+      if ns > self._max_ns:
+        self._max_ns = ns
+
+    def percentile(self,q: float) -> int:
+      '''
+      Upper bound of the bucket holding the q-th quantile (0 < q <= 1)
+      '''
+      if not self._count:
+        return 0
+      target = q * self._count
+      seen = 0
+      for shift,top in sorted(self._buckets):
+        seen += self._buckets[(shift,top)]
+        if seen >= target:
+          return min((top + 1) << shift,self._max_ns)
+      return self._max_ns
+
+    def clear(self):
+      self.__init__()
+
+    def merge(self,other: 'LatencyHistogram'):
+      for key,count in other._buckets.items():
+        self._buckets[key] = self._buckets.get(key,0) + count
+      self._count += other._count
+      self._total_ns += other._total_ns
+      self._max_ns = max(self._max_ns,other._max_ns)
+      self._last_ns = other._last_ns or self._last_ns
+
+    def getState(self) -> dict:
+      '''
+      Plain, picklable copy of the histogram, so that histograms of several processes can be merged
+      '''
+      return {
+        "buckets": [[shift,top,count] for (shift,top),count in self._buckets.items()],
+        "count": self._count,
+        "total_ns": self._total_ns,
+        "max_ns": self._max_ns,
+        "last_ns": self._last_ns,
+      }
+
+    @classmethod
+    def fromState(cls,state: dict):
+      histogram = cls()
+      histogram._buckets = {(shift,top): count for shift,top,count in state["buckets"]}
+      histogram._count = state["count"]
+      histogram._total_ns = state["total_ns"]
+      histogram._max_ns = state["max_ns"]
+      histogram._last_ns = state["last_ns"]
+      return histogram
+
+    def summarize(self) -> dict:
+      return {
+        "count": self._count,
+        "mean_ns": self._total_ns / self._count if self._count else 0,
+        "p50_ns": self.percentile(0.5),
+        "p99_ns": self.percentile(0.99),
+        "max_ns": self._max_ns,
+        "last_ns": self._last_ns,
+      }
+
+_lock = Lock()
+_enabled = False
+_originals = [] # (owner, attribute, original value) of every patched attribute
+_operations = {}
+_build_phases = {}
+# Rank query name -> [queries, bitvector ranks, bits popcounted]
+_rank_stats = {}
+
+class _Probes(local):
+    '''
+    Probe counters of the rank query running in the current thread, so that concurrent queries of a
+    threaded server do not mix their counts. cells holds: bitvector ranks, scanned bits, how many
+    counted rank1Pair calls are running (rank1 calls made by rank1Pair are not counted again), and how many
+    rank queries are running (a rank query made by another one, such as the head ranks of RunLengthBWT,
+    is part of the outer query). Plain list cells are the cheapest counters to bump
+    '''
+    def __init__(self) -> None:
+      self.cells = [0,0,0,0]
+
+_probes = _Probes()
+
+def _histogram(histograms: dict,name: str) -> LatencyHistogram:
+    with _lock:
+      if name not in histograms:
+        histograms[name] = LatencyHistogram()
+      return histograms[name]
+
+def _record(histogram: LatencyHistogram,ns: int):
+    with _lock:
+      histogram.record(ns)
+
+def _timed(func,histogram: LatencyHistogram):
+    @wraps(func)
+    def wrapper(*args,**kwargs):
+      t1 = perf_counter_ns()
+      try:
+        return func(*args,**kwargs)
+      finally:
+        _record(histogram,perf_counter_ns() - t1)
+    return wrapper
+
+def _rankTimed(func,histogram: LatencyHistogram,stats: list):
+    @wraps(func)
+    def wrapper(*args,**kwargs):
+      cells = _probes.cells
+      if cells[3]:
+        return func(*args,**kwargs)
+      probes,bits,_,_ = cells
+      cells[3] += 1
+      t1 = perf_counter_ns()
+      try:
+        return func(*args,**kwargs)
+      finally:
+        ns = perf_counter_ns() - t1
+        cells[3] -= 1
+        with _lock:
+          histogram.record(ns)
+          stats[0] += 1
+          stats[1] += cells[0] - probes
+          stats[2] += cells[1] - bits
+    return wrapper
+
+def _countedRank1(rank1,scanned_bits: int):
+    @wraps(rank1)
+    def wrapper(self,i):
+      cells = _probes.cells
+      if not cells[2]:
+        cells[0] += 1
+        cells[1] += i % scanned_bits
+      return rank1(self,i)
+    return wrapper
+
+def _countedRank1Pair(rank1Pair,scanned_bits: int):
+    @wraps(rank1Pair)
+    def wrapper(self,i,j):
+      cells = _probes.cells
+      cells[0] += 1
+      cells[1] += i % scanned_bits + j % scanned_bits
+      cells[2] += 1
+      try:
+        return rank1Pair(self,i,j)
+      finally:
+        cells[2] -= 1
+    return wrapper
+
+def _flatCounted(query,counted):
+    '''
+    Run the counted copy of a flat WaveletTree query, or the query itself on trees without a flat layout
+    '''
+    @wraps(query)
+    def wrapper(self,*args):
+      if self._flat is None or not self.flat_queries:
+        return query(self,*args)
+      return counted(self,*args,_probes.cells)
+    return wrapper
+
+def _patch(owner,attribute: str,wrap):
+    '''
+    Replace owner.attribute with wrap(original), keeping static and class methods what they were
+    '''
+    original = vars(owner)[attribute]
+    if isinstance(original,(staticmethod,classmethod)):
+      patched = type(original)(wrap(original.__func__))
+    else:
+      patched = wrap(original)
+    setattr(owner,attribute,patched)
+    _originals.append((owner,attribute,original))
+
+def enable():
+    '''
+    Start recording metrics in this process. Metrics recorded earlier are kept
+    '''
+    global _enabled
+    if _enabled:
+      return
+    for owner,attribute in OPERATIONS:
+      histogram = _histogram(_operations,f'{owner.__name__}.{attribute}')
+      _patch(owner,attribute,lambda func,histogram=histogram: _timed(func,histogram))
+    # The flat WaveletTree queries rank in place, without the bitvector methods that count the ranks: their counted
+    # copies run instead. Patched before the timers, so the timers wrap them
+    for attribute,counted in FLAT_QUERIES.items():
+      _patch(WaveletTree,attribute,lambda func,counted=counted: _flatCounted(func,counted))
+    for owner,attribute in RANK_QUERIES:
+      name = f'{owner.__name__}.{attribute}'
+      histogram = _histogram(_operations,name)
+      stats = _rank_stats.setdefault(name,[0,0,0])
+      _patch(owner,attribute,lambda func,histogram=histogram,stats=stats: _rankTimed(func,histogram,stats))
+    for name,bit_vector_type in BIT_VECTOR_TYPES.items():
+      scanned_bits = SCANNED_BITS[name]
+      _patch(bit_vector_type,'rank1',lambda func,scanned_bits=scanned_bits: _countedRank1(func,scanned_bits))
+      _patch(bit_vector_type,'rank1Pair',lambda func,scanned_bits=scanned_bits: _countedRank1Pair(func,scanned_bits))
+
+    for phase,(owner,attribute) in BUILD_PHASES.items():
+      histogram = _histogram(_build_phases,phase)
+      _patch(owner,attribute,lambda func,histogram=histogram: _timed(func,histogram))
+    # get_suffix_array_builder hands out the registered functions, so the registry is patched instead
+    histogram = _histogram(_build_phases,'suffix_array')
+    for name in list(SuffixArray.SUFFIX_ARRAY_BUILDERS):
+      _patchBuilder(name,histogram)
+    _enabled = True
+
+def _patchBuilder(name: str,histogram: LatencyHistogram):
+    original = SuffixArray.SUFFIX_ARRAY_BUILDERS[name]
+    SuffixArray.SUFFIX_ARRAY_BUILDERS[name] = _timed(original,histogram)
+    _originals.append((SuffixArray.SUFFIX_ARRAY_BUILDERS,name,original))
+
+def disable():
+    '''
+    Stop recording and restore the original methods. Recorded metrics are kept until reset()
+    '''
+    global _enabled
+    while _originals:
+      owner,attribute,original = _originals.pop()
+      if isinstance(owner,dict):
+        owner[attribute] = original
+      else:
+        setattr(owner,attribute,original)
+    _enabled = False
+
+def isEnabled() -> bool:
+    return _enabled
+
+def reset():
+    '''
+    Clear every recorded metric. Installed wrappers keep recording into the cleared histograms
+    '''
+    with _lock:
+      for histograms in (_operations,_build_phases):
+        for histogram in histograms.values():
+          histogram.clear()
+      for stats in _rank_stats.values():
+        stats[:] = [0,0,0]
+
+def getState() -> dict:
+    '''
+    Picklable snapshot of the raw metrics of this process, see mergeStates()
+    '''
+    with _lock:
+      return {
+        "enabled": _enabled,
+        "operations": {name: histogram.getState() for name,histogram in _operations.items()},
+        "build": {name: histogram.getState() for name,histogram in _build_phases.items()},
+        "rank": {name: list(stats) for name,stats in _rank_stats.items()},
+      }
+
+def mergeStates(states: list[dict]) -> dict:
+    '''
+    Combine the snapshots of several processes into one
+    '''
+    merged = {"enabled": any(state["enabled"] for state in states), "operations": {}, "build": {}, "rank": {}}
+    for state in states:
+      for section in ("operations","build"):
+        for name,histogram_state in state[section].items():
+          histogram = LatencyHistogram.fromState(histogram_state)
+          if name in merged[section]:
+            merged[section][name].merge(histogram)
+          else:
+            merged[section][name] = histogram
+      for name,stats in state["rank"].items():
+        total = merged["rank"].setdefault(name,[0,0,0])
+        for k,value in enumerate(stats):
+          total[k] += value
+    for section in ("operations","build"):
+      merged[section] = {name: histogram.getState() for name,histogram in merged[section].items()}
+    return merged
+
+def summarize(state: dict) -> dict:
+    '''
+    Readable metrics from a snapshot: percentiles of the histograms and per-query rank costs
+    Operations and phases that never ran are left out
+    '''
+    rank = {}
+    for name,(queries,probes,bits) in state["rank"].items():
+      if queries:
+        rank[name] = {
+          "queries": queries,
+          "nodes_visited": probes,
+          "bits_scanned": bits,
+          "nodes_per_query": probes / queries,
+          "bits_per_query": bits / queries,
+        }
+    return {
+      "enabled": state["enabled"],
+      "operations": {name: LatencyHistogram.fromState(s).summarize() for name,s in state["operations"].items() if s["count"]},
+      "rank": rank,
+      "build": {name: LatencyHistogram.fromState(s).summarize() for name,s in state["build"].items() if s["count"]},
+    }
+
+def getMetrics() -> dict:
+    '''
+    Readable metrics of this process
+    '''
+    return summarize(getState())
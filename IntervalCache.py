@@ -0,0 +1,73 @@
+from collections import OrderedDict
+from threading import Lock
+
+class IntervalCache:
+    '''
+    Bounded LRU cache from patterns to their (sp,ep) interval of sorted suffixes
+    Backward search matches a pattern from its last character, so the interval of any cached
+    suffix of a new pattern is a valid point to resume the search from
+    All operations hold a lock, so one cache can be shared by the threads of a server
+    Public methods:
+      getLongestSuffix(pattern) -> (start,(sp,ep)) for the longest cached pattern[start:], or None
+      put(pattern,interval)
+      getStats() -> hit, miss and eviction counters
+    '''
+    def __init__(self,capacity: int) -> None:
+      if capacity < 1:
+        raise ValueError("Cache capacity must be at least 1")
+      self._capacity = capacity
+      self._intervals = OrderedDict()
+      self._lock = Lock()
+      self._hits = 0
+      self._partial_hits = 0
+      self._misses = 0
+      self._evictions = 0
+
+    def __len__(self) -> int:
+      return len(self._intervals)
+
+    @property
+    def capacity(self) -> int:
+      return self._capacity
+
+    def getLongestSuffix(self,pattern: str):
+      '''
+      Find the longest suffix of the pattern that is in the cache
+      A hit on the whole pattern counts as a hit, a hit on a shorter suffix as a partial hit
+      '''
+      with self._lock:
+        for start in range(len(pattern)):
+          suffix = pattern[start:]
+          interval = self._intervals.get(suffix)
+          if interval is not None:
+            self._intervals.move_to_end(suffix)
+            if start:
+              self._partial_hits += 1
+            else:
+              self._hits += 1
+            return start,interval
+        self._misses += 1
+        return None
+
+    def put(self,pattern: str,interval: tuple[int,int]) -> None:
+      with self._lock:
+        self._intervals[pattern] = interval
+        self._intervals.move_to_end(pattern)
+        if len(self._intervals) > self._capacity:
+          self._intervals.popitem(last=False)
+          self._evictions += 1
+
+    def clear(self) -> None:
+      with self._lock:
+        self._intervals.clear()
+
+    def getStats(self) -> dict:
+      with self._lock:
+        return {
+          "capacity": self._capacity,
+          "size": len(self._intervals),
+          "hits": self._hits,
+          "partial_hits": self._partial_hits,
+          "misses": self._misses,
+          "evictions": self._evictions,
+        }
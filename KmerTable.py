@@ -0,0 +1,94 @@
+from array import array
+from bisect import bisect_left
+
+class KmerTable:
+    '''
+    Interval [sp,ep) of sorted suffixes for every k-mer that occurs in the text
+    A k-mer is packed into an int with ⌈lgΣ⌉ bits per character, first character most significant.
+    Suffixes are sorted by character index, so the k-mers appear in increasing code order along
+    the suffix array and the table is a sorted array of codes searched with bisect
+    Public methods:
+      getInterval(kmer) -> (sp,ep) of a sequence of k character indexes, (0,0) if it does not occur
+    Space: at most min(n,Σ^k) entries of one code and two row numbers
+    '''
+    def __init__(self,codes,sa,k: int,character_size: int) -> None:
+      '''
+        :param codes: the text as character indexes
+        :param sa: suffix array of codes
+        :param int k: length of the k-mers
+        :param int character_size: number of characters in the character set
+      '''
+      self._k = k
+      self._bits = max(1,(character_size - 1).bit_length())
+      if k < 1 or k * self._bits > 64:
+        raise ValueError(f"k-mer length must be between 1 and {64 // self._bits} for {character_size} characters")
+      n = len(codes)
+      mask = (1 << (k * self._bits)) - 1
+
+      # Code of the k-mer starting at every text position that has k characters left
+      last = n - k
+      window = array('Q',bytes(8 * max(last + 1,0)))
+      code = 0
+      for pos,charIdx in enumerate(codes):
+        code = ((code << self._bits) | charIdx) & mask
+        if pos >= k - 1:
+          window[pos - k + 1] = code
+
+      row_typecode = 'I' if n < 1 << 32 else 'Q'
+      self._codes = array('Q')
+      self._starts = array(row_typecode)
+      self._ends = array(row_typecode)
+      for row,pos in enumerate(sa):
+        if pos > last:
+          continue
+        code = window[pos]
+        if self._codes and self._codes[-1] == code:
+          self._ends[-1] = row + 1
+        else:
+          self._codes.append(code)
+          self._starts.append(row)
+          self._ends.append(row + 1)
+
+    def __len__(self) -> int:
+      return len(self._codes)
+
+    @property
+    def k(self) -> int:
+      return self._k
+
+    def getInterval(self,kmer):
+      '''
+      :param kmer: sequence of k character indexes
+      '''
+      code = 0
+      for charIdx in kmer:
+        code = (code << self._bits) | charIdx
+      i = bisect_left(self._codes,code)
+      if i < len(self._codes) and self._codes[i] == code:
+        return self._starts[i],self._ends[i]
+      return 0,0
+
+    def serialize(self,writer) -> dict:
+      return {
+        "k": self._k,
+        "bits": self._bits,
+        "codes": writer.addBuffer(self._codes),
+        "starts": writer.addBuffer(self._starts),
+        "ends": writer.addBuffer(self._ends),
+      }
+
+    @classmethod
+    def deserialize(cls,state: dict,reader):
+      table = cls.__new__(cls)
+      table._k = state["k"]
+      table._bits = state["bits"]
+      table._codes = reader.getBuffer(state["codes"])
+      table._starts = reader.getBuffer(state["starts"])
+      table._ends = reader.getBuffer(state["ends"])
+      return table
+
+    def getSpaceUsage(self) -> dict:
+      return {
+        "entries": len(self._codes),
+        "bits": len(self._codes) * (64 + 8 * (self._starts.itemsize + self._ends.itemsize)),
+      }
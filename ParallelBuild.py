@@ -0,0 +1,151 @@
+import math
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
+import numpy as np
+from BitVector import BitVector
+from WaveletTreeNode import Node
+from utils import encodeText
+
+def encode_text(text, character_set: str):
+    """
+    text: str or a sequence of character indexes
+    returns: numpy uint8 array with the index of every character in the character set
+    """
+    if len(character_set) > 256:
+        raise ValueError("Parallel builds support character sets of at most 256 characters")
+    if isinstance(text, str):
+        text = encodeText(text, character_set)
+    if isinstance(text, (bytes, bytearray, memoryview)):
+        return np.frombuffer(text, dtype=np.uint8)
+    return np.asarray(text, dtype=np.uint8)
+
+def _split_point(chrlo: int, chrhi: int, splits: dict = None):
+    if splits is not None and (chrlo, chrhi) in splits:
+        return splits[(chrlo, chrhi)]
+    return chrlo + math.ceil((chrhi - chrlo) / 2)
+
+def build_subtree(codes, chrlo: int, chrhi: int, block_size: int = None, depth: int = 0, splits: dict = None, bit_vector_type=BitVector):
+    """
+    codes: numpy array with the characters of the node, all in [chrlo, chrhi)
+    splits: split point of every character range (see WaveletTree.getAlphabeticSplits), None splits ranges in half
+    bit_vector_type: class of the node bitvectors, built with its fromNumpy
+    returns: root Node of the subtree, with bits packed by numpy
+    Every level copies the codes once, so a subtree costs O(n) bytes per level
+    """
+    mid = _split_point(chrlo, chrhi, splits)
+    if chrlo == mid or chrhi == mid:
+        return Node(chrlo, chrhi, size=len(codes), depth=depth)
+    in_right_child = codes >= mid
+    node = Node(chrlo, chrhi, bit_vector=bit_vector_type.fromNumpy(in_right_child, superblock_size=block_size), size=len(codes), depth=depth, mid=mid)
+    node.left = build_subtree(codes[~in_right_child], chrlo, mid, block_size, depth + 1, splits, bit_vector_type)
+    node.right = build_subtree(codes[in_right_child], mid, chrhi, block_size, depth + 1, splits, bit_vector_type)
+    return node
+
+def _attach(shm_name: str, size: int):
+    shm = shared_memory.SharedMemory(name=shm_name)
+    return shm, np.ndarray((size,), dtype=np.uint8, buffer=shm.buf)
+
+def _build_subtree_task(shm_name: str, size: int, chrlo: int, chrhi: int, block_size: int, depth: int, splits: dict = None, bit_vector_type=BitVector):
+    """
+    Worker: select the characters of [chrlo, chrhi) from the shared text and build their subtree
+    """
+    shm, codes = _attach(shm_name, size)
+    try:
+        node_codes = codes[(codes >= chrlo) & (codes < chrhi)]
+    finally:
+        del codes
+        shm.close()
+    return build_subtree(node_codes, chrlo, chrhi, block_size, depth, splits, bit_vector_type)
+
+def _matrix_level_task(shm_name: str, size: int, height: int, level: int, block_size: int, bit_vector_type=BitVector):
+    """
+    Worker: level l of a wavelet matrix holds bit l of the codes, stably sorted by
+    their first l bits read in reverse (the order produced by the previous partitions)
+    The stable sort needs an index array, so a worker uses about 10 bytes per character
+    """
+    shm, codes = _attach(shm_name, size)
+    try:
+        codes = codes.copy()
+    finally:
+        shm.close()
+    shift = height - level - 1
+    if level:
+        prefix = codes >> (shift + 1)
+        key = np.zeros_like(prefix)
+        for b in range(level):
+            key |= ((prefix >> b) & 1) << (level - b - 1)
+        codes = codes[np.argsort(key, kind='stable')]
+    bits = ((codes >> shift) & 1).astype(bool)
+    return bit_vector_type.fromNumpy(bits, superblock_size=block_size), int(size - np.count_nonzero(bits))
+
+class _SharedText:
+    """
+    Context manager that copies the encoded text into a shared memory block
+    so that worker processes can read it without pickling
+    """
+    def __init__(self, codes):
+        self.size = len(codes)
+        self._shm = shared_memory.SharedMemory(create=True, size=max(self.size, 1))
+        np.ndarray((self.size,), dtype=np.uint8, buffer=self._shm.buf)[:] = codes
+        self.name = self._shm.name
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self._shm.close()
+        self._shm.unlink()
+
+def build_tree_parallel(codes, character_size: int, block_size: int = None, workers: int = 1, splits: dict = None, bit_vector_type=BitVector):
+    """
+    codes: numpy uint8 array of character indexes
+    returns: root Node of a wavelet tree over codes
+    The top levels are built in this process until there is one subtree per worker,
+    then sibling subtrees are built in a process pool over the shared text
+    """
+    if workers <= 1:
+        return build_subtree(codes, 0, character_size, block_size, splits=splits, bit_vector_type=bit_vector_type)
+
+    split_depth = max(1, math.ceil(math.log2(workers)))
+    pending = []
+
+    def build_top(node_codes, chrlo, chrhi, depth, executor, shared):
+        mid = _split_point(chrlo, chrhi, splits)
+        if chrlo == mid or chrhi == mid:
+            return Node(chrlo, chrhi, size=len(node_codes), depth=depth)
+        in_right_child = node_codes >= mid
+        node = Node(chrlo, chrhi, bit_vector=bit_vector_type.fromNumpy(in_right_child, superblock_size=block_size), size=len(node_codes), depth=depth, mid=mid)
+        for side, lo, hi in (('left', chrlo, mid), ('right', mid, chrhi)):
+            if depth + 1 == split_depth:
+                # Workers select the codes of their subtree from the shared text
+                future = executor.submit(_build_subtree_task, shared.name, shared.size, lo, hi, block_size, depth + 1, splits, bit_vector_type)
+                pending.append((node, side, future))
+            else:
+                child_codes = node_codes[in_right_child if side == 'right' else ~in_right_child]
+                setattr(node, side, build_top(child_codes, lo, hi, depth + 1, executor, shared))
+        return node
+
+    with _SharedText(codes) as shared, ProcessPoolExecutor(max_workers=workers) as executor:
+        root = build_top(codes, 0, character_size, 0, executor, shared)
+        for node, side, future in pending:
+            setattr(node, side, future.result())
+    return root
+
+def build_matrix_levels_parallel(codes, height: int, block_size: int = None, workers: int = 1, bit_vector_type=BitVector):
+    """
+    codes: numpy uint8 array of character indexes
+    returns: (list of level BitVectors, list of zero counts per level)
+    Every level only depends on the original codes, so the levels are built independently
+    """
+    if workers <= 1:
+        results = []
+        for level in range(height):
+            shift = height - level - 1
+            bits = ((codes >> shift) & 1).astype(bool)
+            results.append((bit_vector_type.fromNumpy(bits, superblock_size=block_size), int(len(codes) - np.count_nonzero(bits))))
+            codes = np.concatenate((codes[~bits], codes[bits]))
+    else:
+        with _SharedText(codes) as shared, ProcessPoolExecutor(max_workers=workers) as executor:
+            futures = [executor.submit(_matrix_level_task, shared.name, shared.size, height, level, block_size, bit_vector_type) for level in range(height)]
+            results = [future.result() for future in futures]
+    return [bit_vector for bit_vector, _ in results], [zeros for _, zeros in results]
@@ -0,0 +1,232 @@
+import itertools
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from threading import BrokenBarrierError, Lock
+from time import time
+from FMIndex import FMIndex
+import Instrumentation
+
+# Index loaded by each worker process of the query pool
+_worker_index = None
+# Barrier with one party per worker, so that a task can be sent to every worker once
+_worker_barrier = None
+
+def _initWorker(index_path: str, cache_size: int, barrier, instrument: bool):
+    global _worker_index, _worker_barrier
+    _worker_barrier = barrier
+    if instrument:
+        Instrumentation.enable()
+    _worker_index = FMIndex.load(index_path, cache_size=cache_size)
+
+def _count(pattern: str):
+    return _worker_index.findMatchCount(pattern)
+
+def _rank(charIdx: int, idx: int):
+    return _worker_index._waveletTree.getRank(charIdx, idx)
+
+def _countBatch(patterns: list[str]):
+    try:
+        return [int(count) for count in _worker_index.findMatchCounts(patterns)]
+    except ImportError:
+        return [_worker_index.findMatchCount(pattern) for pattern in patterns]
+
+def _instrumentationTask(action: str, timeout: float):
+    '''
+    Wait until every worker holds one of these tasks, then apply the action in this worker
+    Returns the raw metrics of the worker
+    '''
+    _worker_barrier.wait(timeout)
+    if action == 'enable':
+        Instrumentation.enable()
+    elif action == 'disable':
+        Instrumentation.disable()
+    elif action == 'reset':
+        Instrumentation.reset()
+    return Instrumentation.getState()
+
+def _buildIndexFile(index_path: str, source, build_options: dict):
+    '''
+    Build an index from source and atomically replace the file at index_path
+    Workers that still map the old file keep reading it until they are replaced
+    '''
+    index = FMIndex.fromStream(source, **build_options)
+    tmp_path = f'{index_path}.{os.getpid()}.tmp'
+    index.save(tmp_path)
+    os.replace(tmp_path, index_path)
+
+class QueryService:
+    '''
+    Answers count, rank and batch count queries on a pool of worker processes
+    Every worker memory-maps the same index file, so the index pages are shared between them
+    Rebuilds run as background jobs in their own process. When a rebuild finishes,
+    new queries go to a fresh pool over the new file while the old pool drains
+    Other expensive work, such as benchmarks that build indexes, runs as a background job the same way
+    Public methods:
+      count(pattern), rank(charIdx,idx), countBatch(patterns) -> results, blocking the calling thread only
+      submitRebuild(source,**build_options), submitTask(kind,fn,*args,**options) -> job id
+      getJob(job_id), listJobs() -> job status records
+      setInstrumentation(enabled), resetMetrics(), getMetrics() -> metrics merged over all workers
+    '''
+    def __init__(self, index_path: str, workers: int = None, cache_size: int = 0, timeout: float = 30, instrument: bool = False) -> None:
+        '''
+        :param str index_path: index file written by FMIndex.save
+        :param int workers: number of query processes. Defaults to the number of cores
+        :param int cache_size: size of the interval cache of every worker
+        :param float timeout: seconds to wait for a query result
+        :param bool instrument: record metrics in the workers from the start, see Instrumentation
+        '''
+        self._index_path = index_path
+        self._workers = workers or os.cpu_count() or 1
+        self._cache_size = cache_size
+        self._timeout = timeout
+        self._instrument = instrument
+        self._lock = Lock()
+        self._pool = self._createPool()
+        self._generation = 0
+
+        # Background jobs run one at a time, in submission order
+        self._job_runner = ThreadPoolExecutor(max_workers=1)
+        self._jobs = {}
+        self._job_ids = itertools.count(1)
+
+    def _createPool(self):
+        self._barrier = multiprocessing.Barrier(self._workers)
+        return ProcessPoolExecutor(max_workers=self._workers, initializer=_initWorker, initargs=(self._index_path, self._cache_size, self._barrier, self._instrument))
+
+    def _broadcast(self, action: str) -> list[dict]:
+        '''
+        Run an instrumentation action once in every worker. The barrier keeps a worker that has
+        taken one of the tasks from taking another, so the tasks are spread over all workers
+        '''
+        with self._lock:
+            futures = [self._pool.submit(_instrumentationTask, action, self._timeout) for _ in range(self._workers)]
+            barrier = self._barrier
+        try:
+            return [future.result(self._timeout) for future in futures]
+        except BrokenBarrierError:
+            barrier.reset()
+            raise TimeoutError("Not every worker picked up the instrumentation task in time")
+
+    def _submit(self, fn, *args):
+        with self._lock:
+            return self._pool.submit(fn, *args)
+
+    @property
+    def workers(self) -> int:
+        return self._workers
+
+    @property
+    def generation(self) -> int:
+        '''
+        Number of rebuilds that have been swapped in
+        '''
+        return self._generation
+
+    def count(self, pattern: str) -> int:
+        return self._submit(_count, pattern).result(self._timeout)
+
+    def rank(self, charIdx: int, idx: int) -> int:
+        return self._submit(_rank, charIdx, idx).result(self._timeout)
+
+    def countBatch(self, patterns: list[str]) -> list[int]:
+        '''
+        Split the patterns into one chunk per worker and count the chunks in parallel
+        '''
+        chunk_size = max(1, -(-len(patterns) // self._workers))
+        futures = [self._submit(_countBatch, patterns[i:i + chunk_size]) for i in range(0, len(patterns), chunk_size)]
+        counts = []
+        for future in futures:
+            counts.extend(future.result(self._timeout))
+        return counts
+
+    def setInstrumentation(self, enabled: bool):
+        '''
+        Switch metric recording on or off in every worker, including the workers of later rebuilds
+        '''
+        self._instrument = enabled
+        self._broadcast('enable' if enabled else 'disable')
+
+    def resetMetrics(self):
+        self._broadcast('reset')
+
+    def getMetrics(self) -> dict:
+        '''
+        Metrics of all workers of the current pool, merged and summarized
+        '''
+        return Instrumentation.summarize(Instrumentation.mergeStates(self._broadcast('state')))
+
+    def _createJob(self, kind: str, options: dict) -> int:
+        job_id = next(self._job_ids)
+        self._jobs[job_id] = {
+            "id": job_id,
+            "kind": kind,
+            "status": "queued",
+            "options": options,
+            "submitted_at": time(),
+            "started_at": None,
+            "finished_at": None,
+            "error": None,
+            "result": None,
+        }
+        return job_id
+
+    def submitRebuild(self, source, **build_options) -> int:
+        '''
+        Queue a rebuild of the index from source (a file path or an iterable of chunks)
+        :param build_options: passed on to FMIndex.fromStream
+        '''
+        job_id = self._createJob("rebuild", build_options)
+        self._job_runner.submit(self._runJob, job_id, _buildIndexFile, (self._index_path, source, build_options), {}, self._swapPool)
+        return job_id
+
+    def submitTask(self, kind: str, fn, *args, **options) -> int:
+        '''
+        Queue fn(*args, **options) to run in its own process. Its return value is kept as the result of the job
+        :param str kind: name of the job in its status record
+        :param fn: a module-level function, so that it can be sent to the job process
+        :param options: recorded in the status record, so they have to be JSON serializable
+        '''
+        job_id = self._createJob(kind, options)
+        self._job_runner.submit(self._runJob, job_id, fn, args, options)
+        return job_id
+
+    def _runJob(self, job_id: int, fn, args: tuple, kwargs: dict, on_done=None):
+        '''
+        Run fn(*args, **kwargs) in a process of its own, then on_done in this thread if it succeeded
+        '''
+        job = self._jobs[job_id]
+        job["status"] = "running"
+        job["started_at"] = time()
+        try:
+            with ProcessPoolExecutor(max_workers=1) as runner:
+                job["result"] = runner.submit(fn, *args, **kwargs).result()
+            if on_done is not None:
+                on_done()
+            job["status"] = "done"
+        except Exception as e:
+            job["status"] = "failed"
+            job["error"] = repr(e)
+        job["finished_at"] = time()
+
+    def _swapPool(self):
+        '''
+        Send new queries to a fresh pool over the rebuilt file
+        '''
+        with self._lock:
+            old_pool = self._pool
+            self._pool = self._createPool()
+            self._generation += 1
+        old_pool.shutdown(wait=False)
+
+    def getJob(self, job_id: int):
+        job = self._jobs.get(job_id)
+        return None if job is None else dict(job)
+
+    def listJobs(self) -> list[dict]:
+        return [dict(job) for job in self._jobs.values()]
+
+    def close(self):
+        self._job_runner.shutdown(wait=True)
+        with self._lock:
+            self._pool.shutdown(wait=True)
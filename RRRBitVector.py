@@ -0,0 +1,271 @@
+from array import array
+from bisect import bisect_right
+try:
+  import numpy as np
+except ImportError: # numpy is only needed for the batched rank queries
+  np = None
+from constants import BIT_PACK_SIZE, RRR_BLOCK_SIZE, RRR_SUPERBLOCK_SIZE
+from utils import selectInWord
+
+# Every block of RRR_BLOCK_SIZE bits is stored as its class (number of 1s) and its offset,
+# the index of the block among all blocks of that class
+_CLASS_BITS = 4
+_CLASSES_PER_WORD = BIT_PACK_SIZE // _CLASS_BITS
+_CLASS_VALUES = [[] for _ in range(RRR_BLOCK_SIZE + 1)]
+_OFFSETS = array('H',bytes(2 << RRR_BLOCK_SIZE))
+for _value in range(1 << RRR_BLOCK_SIZE):
+  _OFFSETS[_value] = len(_CLASS_VALUES[_value.bit_count()])
+  _CLASS_VALUES[_value.bit_count()].append(_value)
+# Bits needed to store an offset of every class. Blocks of all 0s or all 1s need none
+_OFFSET_WIDTHS = [(len(values) - 1).bit_length() for values in _CLASS_VALUES]
+del _value
+
+# Ranks skip over the blocks before their own one _CHUNK_BLOCKS at a time:
+# for every 16-bit chunk of classes, the number of 1s and the offset bits of its 4 blocks
+_CHUNK_BLOCKS = 4
+_CHUNK_MASK = (1 << (_CHUNK_BLOCKS * _CLASS_BITS)) - 1
+_CHUNK_ONES = array('H',bytes(2 << (_CHUNK_BLOCKS * _CLASS_BITS)))
+_CHUNK_WIDTHS = array('H',bytes(2 << (_CHUNK_BLOCKS * _CLASS_BITS)))
+for _chunk in range(1,_CHUNK_MASK + 1):
+  _CHUNK_ONES[_chunk] = _CHUNK_ONES[_chunk >> _CLASS_BITS] + (_chunk & 0xF)
+  _CHUNK_WIDTHS[_chunk] = _CHUNK_WIDTHS[_chunk >> _CLASS_BITS] + _OFFSET_WIDTHS[_chunk & 0xF]
+del _chunk
+
+class RRRBitVector:
+    '''
+    Compressed bitvector (Raman, Raman and Rao) supporting rank queries in O(superblock / block) time
+    Bits are cut into blocks of RRR_BLOCK_SIZE bits. A block with c 1s is stored as:
+      - its class c, in 4 bits
+      - its offset among the C(b,c) blocks of class c, in ⌈lg C(b,c)⌉ bits (0 bits for all-0 or all-1 blocks)
+    Every superblock keeps the number of 1s before it and the position of its first offset,
+    so rank1(i) sums the classes from the superblock to the block of i, 4 blocks per table lookup,
+    and decodes that one block. select1(k) binary searches the superblock ranks and sums classes the same way
+    Space: about nH0 + n * 4/b + n/superblock_size * 128 bits. Sparse, dense or run-heavy bitvectors
+    shrink well below n bits, while random ones are slightly larger than a plain BitVector
+    Same interface as BitVector
+    '''
+    def __init__(self,bits = (),superblock_size: int = None) -> None:
+      '''
+        :param bits: iterable of 0s and 1s (or booleans)
+        :param int superblock_size: bits per rank sample, rounded to a whole number of 4-block chunks
+      '''
+      if superblock_size is None:
+        superblock_size = RRR_SUPERBLOCK_SIZE
+      chunks = max(1,round(superblock_size / (RRR_BLOCK_SIZE * _CHUNK_BLOCKS)))
+      self._blocks_per_superblock = chunks * _CHUNK_BLOCKS
+      digits = bytes(bits).translate(bytes.maketrans(b'\x00\x01',b'01'))
+      self._size = len(digits)
+
+      classes = array('Q')
+      offsets = array('Q')
+      superblock_ranks = array('Q')
+      superblock_pointers = array('Q')
+      class_word = offset_word = offset_bits = 0
+      rank = pointer = 0
+      # One extra block so that rank1(size) never reads past the end
+      num_blocks = self._size // RRR_BLOCK_SIZE + 1
+      for block in range(num_blocks):
+        if not block % self._blocks_per_superblock:
+          superblock_ranks.append(rank)
+          superblock_pointers.append(pointer)
+        chunk = digits[block * RRR_BLOCK_SIZE:(block + 1) * RRR_BLOCK_SIZE]
+        value = int(chunk[::-1],2) if chunk else 0
+        c = value.bit_count()
+        class_word |= c << ((block % _CLASSES_PER_WORD) * _CLASS_BITS)
+        if block % _CLASSES_PER_WORD == _CLASSES_PER_WORD - 1:
+          classes.append(class_word)
+          class_word = 0
+
+        width = _OFFSET_WIDTHS[c]
+        if width:
+          offset_word |= _OFFSETS[value] << offset_bits
+          offset_bits += width
+          if offset_bits >= BIT_PACK_SIZE:
+            offsets.append(offset_word & 0xFFFFFFFFFFFFFFFF)
+            offset_word >>= BIT_PACK_SIZE
+            offset_bits -= BIT_PACK_SIZE
+        rank += c
+        pointer += width
+      classes.append(class_word)
+      # A trailing zero word lets an offset be read as two whole words
+      offsets.append(offset_word)
+      offsets.append(0)
+
+      self._classes = classes
+      self._offsets = offsets
+      self._superblock_ranks = superblock_ranks
+      self._superblock_pointers = superblock_pointers
+      self._ones = rank
+
+    @classmethod
+    def fromNumpy(cls,bits,superblock_size: int = None):
+      '''
+      Build an RRRBitVector from a numpy boolean array
+      '''
+      return cls(np.asarray(bits,dtype=np.uint8).tobytes(),superblock_size=superblock_size)
+
+    def __len__(self) -> int:
+      return self._size
+
+    def __repr__(self) -> str:
+      return ''.join(str(self.access(i)) for i in range(self._size))
+
+    @property
+    def ones(self) -> int:
+      return self._ones
+
+    def _getClass(self,block: int) -> int:
+      return (self._classes[block // _CLASSES_PER_WORD] >> ((block % _CLASSES_PER_WORD) * _CLASS_BITS)) & 0xF
+
+    def _findBlock(self,block: int):
+      '''
+      (number of 1s before the block, the block decoded as an int)
+      '''
+      superblock = block // self._blocks_per_superblock
+      rank = self._superblock_ranks[superblock]
+      pointer = self._superblock_pointers[superblock]
+      b = superblock * self._blocks_per_superblock
+      while block - b >= _CHUNK_BLOCKS:
+        chunk = (self._classes[b // _CLASSES_PER_WORD] >> ((b % _CLASSES_PER_WORD) * _CLASS_BITS)) & _CHUNK_MASK
+        rank += _CHUNK_ONES[chunk]
+        pointer += _CHUNK_WIDTHS[chunk]
+        b += _CHUNK_BLOCKS
+      for b in range(b,block):
+        c = self._getClass(b)
+        rank += c
+        pointer += _OFFSET_WIDTHS[c]
+      c = self._getClass(block)
+      width = _OFFSET_WIDTHS[c]
+      if not width:
+        return rank,_CLASS_VALUES[c][0]
+      w = pointer // BIT_PACK_SIZE
+      shift = pointer % BIT_PACK_SIZE
+      offset = ((self._offsets[w] >> shift) | (self._offsets[w + 1] << (BIT_PACK_SIZE - shift))) & ((1 << width) - 1)
+      return rank,_CLASS_VALUES[c][offset]
+
+    def access(self,i: int) -> int:
+      '''
+      Bit at index i
+      '''
+      if i < 0 or i >= self._size:
+        raise IndexError(f'Cannot get bit at index {i}. Max index is {self._size - 1}')
+      _,value = self._findBlock(i // RRR_BLOCK_SIZE)
+      return (value >> (i % RRR_BLOCK_SIZE)) & 1
+
+    def rank1(self,i: int) -> int:
+      '''
+      Number of 1s in bits[0:i]
+      '''
+      rank,value = self._findBlock(i // RRR_BLOCK_SIZE)
+      return rank + (value & ((1 << (i % RRR_BLOCK_SIZE)) - 1)).bit_count()
+
+    def rank1Pair(self,i: int,j: int):
+      '''
+      (rank1(i), rank1(j)), decoding the block once when i and j fall in the same block
+      '''
+      block = i // RRR_BLOCK_SIZE
+      rank,value = self._findBlock(block)
+      rank_i = rank + (value & ((1 << (i % RRR_BLOCK_SIZE)) - 1)).bit_count()
+      if j // RRR_BLOCK_SIZE == block:
+        return rank_i,rank + (value & ((1 << (j % RRR_BLOCK_SIZE)) - 1)).bit_count()
+      return rank_i,self.rank1(j)
+
+    def rank0(self,i: int) -> int:
+      '''
+      Number of 0s in bits[0:i]
+      '''
+      return i - self.rank1(i)
+
+    def _select(self,k: int,bit: int) -> int:
+      '''
+      Position of the k-th bit equal to bit (counting from 0)
+      '''
+      total = self._ones if bit else self._size - self._ones
+      if k < 0 or k >= total:
+        raise ValueError(f'Cannot select {bit} number {k}. There are only {total} {bit}s')
+      superblock_bits = self._blocks_per_superblock * RRR_BLOCK_SIZE
+      if bit:
+        before_superblock = lambda s: self._superblock_ranks[s]
+      else:
+        before_superblock = lambda s: s * superblock_bits - self._superblock_ranks[s]
+      if bit:
+        superblock = bisect_right(self._superblock_ranks,k) - 1
+      else:
+        superblock = bisect_right(range(len(self._superblock_ranks)),k,key=before_superblock) - 1
+      k -= before_superblock(superblock)
+      b = superblock * self._blocks_per_superblock
+      while True:
+        chunk = (self._classes[b // _CLASSES_PER_WORD] >> ((b % _CLASSES_PER_WORD) * _CLASS_BITS)) & _CHUNK_MASK
+        count = _CHUNK_ONES[chunk] if bit else _CHUNK_BLOCKS * RRR_BLOCK_SIZE - _CHUNK_ONES[chunk]
+        if count > k:
+          break
+        k -= count
+        b += _CHUNK_BLOCKS
+      while True:
+        c = self._getClass(b)
+        count = c if bit else RRR_BLOCK_SIZE - c
+        if count > k:
+          break
+        k -= count
+        b += 1
+      _,value = self._findBlock(b)
+      if not bit:
+        value = ~value & ((1 << RRR_BLOCK_SIZE) - 1)
+      return b * RRR_BLOCK_SIZE + selectInWord(value,k)
+
+    def select1(self,k: int) -> int:
+      '''
+      Position of the k-th 1 (counting from 0), the i with bits[i] = 1 and rank1(i) = k
+      '''
+      return self._select(k,1)
+
+    def select0(self,k: int) -> int:
+      '''
+      Position of the k-th 0 (counting from 0)
+      '''
+      return self._select(k,0)
+
+    def rank1Many(self,idxs):
+      '''
+      rank1 over a numpy array of positions
+      '''
+      return np.fromiter((self.rank1(i) for i in idxs.tolist()),dtype=np.int64,count=len(idxs))
+
+    def rank0Many(self,idxs):
+      return idxs - self.rank1Many(idxs)
+
+    def serialize(self,writer) -> dict:
+      return {
+        "type": "rrr",
+        "size": self._size,
+        "ones": self._ones,
+        "blocks_per_superblock": self._blocks_per_superblock,
+        "classes": writer.addBuffer(self._classes),
+        "offsets": writer.addBuffer(self._offsets),
+        "superblock_ranks": writer.addBuffer(self._superblock_ranks),
+        "superblock_pointers": writer.addBuffer(self._superblock_pointers),
+      }
+
+    @classmethod
+    def deserialize(cls,state: dict,reader):
+      bit_vector = cls.__new__(cls)
+      bit_vector._size = state["size"]
+      bit_vector._ones = state["ones"]
+      bit_vector._blocks_per_superblock = state["blocks_per_superblock"]
+      bit_vector._classes = reader.getBuffer(state["classes"])
+      bit_vector._offsets = reader.getBuffer(state["offsets"])
+      bit_vector._superblock_ranks = reader.getBuffer(state["superblock_ranks"])
+      bit_vector._superblock_pointers = reader.getBuffer(state["superblock_pointers"])
+      return bit_vector
+
+    def getSpaceUsage(self) -> dict:
+      '''
+      Report the space used in bits by the classes and offsets (payload) and the superblock samples (directory)
+      '''
+      payload_bits = (len(self._classes) + len(self._offsets)) * BIT_PACK_SIZE
+      directory_bits = (len(self._superblock_ranks) + len(self._superblock_pointers)) * BIT_PACK_SIZE
+      return {
+        "bits": self._size,
+        "payload_bits": payload_bits,
+        "directory_bits": directory_bits,
+      }
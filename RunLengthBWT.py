@@ -0,0 +1,193 @@
+from array import array
+from bisect import bisect_right
+from itertools import groupby
+try:
+  import numpy as np
+except ImportError: # numpy is only needed for getRanks
+  np = None
+from utils import encodeText
+from WaveletTree import WaveletTree
+
+class RunLengthBWT:
+    '''
+    Run-length encoded rank structure over a BWT (the counting part of an r-index)
+    A BWT of r runs is stored as:
+      - the head (character) of every run, with a WaveletTree over the heads for rank
+      - the start position of every run
+      - for every character, the total length of its first k runs, for every k
+    rank_c(i) finds the run holding position i-1 by binary search, counts the c-runs before it
+    with the heads tree, and adds their total length plus the part of the run itself if it is a c-run
+    Public methods: same as WaveletTree
+      getRank(charIdx,idx), getRankPair(charIdx,i,j), getRankAll(idx), getRanks(charIdx,idxs), getCharAndRank(idx)
+      access(idx), select(charIdx,k)
+    Example use:
+    rlbwt = RunLengthBWT('aaacccaa$',character_set="$ac")
+    rlbwt.getRank(1,8) <-> rank_a(8)
+
+    Space: O(r lgΣ) bits for the heads tree plus a head byte and two 32-bit integers per run
+    (64-bit past 4G characters), instead of O(n lgΣ) bits.
+    Pays off when the BWT has long runs, e.g. for collections of similar genomes
+    '''
+
+    def __init__(self,text: str, character_set: str, block_size = None,workers: int = None,bitvector: str = 'plain',debug:bool = False) -> None:
+      '''
+        Build a run-length BWT that supports efficient rank_i(j) queries
+        :param text: BWT to represent, as a string or a sequence of character indexes (e.g. bytes)
+        :param str character_set: an ordered string of all possible characters
+        :param int block_size: passed on to the WaveletTree over the run heads
+        :param int workers: passed on to the WaveletTree over the run heads
+        :param str bitvector: encoding of the bitvectors of the heads tree
+      '''
+      self._size = len(text)
+      self._character_size = len(character_set)
+      codes = encodeText(text,character_set) if isinstance(text,str) else text
+
+      # Positions and lengths fit in 32 bits for texts of up to 4G characters
+      typecode = 'I' if self._size < 1 << 32 else 'Q'
+      heads = array('B' if self._character_size <= 256 else 'H')
+      self._starts = array(typecode)
+      # Total length of the runs of every character so far, appended after each of its runs
+      run_lengths = [[0] for _ in range(self._character_size)]
+      position = 0
+      for charIdx,run in groupby(codes):
+        length = sum(1 for _ in run)
+        heads.append(charIdx)
+        self._starts.append(position)
+        run_lengths[charIdx].append(run_lengths[charIdx][-1] + length)
+        position += length
+      self._heads = heads
+      self._setRunLengths(run_lengths,typecode)
+      self._head_tree = WaveletTree(heads,character_set,block_size=block_size,workers=workers,bitvector=bitvector)
+
+    def _setRunLengths(self,run_lengths: list,typecode: str):
+      '''
+      Concatenate the per character cumulative run lengths into one array
+      '''
+      self._run_lengths = array(typecode)
+      self._run_length_offsets = array(typecode)
+      for lengths in run_lengths:
+        self._run_length_offsets.append(len(self._run_lengths))
+        self._run_lengths.extend(lengths)
+
+    @property
+    def runs(self) -> int:
+      return len(self._heads)
+
+    def _findRun(self,idx):
+      '''
+      Index of the run holding position idx
+      '''
+      return bisect_right(self._starts,idx) - 1
+
+    def getRank(self,charIdx,idx,debug: bool =False):
+      if idx > self._size:
+        raise ValueError(f"Cannot get rank at index {idx}. Idx can be at most {self._size}")
+      if charIdx < 0 or charIdx >= self._character_size:
+        raise ValueError(f"Cannot get rank of char-{charIdx}. There are only {self._character_size} characters")
+      if idx == 0:
+        return 0
+      run = self._findRun(idx - 1)
+      rank = self._run_lengths[self._run_length_offsets[charIdx] + self._head_tree.getRank(charIdx,run)]
+      if self._heads[run] == charIdx:
+        rank += idx - self._starts[run]
+      return rank
+
+    def getRankPair(self,charIdx,i,j):
+      if j > self._size or i > j:
+        raise ValueError(f"Cannot get ranks at indexes {i},{j}. Need i <= j <= {self._size}")
+      return self.getRank(charIdx,i),self.getRank(charIdx,j)
+
+    def getRankAll(self,idx):
+      if idx > self._size:
+        raise ValueError(f"Cannot get rank at index {idx}. Idx can be at most {self._size}")
+      if idx == 0:
+        return [0] * self._character_size
+      run = self._findRun(idx - 1)
+      run_counts = self._head_tree.getRankAll(run)
+      ranks = [self._run_lengths[offset + count] for offset,count in zip(self._run_length_offsets,run_counts)]
+      ranks[self._heads[run]] += idx - self._starts[run]
+      return ranks
+
+    def getRanks(self,charIdx,idxs):
+      '''
+      Vectorized getRank over a numpy array of positions
+      '''
+      if charIdx < 0 or charIdx >= self._character_size:
+        raise ValueError(f"Cannot get rank of char-{charIdx}. There are only {self._character_size} characters")
+      position_type = np.uint32 if self._starts.itemsize == 4 else np.uint64
+      starts = np.frombuffer(self._starts,dtype=position_type).astype(np.int64)
+      heads = np.frombuffer(self._heads,dtype=np.uint8 if self._heads.itemsize == 1 else np.uint16)
+      runs = np.maximum(np.searchsorted(starts,idxs - 1,side='right') - 1,0)
+      offset = self._run_length_offsets[charIdx]
+      run_lengths = np.frombuffer(self._run_lengths,dtype=position_type).astype(np.int64)
+      ranks = run_lengths[offset + self._head_tree.getRanks(charIdx,runs)]
+      ranks += np.where(heads[runs] == charIdx,idxs - starts[runs],0)
+      return np.where(idxs > 0,ranks,0)
+
+    def getCharAndRank(self,idx):
+      if idx < 0 or idx >= self._size:
+        raise ValueError(f"Cannot get character at index {idx}. Idx can be at most {self._size - 1}")
+      run = self._findRun(idx)
+      charIdx,run_rank = self._head_tree.getCharAndRank(run)
+      return charIdx,self._run_lengths[self._run_length_offsets[charIdx] + run_rank] + idx - self._starts[run]
+
+    def access(self,idx):
+      if idx < 0 or idx >= self._size:
+        raise ValueError(f"Cannot get character at index {idx}. Idx can be at most {self._size - 1}")
+      return self._heads[self._findRun(idx)]
+
+    def select(self,charIdx,k):
+      '''
+      Find the charIdx-run holding the k-th occurrence in the cumulative run lengths of charIdx,
+      then the position of that run with a select on the heads tree
+      '''
+      if charIdx < 0 or charIdx >= self._character_size:
+        raise ValueError(f"Cannot select char-{charIdx}. There are only {self._character_size} characters")
+      offset = self._run_length_offsets[charIdx]
+      end = self._run_length_offsets[charIdx + 1] if charIdx + 1 < self._character_size else len(self._run_lengths)
+      count = self._run_lengths[end - 1]
+      if k < 0 or k >= count:
+        raise ValueError(f"Cannot select occurrence {k} of char-{charIdx}. It occurs {count} times")
+      run_rank = bisect_right(self._run_lengths,k,offset,end) - 1 - offset
+      return self._starts[self._head_tree.select(charIdx,run_rank)] + k - self._run_lengths[offset + run_rank]
+
+    def serialize(self,writer) -> dict:
+      return {
+        "size": self._size,
+        "character_size": self._character_size,
+        "heads": writer.addBuffer(self._heads),
+        "starts": writer.addBuffer(self._starts),
+        "run_lengths": writer.addBuffer(self._run_lengths),
+        "run_length_offsets": writer.addBuffer(self._run_length_offsets),
+        "head_tree": self._head_tree.serialize(writer),
+      }
+
+    @classmethod
+    def deserialize(cls,state: dict,reader):
+      rlbwt = cls.__new__(cls)
+      rlbwt._size = state["size"]
+      rlbwt._character_size = state["character_size"]
+      rlbwt._heads = reader.getBuffer(state["heads"])
+      rlbwt._starts = reader.getBuffer(state["starts"])
+      rlbwt._run_lengths = reader.getBuffer(state["run_lengths"])
+      rlbwt._run_length_offsets = reader.getBuffer(state["run_length_offsets"])
+      rlbwt._head_tree = WaveletTree.deserialize(state["head_tree"],reader)
+      return rlbwt
+
+    def getSpaceUsage(self) -> dict:
+      '''
+      Report the space used in bits
+        bits: bits of the heads tree bitvectors
+        payload_bits: heads tree payload, the run heads and the run starts
+        directory_bits: heads tree directory and the cumulative run lengths
+        runs: number of runs r
+      '''
+      usage = self._head_tree.getSpaceUsage()
+      usage["payload_bits"] += (len(self._heads) * self._heads.itemsize + len(self._starts) * self._starts.itemsize) * 8
+      usage["directory_bits"] += (len(self._run_lengths) + len(self._run_length_offsets)) * self._run_lengths.itemsize * 8
+      usage["overhead"] = usage["directory_bits"] / usage["bits"] if usage["bits"] else 0
+      usage["runs"] = self.runs
+      return usage
+
+    def __repr__(self) -> str:
+      return f'RunLengthBWT: {self._size} characters in {self.runs} runs\n{self._head_tree!r}'
@@ -0,0 +1,169 @@
+from array import array
+from bisect import bisect_right
+try:
+  import numpy as np
+except ImportError: # numpy is only needed for the batched rank queries and fromNumpy
+  np = None
+
+class RunLengthBitVector:
+    '''
+    Bitvector stored as its runs of 1s, supporting rank queries in O(lg r) time for r runs
+    Keeps, for every run of 1s, its start, its end (exclusive) and the number of 1s before it
+    rank1(i) finds the last run starting at or before i by binary search, and so do select1(k) and select0(k)
+    over the ranks and the number of 0s before every run
+    Space: 3 * 64 bits per run of 1s, independent of n. Only pays off when runs are long,
+    e.g. the wavelet nodes of the BWT of a repetitive text
+    Same interface as BitVector
+    '''
+    def __init__(self,bits = (),superblock_size: int = None) -> None:
+      '''
+        :param bits: iterable of 0s and 1s (or booleans)
+        :param int superblock_size: not used, there is no rank directory
+      '''
+      data = bytes(bits)
+      self._size = len(data)
+      starts = array('Q')
+      ends = array('Q')
+      ranks = array('Q')
+      ones = 0
+      start = data.find(1)
+      while start != -1:
+        end = data.find(0,start)
+        if end == -1:
+          end = self._size
+        starts.append(start)
+        ends.append(end)
+        ranks.append(ones)
+        ones += end - start
+        start = data.find(1,end)
+      self._setRuns(starts,ends,ranks,ones)
+
+    @classmethod
+    def fromNumpy(cls,bits,superblock_size: int = None):
+      '''
+      Build a RunLengthBitVector from a numpy boolean array, finding the run boundaries with np.diff
+      '''
+      bit_vector = cls.__new__(cls)
+      bit_vector._size = len(bits)
+      edges = np.flatnonzero(np.diff(np.concatenate(([0],np.asarray(bits,dtype=np.int8),[0]))))
+      starts = edges[::2].astype(np.uint64)
+      ends = edges[1::2].astype(np.uint64)
+      lengths = ends - starts
+      ranks = np.cumsum(lengths) - lengths
+      bit_vector._setRuns(*(array('Q',values.tobytes()) for values in (starts,ends,ranks)),int(lengths.sum()))
+      return bit_vector
+
+    def _setRuns(self,starts,ends,ranks,ones: int):
+      self._starts = starts
+      self._ends = ends
+      self._ranks = ranks
+      self._ones = ones
+
+    def __len__(self) -> int:
+      return self._size
+
+    def __repr__(self) -> str:
+      return ''.join(str(self.access(i)) for i in range(self._size))
+
+    @property
+    def ones(self) -> int:
+      return self._ones
+
+    @property
+    def runs(self) -> int:
+      '''
+      Number of runs of 1s
+      '''
+      return len(self._starts)
+
+    def access(self,i: int) -> int:
+      '''
+      Bit at index i
+      '''
+      if i < 0 or i >= self._size:
+        raise IndexError(f'Cannot get bit at index {i}. Max index is {self._size - 1}')
+      run = bisect_right(self._starts,i) - 1
+      return int(run >= 0 and i < self._ends[run])
+
+    def rank1(self,i: int) -> int:
+      '''
+      Number of 1s in bits[0:i]
+      '''
+      run = bisect_right(self._starts,i) - 1
+      if run < 0:
+        return 0
+      return self._ranks[run] + min(i,self._ends[run]) - self._starts[run]
+
+    def rank1Pair(self,i: int,j: int):
+      return self.rank1(i),self.rank1(j)
+
+    def rank0(self,i: int) -> int:
+      '''
+      Number of 0s in bits[0:i]
+      '''
+      return i - self.rank1(i)
+
+    def select1(self,k: int) -> int:
+      '''
+      Position of the k-th 1 (counting from 0), the i with bits[i] = 1 and rank1(i) = k
+      '''
+      if k < 0 or k >= self._ones:
+        raise ValueError(f'Cannot select 1 number {k}. There are only {self._ones} 1s')
+      run = bisect_right(self._ranks,k) - 1
+      return self._starts[run] + k - self._ranks[run]
+
+    def select0(self,k: int) -> int:
+      '''
+      Position of the k-th 0 (counting from 0)
+      '''
+      zeros = self._size - self._ones
+      if k < 0 or k >= zeros:
+        raise ValueError(f'Cannot select 0 number {k}. There are only {zeros} 0s')
+      # Runs with at most k 0s before them all come before the k-th 0
+      run = bisect_right(range(len(self._starts)),k,key=lambda r: self._starts[r] - self._ranks[r]) - 1
+      if run < 0:
+        return k
+      return k + self._ranks[run] + self._ends[run] - self._starts[run]
+
+    def rank1Many(self,idxs):
+      '''
+      Vectorized rank1 over a numpy array of positions
+      '''
+      if not len(self._starts):
+        return np.zeros(len(idxs),dtype=np.int64)
+      starts = np.frombuffer(self._starts,dtype=np.uint64).astype(np.int64)
+      ends = np.frombuffer(self._ends,dtype=np.uint64).astype(np.int64)
+      ranks = np.frombuffer(self._ranks,dtype=np.uint64).astype(np.int64)
+      runs = np.searchsorted(starts,idxs,side='right') - 1
+      safe = np.maximum(runs,0)
+      return np.where(runs >= 0,ranks[safe] + np.minimum(idxs,ends[safe]) - starts[safe],0)
+
+    def rank0Many(self,idxs):
+      return idxs - self.rank1Many(idxs)
+
+    def serialize(self,writer) -> dict:
+      return {
+        "type": "runlength",
+        "size": self._size,
+        "ones": self._ones,
+        "starts": writer.addBuffer(self._starts),
+        "ends": writer.addBuffer(self._ends),
+        "ranks": writer.addBuffer(self._ranks),
+      }
+
+    @classmethod
+    def deserialize(cls,state: dict,reader):
+      bit_vector = cls.__new__(cls)
+      bit_vector._size = state["size"]
+      bit_vector._setRuns(reader.getBuffer(state["starts"]),reader.getBuffer(state["ends"]),reader.getBuffer(state["ranks"]),state["ones"])
+      return bit_vector
+
+    def getSpaceUsage(self) -> dict:
+      '''
+      Report the space used in bits by the run boundaries (payload) and the ranks before every run (directory)
+      '''
+      return {
+        "bits": self._size,
+        "payload_bits": (len(self._starts) + len(self._ends)) * 64,
+        "directory_bits": len(self._ranks) * 64,
+      }
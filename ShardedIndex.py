@@ -0,0 +1,212 @@
+import json
+import os
+from concurrent.futures import ProcessPoolExecutor
+from FMIndex import FMIndex
+
+MANIFEST_NAME = 'manifest.json'
+
+# Shards loaded by each worker process of the query pool, and their manifest entries
+_worker_indexes = None
+_worker_shards = None
+
+def _loadShards(directory: str, shards: list[dict], cache_size: int) -> list[FMIndex]:
+    return [FMIndex.load(os.path.join(directory, shard["path"]), cache_size=cache_size) for shard in shards]
+
+def _initWorker(directory: str, shards: list[dict], cache_size: int):
+    global _worker_indexes, _worker_shards
+    _worker_shards = shards
+    _worker_indexes = _loadShards(directory, shards, cache_size)
+
+def _countOverlapping(text: str, pattern: str) -> int:
+    count = 0
+    position = text.find(pattern)
+    while position != -1:
+        count += 1
+        position = text.find(pattern, position + 1)
+    return count
+
+def _countShard(index: FMIndex, shard: dict, pattern: str) -> int:
+    '''
+    Matches that start in the overlap of a chunk lie entirely inside it, and belong to the next chunk
+    '''
+    return index.findMatchCount(pattern) - _countOverlapping(shard["overlap"], pattern)
+
+def _locateShard(index: FMIndex, shard: dict, pattern: str) -> list[int]:
+    '''
+    Positions of the matches in the document
+    '''
+    return [shard["offset"] + position for position in index.iterLocate(pattern) if position < shard["length"]]
+
+def _countShards(shard_ids: list[int], pattern: str) -> list[int]:
+    return [_countShard(_worker_indexes[k], _worker_shards[k], pattern) for k in shard_ids]
+
+def _locateShards(shard_ids: list[int], pattern: str) -> list[list[int]]:
+    return [_locateShard(_worker_indexes[k], _worker_shards[k], pattern) for k in shard_ids]
+
+def _buildShard(path: str, text: str, meta_char: str, index_options: dict):
+    seen = set(text)
+    if seen and min(seen) <= meta_char:
+        raise ValueError(f"Meta character {meta_char!r} must sort before every character of the text")
+    character_set = ''.join(sorted(seen.union(meta_char)))
+    FMIndex(text + meta_char, character_set, **index_options).save(path)
+
+def _splitDocument(document: str, text: str, chunk_size: int, overlap: int):
+    '''
+    Cut a document into shards of chunk_size characters, each followed by the next overlap characters
+    An empty document has no shard: an index over the terminator alone has nothing to search
+    returns: iterator over (manifest entry, shard text)
+    '''
+    step = chunk_size or len(text)
+    for offset in range(0, len(text), max(step, 1)):
+        length = min(step, len(text) - offset)
+        yield {
+            "document": document,
+            "offset": offset,
+            "length": length,
+            "overlap": text[offset + length:offset + length + overlap] if chunk_size else '',
+        }, text[offset:offset + length + overlap]
+
+class ShardedIndex:
+    '''
+    Counts and locates patterns over a corpus split into independently built FMIndex shards
+    A corpus of documents is split either into one shard per document, or into chunks of a fixed
+    size that overlap the next chunk, so that matches across a chunk boundary are still found.
+    A match is only reported by the chunk where it starts, so the overlap is never counted twice
+    Shards are saved to a directory with a JSON manifest. Every query process memory-maps all of them,
+    and a query fans out over the processes, each searching its share of the shards
+    Public methods:
+      build(documents,directory,...) -> ShardedIndex, building the shards in parallel
+      count(pattern), countByDocument(pattern), locate(pattern) -> merged results of all shards
+    '''
+    def __init__(self, directory: str, workers: int = None, cache_size: int = 0, timeout: float = 30) -> None:
+        '''
+        :param str directory: directory written by ShardedIndex.build
+        :param int workers: number of query processes. Defaults to the number of cores. 1 searches in this process
+        :param int cache_size: size of the interval cache of every shard
+        :param float timeout: seconds to wait for the results of one query
+        '''
+        with open(os.path.join(directory, MANIFEST_NAME)) as f:
+            manifest = json.load(f)
+        self._directory = directory
+        self._shards = manifest["shards"]
+        self._documents = manifest["documents"]
+        self._overlap = manifest["overlap"]
+        self._chunk_size = manifest["chunk_size"]
+        self._workers = min(workers or os.cpu_count() or 1, max(len(self._shards), 1))
+        self._timeout = timeout
+        if self._workers > 1:
+            self._indexes = None
+            self._pool = ProcessPoolExecutor(max_workers=self._workers, initializer=_initWorker, initargs=(directory, self._shards, cache_size))
+        else:
+            self._indexes = _loadShards(directory, self._shards, cache_size)
+            self._pool = None
+
+    @classmethod
+    def build(cls, documents, directory: str, chunk_size: int = None, overlap: int = 0, workers: int = None, meta_char: str = '$', **index_options):
+        '''
+        Build one FMIndex per shard in parallel and save them to directory
+        :param documents: iterable of (name, text) pairs, or a dict from name to text (see TextReader.read_documents)
+        :param int chunk_size: split documents into shards of this many characters. None makes one shard per document
+        :param int overlap: characters of the next chunk added to every chunk. Patterns of up to overlap + 1
+          characters are found across chunk boundaries
+        :param int workers: number of build processes, and of query processes of the returned index
+        :param str meta_char: terminator of every shard, it must sort before every character of the corpus
+        :param index_options: passed on to the FMIndex constructor. cache_size is also used by the returned index
+        '''
+        if chunk_size is not None and chunk_size < 1:
+            raise ValueError("Chunk size must be at least 1")
+        if overlap < 0:
+            raise ValueError("Overlap cannot be negative")
+        if isinstance(documents, dict):
+            documents = documents.items()
+        os.makedirs(directory, exist_ok=True)
+        shards = []
+        lengths = {}
+        with ProcessPoolExecutor(max_workers=workers or os.cpu_count() or 1) as builder:
+            futures = []
+            for document, document_text in documents:
+                if document in lengths:
+                    raise ValueError(f"Duplicate document name {document!r}")
+                lengths[document] = len(document_text)
+                for shard, text in _splitDocument(document, document_text, chunk_size, overlap):
+                    shard["path"] = f'shard-{len(shards):05d}.fmi'
+                    shards.append(shard)
+                    futures.append(builder.submit(_buildShard, os.path.join(directory, shard["path"]), text, meta_char, index_options))
+            for future in futures:
+                future.result()
+
+        manifest = {
+            "chunk_size": chunk_size,
+            "overlap": overlap,
+            "documents": [{"name": name, "length": length} for name, length in lengths.items()],
+            "shards": shards,
+        }
+        # The manifest is written last, so a directory with a manifest always holds every shard
+        tmp_path = os.path.join(directory, f'{MANIFEST_NAME}.{os.getpid()}.tmp')
+        with open(tmp_path, 'w') as f:
+            json.dump(manifest, f)
+        os.replace(tmp_path, os.path.join(directory, MANIFEST_NAME))
+        return cls(directory, workers=workers, cache_size=index_options.get('cache_size', 0))
+
+    @property
+    def shards(self) -> int:
+        return len(self._shards)
+
+    @property
+    def documents(self) -> list[dict]:
+        '''
+        Name and length of every document, in corpus order
+        '''
+        return [dict(document) for document in self._documents]
+
+    def _checkPattern(self, pattern: str):
+        if not pattern:
+            raise ValueError("Pattern cannot be empty")
+        if self._chunk_size is not None and len(pattern) > self._overlap + 1:
+            raise ValueError(f"Patterns can be at most {self._overlap + 1} characters long, the chunk overlap plus one")
+
+    def _fanOut(self, task, local_task, pattern: str) -> list:
+        '''
+        Run a query on every shard, one group of shards per worker, and return the results in shard order
+        '''
+        self._checkPattern(pattern)
+        if self._pool is None:
+            return [local_task(index, shard, pattern) for index, shard in zip(self._indexes, self._shards)]
+        groups = [list(range(w, len(self._shards), self._workers)) for w in range(self._workers)]
+        futures = [self._pool.submit(task, group, pattern) for group in groups]
+        results = [None] * len(self._shards)
+        for group, future in zip(groups, futures):
+            for k, result in zip(group, future.result(self._timeout)):
+                results[k] = result
+        return results
+
+    def count(self, pattern: str) -> int:
+        '''
+        Number of occurrences of the pattern in the whole corpus
+        '''
+        return sum(self._fanOut(_countShards, _countShard, pattern))
+
+    def countByDocument(self, pattern: str) -> dict:
+        '''
+        Number of occurrences of the pattern in every document that has at least one
+        '''
+        counts = {}
+        for shard, count in zip(self._shards, self._fanOut(_countShards, _countShard, pattern)):
+            if count:
+                counts[shard["document"]] = counts.get(shard["document"], 0) + count
+        return counts
+
+    def locate(self, pattern: str) -> list[tuple]:
+        '''
+        Sorted list of (document, position in the document) of the occurrences of the pattern
+        Documents are ordered as in the corpus
+        '''
+        order = {document["name"]: k for k, document in enumerate(self._documents)}
+        matches = []
+        for shard, positions in zip(self._shards, self._fanOut(_locateShards, _locateShard, pattern)):
+            matches.extend((shard["document"], position) for position in positions)
+        return sorted(matches, key=lambda match: (order[match[0]], match[1]))
+
+    def close(self):
+        if self._pool is not None:
+            self._pool.shutdown(wait=True)
@@ -1,5 +1,5 @@
+from array import array
 from itertools import zip_longest, islice
-from utils import timer_func
 
 def to_int_keys_best(l):
     """
@@ -16,7 +16,6 @@ def to_int_keys_best(l):
     index = {v: i for i, v in enumerate(ls)}
     return [index[v] for v in l]
 
-@timer_func
 def suffix_array_best(s,debug: bool=False):
     """
     suffix array of s
@@ -35,4 +34,141 @@ def suffix_array_best(s,debug: bool=False):
     sa = [0] * n
     for i in range(n):
       sa[line[i]] = i
-    return sa
\ No newline at end of file
+    return sa
+
+def to_symbol_codes(s):
+    """
+    s: str, bytes or a sequence of non-negative ints (e.g. an array buffer)
+    returns: (the integer symbol codes, the largest code)
+    Strings are mapped to the rank of each character in their sorted alphabet.
+    bytes, bytearrays, arrays and lists are used as they are, without a copy
+    """
+    if isinstance(s, str):
+        s = to_int_keys_best(s)
+    elif not isinstance(s, (list, bytes, bytearray, array)):
+        s = list(s)
+    return s, max(s, default=0)
+
+def suffix_array_typecode(n: int):
+    """
+    returns: array typecode of a suffix array of length n: int32, or int64 past 2^31 positions
+    Signed, so that -1 can mark empty slots during the construction
+    """
+    return 'i' if n < 1 << 31 else 'q'
+
+
+def _sa_is(s, upper):
+    """
+    s: sequence of ints in [0, upper] (list, bytes or array)
+    returns: suffix array of s as an int32/int64 array, using induced sorting of the LMS substrings
+    Every working buffer is a typed array: 1 byte per position for the types
+    and 4 or 8 bytes for the suffix array, the LMS positions and the recursion
+    """
+    n = len(s)
+    typecode = suffix_array_typecode(n)
+    if n <= 1:
+        return array(typecode, range(n))
+    if n == 2:
+        return array(typecode, [0, 1] if s[0] < s[1] else [1, 0])
+
+    # is_s[i] is 1 if the suffix at i is S-type (smaller than the suffix at i + 1)
+    is_s = bytearray(n)
+    for i in range(n - 2, -1, -1):
+        is_s[i] = is_s[i + 1] if s[i] == s[i + 1] else s[i] < s[i + 1]
+
+    # Bucket boundaries: L-type suffixes fill a bucket from the front, S-type from the back
+    sum_l = [0] * (upper + 2)
+    sum_s = [0] * (upper + 2)
+    for i in range(n):
+        if is_s[i]:
+            sum_l[s[i] + 1] += 1
+        else:
+            sum_s[s[i]] += 1
+    for c in range(upper + 1):
+        sum_s[c] += sum_l[c]
+        sum_l[c + 1] += sum_s[c]
+
+    sa = array(typecode)
+
+    def induce(lms):
+        sa[:] = array(typecode, [-1]) * n
+        buf = sum_s[:]
+        for d in lms:
+            sa[buf[s[d]]] = d
+            buf[s[d]] += 1
+        buf = sum_l[:]
+        sa[buf[s[n - 1]]] = n - 1
+        buf[s[n - 1]] += 1
+        for i in range(n):
+            v = sa[i] - 1
+            if v >= 0 and not is_s[v]:
+                sa[buf[s[v]]] = v
+                buf[s[v]] += 1
+        buf = sum_l[:]
+        for i in range(n - 1, -1, -1):
+            v = sa[i] - 1
+            if v >= 0 and is_s[v]:
+                buf[s[v] + 1] -= 1
+                sa[buf[s[v] + 1]] = v
+
+    lms_map = array(typecode, [-1]) * (n + 1)
+    lms = array(typecode)
+    for i in range(1, n):
+        if not is_s[i - 1] and is_s[i]:
+            lms_map[i] = len(lms)
+            lms.append(i)
+    m = len(lms)
+
+    induce(lms)
+    if not m:
+        return sa
+
+    # Name the LMS substrings in their induced order and sort them recursively
+    sorted_lms = array(typecode, (v for v in sa if lms_map[v] != -1))
+    rec_s = array(typecode, [0]) * m
+    rec_upper = 0
+    for i in range(1, m):
+        l, r = sorted_lms[i - 1], sorted_lms[i]
+        end_l = lms[lms_map[l] + 1] if lms_map[l] + 1 < m else n
+        end_r = lms[lms_map[r] + 1] if lms_map[r] + 1 < m else n
+        same = end_l - l == end_r - r
+        if same:
+            while l < end_l and s[l] == s[r]:
+                l += 1
+                r += 1
+            same = l < n and s[l] == s[r]
+        if not same:
+            rec_upper += 1
+        rec_s[lms_map[sorted_lms[i]]] = rec_upper
+
+    del sorted_lms
+    rec_sa = _sa_is(rec_s, rec_upper)
+    del rec_s, lms_map
+    induce(array(typecode, (lms[i] for i in rec_sa)))
+    return sa
+
+def suffix_array_sais(s,debug: bool=False):
+    """
+    suffix array of s
+    s can be a str or an integer-encoded buffer (list, array, bytes)
+    SA-IS, O(n)
+    """
+    codes, upper = to_symbol_codes(s)
+    return _sa_is(codes, upper)
+
+# Registry of the available construction backends.
+# 'doubling' is kept as the reference implementation
+SUFFIX_ARRAY_BUILDERS = {
+    'doubling': suffix_array_best,
+    'sais': suffix_array_sais,
+}
+
+def get_suffix_array_builder(name: str):
+    """
+    name: key in SUFFIX_ARRAY_BUILDERS
+    returns: the suffix array construction function
+    """
+    try:
+        return SUFFIX_ARRAY_BUILDERS[name]
+    except KeyError:
+        raise ValueError(f"Unknown suffix array algorithm '{name}'. Choose one of: {', '.join(SUFFIX_ARRAY_BUILDERS)}")
@@ -0,0 +1,99 @@
+from constants import READ_CHUNK_SIZE
+
+def _iter_chunks(source, chunk_size: int):
+    """
+    source: path to a file, or an iterable of str / bytes chunks
+    returns: iterator over bytes chunks
+    """
+    if isinstance(source, str):
+        with open(source, 'rb') as f:
+            while True:
+                chunk = f.read(chunk_size)
+                if not chunk:
+                    return
+                yield chunk
+    else:
+        for chunk in source:
+            yield chunk.encode('latin-1') if isinstance(chunk, str) else bytes(chunk)
+
+def read_text(source, fasta: bool = True, meta_char: str = '$', max_lines: int = None, chunk_size: int = READ_CHUNK_SIZE):
+    """
+    Stream a text into one compact buffer, ready to be indexed
+    source: path to a text/FASTA file, or an iterable of str / bytes chunks
+    fasta: skip header lines that start with '>'
+    meta_char: appended to the end of the text. It must sort before every character of the text
+    max_lines: stop after this many input lines (header lines included)
+    returns: (bytearray holding the text, character set of the text as a sorted str)
+    Newlines and carriage returns are dropped and the character set is collected in the same pass.
+    Only one chunk is held besides the output buffer, so reading needs n + chunk_size bytes
+    """
+    text = bytearray()
+    seen = set()
+    in_header = False
+    at_line_start = True
+    lines_read = 0
+    for chunk in _iter_chunks(source, chunk_size):
+        lines = chunk.split(b'\n')
+        for k, line in enumerate(lines):
+            if k:
+                lines_read += 1
+                if max_lines is not None and lines_read >= max_lines:
+                    break
+                in_header = False
+                at_line_start = True
+            if not line:
+                continue
+            if at_line_start and fasta and line[0] == ord('>'):
+                in_header = True
+            at_line_start = False
+            if not in_header:
+                line = line.replace(b'\r', b'')
+                seen.update(set(line))
+                text += line
+        else:
+            continue
+        break
+
+    meta = meta_char.encode('latin-1')
+    if meta and seen and min(seen) <= meta[0]:
+        raise ValueError(f"Meta character {meta_char!r} must sort before every character of the text")
+    text += meta
+    character_set = ''.join(sorted(chr(b) for b in seen.union(meta)))
+    return text, character_set
+
+def read_documents(source, chunk_size: int = READ_CHUNK_SIZE):
+    """
+    Stream the records of a FASTA file as separate documents
+    source: path to a text/FASTA file, or an iterable of str / bytes chunks
+    returns: iterator over (name, text) pairs. A record is named by its header line without the '>'.
+    Text before the first header (or a file without headers) is named 'document-0'
+    Newlines and carriage returns are dropped as in read_text. Only one record is held at a time
+    """
+    name = None
+    text = bytearray()
+    header = None # the header line being read, until its newline
+    at_line_start = True
+    for chunk in _iter_chunks(source, chunk_size):
+        for k, line in enumerate(chunk.split(b'\n')):
+            if k:
+                if header is not None:
+                    name = header.decode('latin-1').strip()
+                    header = None
+                at_line_start = True
+            if not line:
+                continue
+            if at_line_start and line[0] == ord('>'):
+                if text or name is not None:
+                    yield name or 'document-0', text.decode('latin-1')
+                name = None
+                text = bytearray()
+                header = bytearray(line[1:])
+            elif header is not None:
+                header += line
+            else:
+                text += line.replace(b'\r', b'')
+            at_line_start = False
+    if header is not None:
+        name = header.decode('latin-1').strip()
+    if text or name is not None:
+        yield name or 'document-0', text.decode('latin-1')
@@ -0,0 +1,246 @@
+from array import array
+from utils import encodeText
+from BitVector import get_bit_vector_type, deserialize_bit_vector
+from constants import MAX_VEC_PRINT_LENGTH
+
+class WaveletMatrix:
+    '''
+    Representation of a Wavelet Matrix over the given text and character set
+    Characters are encoded by their index in the character set, using ⌈lgΣ⌉ bits
+    Level l stores one BitVector with bit l (most significant first) of every code,
+    after the codes have been stably partitioned by the bits of the previous levels (0s first)
+    Public methods:
+      getRank(charIdx,idx) -> rank of charIdx-th character in the set at idx position in text
+      getCharAndRank(idx) -> (index of the character at idx, its rank at idx)
+      getRankPair(charIdx,i,j) -> (getRank(charIdx,i), getRank(charIdx,j)) in one descent
+      getRankAll(idx) -> list with the rank of every character at idx
+      getRanks(charIdx,idxs) -> getRank over a numpy array of positions
+      access(idx) -> index of the character at idx
+      select(charIdx,k) -> position of the k-th occurrence (from 0) of the charIdx-th character
+    Example use:
+    matrix = WaveletMatrix('acacaac$',character_set="$ac")
+    matrix.getRank(1,3) <-> rank_a(3)
+
+    Stores n bits per level and one zero count per level => O(nlgΣ) bits space, no per-node objects
+    '''
+
+    def __init__(self,text: str, character_set: str, block_size = None,workers: int = None,bitvector: str = 'plain',debug:bool = False) -> None:
+      '''
+        Build a wavelet matrix that supports efficient rank_i(j) queries
+        :param text: string to represent as a Wavelet Matrix, or a sequence of character indexes (e.g. bytes)
+        :param str character_set: an ordered string of all possible characters
+        :param int block_size: bits per superblock of the rank directory of every level
+        :param int workers: build with numpy, using this many processes for the levels. None uses the pure Python build
+        :param str bitvector: encoding of the level bitvectors, 'plain' (BitVector), 'rrr' (RRRBitVector) or 'runlength' (RunLengthBitVector)
+      '''
+      self._size = len(text)
+      self._character_size = len(character_set)
+      if not len(set(character_set)) == self._character_size:
+        raise ValueError("Character set cannot have duplicate characters")
+      if len(character_set) < 2:
+        raise ValueError("Character set must have at least two unique characters")
+      self._height = (self._character_size - 1).bit_length()
+      self._bit_vector_type = get_bit_vector_type(bitvector)
+
+      codes = encodeText(text,character_set) if isinstance(text,str) else text
+      if workers is None:
+        self._buildLevels(codes,block_size)
+      else:
+        from ParallelBuild import encode_text, build_matrix_levels_parallel
+        self._levels,zeros = build_matrix_levels_parallel(encode_text(codes,character_set),self._height,block_size=block_size,workers=workers,bit_vector_type=self._bit_vector_type)
+        self._zeros = array('Q',zeros)
+
+      # Position of the first occurrence of every character in the last level.
+      # It does not depend on the queried index, so getRank only has to follow one pointer
+      self._starts = array('Q',[self._descend(charIdx,0) for charIdx in range(self._character_size)])
+
+    def _buildLevels(self,codes,block_size:int):
+      '''
+      Stably partition the codes by one bit per level, most significant bit first
+      Byte codes are partitioned with bytes.translate, so a level costs n bytes and no per-character Python objects
+      '''
+      if isinstance(codes,(array,memoryview)) and codes.itemsize == 1:
+        codes = bytes(codes)
+      is_bytes = isinstance(codes,(bytes,bytearray))
+      if not is_bytes:
+        codes = list(codes)
+      self._levels = []
+      self._zeros = array('Q')
+      for level in range(self._height):
+        shift = self._height - level - 1
+        if is_bytes:
+          bits = codes.translate(bytes((code >> shift) & 1 for code in range(256)))
+          ones = bytes(code for code in range(256) if (code >> shift) & 1)
+          zero_codes = codes.translate(None,ones)
+          one_codes = codes.translate(None,bytes(sorted(set(range(256)).difference(ones))))
+        else:
+          bits = bytes((code >> shift) & 1 for code in codes)
+          zero_codes = [code for code,bit in zip(codes,bits) if not bit]
+          one_codes = [code for code,bit in zip(codes,bits) if bit]
+        self._levels.append(self._bit_vector_type(bits,superblock_size=block_size))
+        self._zeros.append(len(zero_codes))
+        codes = zero_codes + one_codes
+
+    @property
+    def height(self):
+      return self._height
+
+    def _descend(self,charIdx,idx):
+      '''
+      Follow position idx down to the last level along the bits of charIdx
+      '''
+      for level in range(self._height):
+        bit_vector = self._levels[level]
+        if (charIdx >> (self._height - level - 1)) & 1:
+          idx = self._zeros[level] + bit_vector.rank1(idx)
+        else:
+          idx = bit_vector.rank0(idx)
+      return idx
+
+    def getRank(self,charIdx,idx,debug: bool =False):
+      if idx > self._size:
+        raise ValueError(f"Cannot get rank at index {idx}. Idx can be at most {self._size}")
+      if charIdx < 0 or charIdx >= self._character_size:
+        raise ValueError(f"Cannot get rank of char-{charIdx}. There are only {self._character_size} characters")
+      return self._descend(charIdx,idx) - self._starts[charIdx]
+
+    def getRankPair(self,charIdx,i,j):
+      '''
+      Follow positions i and j down the levels together
+      '''
+      if j > self._size or i > j:
+        raise ValueError(f"Cannot get ranks at indexes {i},{j}. Need i <= j <= {self._size}")
+      if charIdx < 0 or charIdx >= self._character_size:
+        raise ValueError(f"Cannot get rank of char-{charIdx}. There are only {self._character_size} characters")
+      for level in range(self._height):
+        rank_i,rank_j = self._levels[level].rank1Pair(i,j)
+        if (charIdx >> (self._height - level - 1)) & 1:
+          i = self._zeros[level] + rank_i
+          j = self._zeros[level] + rank_j
+        else:
+          i -= rank_i
+          j -= rank_j
+      start = self._starts[charIdx]
+      return i - start,j - start
+
+    def getRankAll(self,idx):
+      '''
+      Split the range [0,idx) level by level into the ranges of every code prefix
+      The ranges left at the last level hold the occurrences of each character
+      '''
+      if idx > self._size:
+        raise ValueError(f"Cannot get rank at index {idx}. Idx can be at most {self._size}")
+      ranges = [(0,0,idx)]
+      for level in range(self._height):
+        bit_vector = self._levels[level]
+        zeros = self._zeros[level]
+        shift = self._height - level - 1
+        next_ranges = []
+        for prefix,start,end in ranges:
+          rank_start,rank_end = bit_vector.rank1Pair(start,end)
+          next_ranges.append((prefix << 1,start - rank_start,end - rank_end))
+          if ((prefix << 1) | 1) << shift < self._character_size:
+            next_ranges.append(((prefix << 1) | 1,zeros + rank_start,zeros + rank_end))
+        ranges = next_ranges
+      ranks = [0] * self._character_size
+      for charIdx,start,end in ranges:
+        ranks[charIdx] = end - start
+      return ranks
+
+    def getRanks(self,charIdx,idxs):
+      '''
+      Vectorized getRank: one batched rank per level for all positions
+      '''
+      if charIdx < 0 or charIdx >= self._character_size:
+        raise ValueError(f"Cannot get rank of char-{charIdx}. There are only {self._character_size} characters")
+      for level in range(self._height):
+        bit_vector = self._levels[level]
+        if (charIdx >> (self._height - level - 1)) & 1:
+          idxs = self._zeros[level] + bit_vector.rank1Many(idxs)
+        else:
+          idxs = bit_vector.rank0Many(idxs)
+      return idxs - self._starts[charIdx]
+
+    def getCharAndRank(self,idx):
+      '''
+      Read the code of the character at idx one bit per level,
+      following idx down to the last level where its rank can be read off
+      '''
+      if idx < 0 or idx >= self._size:
+        raise ValueError(f"Cannot get character at index {idx}. Idx can be at most {self._size - 1}")
+      charIdx = 0
+      for level in range(self._height):
+        bit_vector = self._levels[level]
+        bit = bit_vector.access(idx)
+        charIdx = (charIdx << 1) | bit
+        if bit:
+          idx = self._zeros[level] + bit_vector.rank1(idx)
+        else:
+          idx = bit_vector.rank0(idx)
+      return charIdx,idx - self._starts[charIdx]
+
+    def access(self,idx):
+      return self.getCharAndRank(idx)[0]
+
+    def select(self,charIdx,k):
+      '''
+      The k-th occurrence sits at starts[charIdx] + k in the last level.
+      Follow that position back up, undoing the partition of every level with select
+      '''
+      if charIdx < 0 or charIdx >= self._character_size:
+        raise ValueError(f"Cannot select char-{charIdx}. There are only {self._character_size} characters")
+      count = self.getRank(charIdx,self._size)
+      if k < 0 or k >= count:
+        raise ValueError(f"Cannot select occurrence {k} of char-{charIdx}. It occurs {count} times")
+      idx = self._starts[charIdx] + k
+      for level in range(self._height - 1,-1,-1):
+        bit_vector = self._levels[level]
+        if (charIdx >> (self._height - level - 1)) & 1:
+          idx = bit_vector.select1(idx - self._zeros[level])
+        else:
+          idx = bit_vector.select0(idx)
+      return idx
+
+    def serialize(self,writer) -> dict:
+      return {
+        "size": self._size,
+        "character_size": self._character_size,
+        "height": self._height,
+        "levels": [bit_vector.serialize(writer) for bit_vector in self._levels],
+        "zeros": writer.addBuffer(self._zeros),
+        "starts": writer.addBuffer(self._starts),
+      }
+
+    @classmethod
+    def deserialize(cls,state: dict,reader):
+      matrix = cls.__new__(cls)
+      matrix._size = state["size"]
+      matrix._character_size = state["character_size"]
+      matrix._height = state["height"]
+      matrix._levels = [deserialize_bit_vector(level,reader) for level in state["levels"]]
+      matrix._zeros = reader.getBuffer(state["zeros"])
+      matrix._starts = reader.getBuffer(state["starts"])
+      return matrix
+
+    def getSpaceUsage(self) -> dict:
+      '''
+      Report the space used in bits by the level bitvectors
+        bits: n bits per level
+        payload_bits: bits in the packed words
+        directory_bits: bits in the superblock and block rank directories, plus the per-level metadata
+        overhead: directory bits per bit of the bitvectors
+      '''
+      usage = {"bits": 0, "payload_bits": 0, "directory_bits": 0}
+      for bit_vector in self._levels:
+        for key,value in bit_vector.getSpaceUsage().items():
+          usage[key] += value
+      usage["directory_bits"] += (len(self._zeros) + len(self._starts)) * 64
+      usage["overhead"] = usage["directory_bits"] / usage["bits"] if usage["bits"] else 0
+      return usage
+
+    def __repr__(self) -> str:
+      s = 'WaveletMatrix:\n'
+      for level,bit_vector in enumerate(self._levels):
+        bits = repr(bit_vector)
+        s+= f'  Level {level} (zeros: {self._zeros[level]}): {bits[:MAX_VEC_PRINT_LENGTH]}{"..." if len(bits) > MAX_VEC_PRINT_LENGTH else ""}\n'
+      return s
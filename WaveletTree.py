@@ -2,10 +2,19 @@ from enum import Enum
 import string
 import warnings
 import math
+from array import array
 from collections import deque
-from utils import timer_func,getIntFromBits
+import heapq
+from utils import encodeText
 from WaveletTreeNode import Node
-from constants import MAX_TREE_PRINT_DEPTH, BIT_PACK_SIZE
+from BitVector import BitVector, get_bit_vector_type
+from constants import BIT_PACK_SIZE, MAX_TREE_PRINT_DEPTH
+
+# Word index and bit offset of a position in a packed bitvector, as shifts and masks
+_WORD_SHIFT = BIT_PACK_SIZE.bit_length() - 1
+_WORD_MASK = BIT_PACK_SIZE - 1
+# _LOW_BITS[k] keeps the k lowest bits of a word
+_LOW_BITS = [(1 << k) - 1 for k in range(BIT_PACK_SIZE)]
 
 class WaveletTree:
     '''
@@ -13,6 +22,16 @@ class WaveletTree:
     Uses a Node object to store the bitvectors
     Public methods:
       getRank(charIdx,idx) -> rank of charIdx-th character in the set at idx position in text
+      getCharAndRank(idx) -> (index of the character at idx, its rank at idx)
+      getRankPair(charIdx,i,j) -> (getRank(charIdx,i), getRank(charIdx,j)) in one descent
+      getRankAll(idx) -> list with the rank of every character at idx
+      getRanks(charIdx,idxs) -> getRank over a numpy array of positions
+      access(idx) -> index of the character at idx
+      select(charIdx,k) -> position of the k-th occurrence (from 0) of the charIdx-th character
+      rangeQuantile(i,j,k) -> k-th smallest character index in text[i:j]
+      rangeTopK(i,j,k) -> the k most frequent characters in text[i:j], as (character index, count)
+      rangeCount(i,j,lo,hi) -> number of characters of text[i:j] whose index is in [lo,hi)
+    Every query costs O(lgΣ) ranks or selects (rangeTopK and rangeCount one descent per reported node)
     Public properties:
       root
     Example use:
@@ -21,18 +40,29 @@ class WaveletTree:
     tree.getRank(2,5) <-> rank_c(5)
 
     Stores n bits at every depth => O(nlgΣ) bits space
-
-    [TODO] If we pre-compute and store ranks at block boundaries,
-    additional space is used. Need to factor this in to find the total space used.
+    With shape='huffman' the split points follow the character frequencies instead, so frequent characters
+    sit closer to the root and the bitvectors hold about n(H0 + 2) bits in total. The tree stays alphabetic
+    (every node covers a contiguous range of characters), so every query works the same on both shapes
+    Every bitvector also keeps a two-level rank directory so that getRank costs O(1) per level.
+    The directory adds o(n) bits per level; getSpaceUsage() reports the exact total.
+    With plain bitvectors, getRank, getRankPair, getCharAndRank and getRankAll run as one loop over
+    a level-ordered copy of the node layout (see _flatten) instead of recursing through the Nodes
     '''
     
-    @timer_func
-    def __init__(self,text: str, character_set: str, block_size = None,debug:bool = False) -> None:
+    SHAPES = ('balanced','huffman')
+    # Answer the rank queries from the flat layout
+    flat_queries = True
+
+    def __init__(self,text: str, character_set: str, block_size = None,workers: int = None,shape: str = 'balanced',bitvector: str = 'plain',debug:bool = False) -> None:
       '''
         Build a wavelet tree that supports efficient rank_i(j) queries
-        :param str text: string to represent as a Wavelet Tree
+        :param text: string to represent as a Wavelet Tree, or a sequence of character indexes (e.g. bytes)
         :param str character_set: an ordered string of all possible characters
-        :param function block_size: size of the blocks. Rank values are pre-computed at block boundaries
+        :param int block_size: bits per superblock of the rank directory. Absolute ranks are pre-computed at superblock boundaries
+        :param int workers: build with numpy, using this many processes for sibling subtrees. None uses the pure Python build
+        :param str shape: 'balanced' splits every character range in half,
+          'huffman' picks the splits that minimize the total size of the bitvectors for the character frequencies of the text
+        :param str bitvector: encoding of the node bitvectors, 'plain' (BitVector), 'rrr' (RRRBitVector) or 'runlength' (RunLengthBitVector)
       '''
       self._size = len(text)
       self._character_size = len(character_set)
@@ -40,64 +70,413 @@ class WaveletTree:
         raise ValueError("Character set cannot have duplicate characters")
       if len(character_set) < 2:
         raise ValueError("Character set must have at least two unique characters")
-      self._root = self._buildTree(text,character_set,block_size,0,self._character_size,range(self._size))
+      if shape not in self.SHAPES:
+        raise ValueError(f"Unknown shape '{shape}'. Choose one of: {', '.join(self.SHAPES)}")
+      self._shape = shape
+      self._bit_vector_type = get_bit_vector_type(bitvector)
+      codes = encodeText(text,character_set) if isinstance(text,str) else text
+      if isinstance(codes,(array,memoryview)) and codes.itemsize == 1:
+        codes = bytes(codes)
+      splits = None
+      if shape == 'huffman':
+        splits = self.getAlphabeticSplits([codes.count(charIdx) for charIdx in range(self._character_size)])
+      if workers is None:
+        self._root = self._buildTree(codes,block_size,0,self._character_size,splits=splits)
+      else:
+        from ParallelBuild import encode_text, build_tree_parallel
+        self._root = build_tree_parallel(encode_text(codes,character_set),self._character_size,block_size=block_size,workers=workers,splits=splits,bit_vector_type=self._bit_vector_type)
+      self._flatten()
+
+    @staticmethod
+    def getAlphabeticSplits(frequencies: list[int]) -> dict:
+      '''
+      Split points of the optimal alphabetic tree for the given character frequencies, as {(chrlo,chrhi): mid}
+      A node over [i,j) stores one bit per occurrence of its characters, so the total size is
+        cost(i,j) = W(i,j) + min over i < m < j of cost(i,m) + cost(m,j)
+      where W(i,j) is the number of occurrences of the characters in [i,j). The best m never moves left
+      when the range grows (Knuth), which makes the dynamic program O(Σ²) instead of O(Σ³)
+      '''
+      sigma = len(frequencies)
+      weight = [0]
+      for frequency in frequencies:
+        weight.append(weight[-1] + frequency)
+      cost = [[0] * (sigma + 1) for _ in range(sigma + 1)]
+      best = [[0] * (sigma + 1) for _ in range(sigma + 1)]
+      for i in range(sigma):
+        best[i][i + 1] = i + 1
+      for width in range(2,sigma + 1):
+        for i in range(sigma - width + 1):
+          j = i + width
+          lo = max(best[i][j - 1],i + 1)
+          hi = min(best[i + 1][j],j - 1)
+          best_cost = None
+          for m in range(lo,hi + 1):
+            split_cost = cost[i][m] + cost[m][j]
+            if best_cost is None or split_cost < best_cost:
+              best_cost,best[i][j] = split_cost,m
+          cost[i][j] = best_cost + weight[j] - weight[i]
+
+      # Only keep the ranges that are nodes of the tree
+      splits = {}
+      ranges = [(0,sigma)]
+      while ranges:
+        i,j = ranges.pop()
+        if j - i > 1:
+          splits[(i,j)] = best[i][j]
+          ranges.extend(((i,best[i][j]),(best[i][j],j)))
+      return splits
 
     @property
     def root(self):
       return self._root
 
-    def _buildTree(self,text:str,character_set:str,block_size:int,chrlo: int,chrhi: int, node_indexes: list[int],depth: int = 0):
+    @property
+    def shape(self):
+      return self._shape
+
+    def _buildTree(self,codes,block_size:int,chrlo: int,chrhi: int,depth: int = 0,splits: dict = None):
       '''
         Recursively build the tree by partitioning the character_set using chrlo and chrhi
+        :param codes: the characters of the node, in text order. bytes are partitioned with bytes.translate,
+          so a level costs n bytes and no per-character Python objects
+        :param dict splits: split point of every character range, see getAlphabeticSplits(). None splits ranges in half
       '''
-      mid = chrlo + math.ceil((chrhi - chrlo) / 2)
+      if splits is None or (chrlo,chrhi) not in splits:
+        mid = chrlo + math.ceil((chrhi - chrlo) / 2)
+      else:
+        mid = splits[(chrlo,chrhi)]
 
       # Leaf node
       if chrlo == mid or chrhi == mid:
-        return Node(chrlo,chrhi,size=len(node_indexes),depth=depth,block_size=block_size)
-
-      bit_vector = []
-      child_indexes = {
-          "left": [],
-          "right": []
-      }
-      ranks = []
-      runningRank = 0
-      runningBits = [0] * BIT_PACK_SIZE
-      runningBitsCtr = 0
-      for j,i in enumerate(node_indexes):
-        in_right_child = text[i] >= character_set[mid]
-
-        # Pre-compute ranks and store at block boundaries
-        if block_size is not None:
-          if not j % block_size:
-            ranks.append(runningRank)
-          runningRank += int(in_right_child)
-        
-        # Pack bits and store as ints of size INT_SIZE
-        runningBits[runningBitsCtr] = int(in_right_child)
-        runningBitsCtr += 1
-        if runningBitsCtr == BIT_PACK_SIZE or i == node_indexes[-1]:
-          bit_vector.append(getIntFromBits(runningBits))
-          # print(f'adding bits:: {runningBits}')
-          runningBits = [0] * BIT_PACK_SIZE
-          runningBitsCtr = 0
-
-        child_indexes["right" if in_right_child else "left"].append(i)
-
-      # If the length of the text is a multiple of block_size
-      # Add an extra rank at the end
-      if block_size is not None and not (j+1) % block_size:
-        ranks.append(runningRank)
-     
-      node = Node(chrlo,chrhi,bit_vector=bit_vector,size=len(node_indexes),depth=depth,block_size=block_size,ranks=ranks)
-      node.left = self._buildTree(text,character_set,block_size,chrlo,mid,child_indexes["left"],depth=depth+1)
-      node.right = self._buildTree(text,character_set,block_size,mid,chrhi,child_indexes["right"],depth=depth+1)
+        return Node(chrlo,chrhi,size=len(codes),depth=depth)
+
+      if isinstance(codes,(bytes,bytearray)):
+        bits = codes.translate(bytes(mid) + b'\x01' * (256 - mid))
+        left_codes = codes.translate(None,bytes(range(mid,256)))
+        right_codes = codes.translate(None,bytes(range(mid)))
+      else:
+        bits = bytes(code >= mid for code in codes)
+        left_codes = [code for code in codes if code < mid]
+        right_codes = [code for code in codes if code >= mid]
+
+      # Rank directory is sampled every block_size bits (rounded up to a whole word)
+      bit_vector = self._bit_vector_type(bits,superblock_size=block_size)
+      node = Node(chrlo,chrhi,bit_vector=bit_vector,size=len(codes),depth=depth,mid=mid)
+      del bits
+      node.left = self._buildTree(left_codes,block_size,chrlo,mid,depth=depth+1,splits=splits)
+      del left_codes
+      node.right = self._buildTree(right_codes,block_size,mid,chrhi,depth=depth+1,splits=splits)
       return node
 
-    @timer_func
+    def _flatten(self):
+      '''
+      Number the internal nodes in level order and store them as parallel lists, k-th entry for the k-th node:
+        mids: split point, characters below it go left
+        lefts, rights: level-order number of an internal child, or ~c for the leaf of the c-th character
+        words, superblocks, blocks: packed bits and rank directory of the node's bitvector
+      A rank is computed in place from the arrays of the node, without a method call per level.
+      The arrays are shared with the Nodes, so this costs O(Σ) references. Trees of compressed
+      bitvectors are not flattened and answer through the Nodes
+      '''
+      self._flat = None
+      if self._root.is_leaf:
+        return
+      internal = [self._root]
+      for node in internal:
+        if type(node.bit_vector) is not BitVector or node.bit_vector._words_per_superblock != self._root.bit_vector._words_per_superblock:
+          return
+        internal.extend(child for child in (node.left,node.right) if not child.is_leaf)
+      number = {id(node): k for k,node in enumerate(internal)}
+      child = lambda node: ~node.chrlo if node.is_leaf else number[id(node)]
+      self._words_per_superblock = self._root.bit_vector._words_per_superblock
+      self._flat = (
+        [node.mid for node in internal],
+        [child(node.left) for node in internal],
+        [child(node.right) for node in internal],
+        [node.bit_vector._words for node in internal],
+        [node.bit_vector._superblock_ranks for node in internal],
+        [node.bit_vector._block_ranks for node in internal],
+      )
+
+    def _checkRank(self,charIdx,idx):
+      if idx < 0 or idx > self._size:
+        raise ValueError(f"Cannot get rank at index {idx}. Idx can be at most {self._size}")
+      if charIdx < 0 or charIdx >= self._character_size:
+        raise ValueError(f"Cannot get rank of char-{charIdx}. There are only {self._character_size} characters")
+
     def getRank(self,charIdx,idx,debug: bool =False):
-      return self._root.getRank(charIdx,idx)
+      '''
+      Follow idx down the path of charIdx: idx becomes the rank of the 1s (right) or 0s (left) in every node
+      '''
+      if self._flat is None or not self.flat_queries:
+        return self._root.getRank(charIdx,idx)
+      self._checkRank(charIdx,idx)
+      mids,lefts,rights,words,superblocks,blocks = self._flat
+      words_per_superblock = self._words_per_superblock
+      low_bits = _LOW_BITS
+      node = 0
+      while node >= 0:
+        w = idx >> _WORD_SHIFT
+        ones = superblocks[node][w // words_per_superblock] + blocks[node][w] + (words[node][w] & low_bits[idx & _WORD_MASK]).bit_count()
+        if charIdx < mids[node]:
+          idx -= ones
+          node = lefts[node]
+        else:
+          idx = ones
+          node = rights[node]
+      return idx
+
+    def getRankPair(self,charIdx,i,j):
+      if self._flat is None or not self.flat_queries:
+        return self._root.getRankPair(charIdx,i,j)
+      if i > j:
+        raise ValueError(f"Cannot get ranks at indexes {i},{j}. Need i <= j <= {self._size}")
+      self._checkRank(charIdx,j)
+      mids,lefts,rights,words,superblocks,blocks = self._flat
+      words_per_superblock = self._words_per_superblock
+      low_bits = _LOW_BITS
+      node = 0
+      while node >= 0:
+        node_words,superblock_ranks,block_ranks = words[node],superblocks[node],blocks[node]
+        w = i >> _WORD_SHIFT
+        ones_i = superblock_ranks[w // words_per_superblock] + block_ranks[w] + (node_words[w] & low_bits[i & _WORD_MASK]).bit_count()
+        w = j >> _WORD_SHIFT
+        ones_j = superblock_ranks[w // words_per_superblock] + block_ranks[w] + (node_words[w] & low_bits[j & _WORD_MASK]).bit_count()
+        if charIdx < mids[node]:
+          i -= ones_i
+          j -= ones_j
+          node = lefts[node]
+        else:
+          i = ones_i
+          j = ones_j
+          node = rights[node]
+      return i,j
+
+    def getRankAll(self,idx):
+      '''
+      Visit the internal nodes in level order, so the position of every node is known before it is visited
+      '''
+      if idx > self._size:
+        raise ValueError(f"Cannot get rank at index {idx}. Idx can be at most {self._size}")
+      ranks = [0] * self._character_size
+      if self._flat is None or not self.flat_queries:
+        return self._root.getRankAll(idx,ranks)
+      mids,lefts,rights,words,superblocks,blocks = self._flat
+      words_per_superblock = self._words_per_superblock
+      low_bits = _LOW_BITS
+      positions = [0] * len(mids)
+      positions[0] = idx
+      for node in range(len(mids)):
+        idx = positions[node]
+        w = idx >> _WORD_SHIFT
+        ones = superblocks[node][w // words_per_superblock] + blocks[node][w] + (words[node][w] & low_bits[idx & _WORD_MASK]).bit_count()
+        left,right = lefts[node],rights[node]
+        if left < 0:
+          ranks[~left] = idx - ones
+        else:
+          positions[left] = idx - ones
+        if right < 0:
+          ranks[~right] = ones
+        else:
+          positions[right] = ones
+      return ranks
+
+    def getRanks(self,charIdx,idxs):
+      if charIdx < 0 or charIdx >= self._character_size:
+        raise ValueError(f"Cannot get rank of char-{charIdx}. There are only {self._character_size} characters")
+      return self._root.getRanks(charIdx,idxs)
+
+    def getCharAndRank(self,idx):
+      '''
+      Follow idx down the path given by its bit in every node, until the leaf of its character
+      '''
+      if self._flat is None or not self.flat_queries:
+        return self._root.getCharAndRank(idx)
+      if idx < 0 or idx >= self._size:
+        raise ValueError(f"Cannot get character at index {idx}. Idx can be at most {self._size - 1}")
+      mids,lefts,rights,words,superblocks,blocks = self._flat
+      words_per_superblock = self._words_per_superblock
+      low_bits = _LOW_BITS
+      node = 0
+      while node >= 0:
+        w = idx >> _WORD_SHIFT
+        offset = idx & _WORD_MASK
+        word = words[node][w]
+        ones = superblocks[node][w // words_per_superblock] + blocks[node][w] + (word & low_bits[offset]).bit_count()
+        if (word >> offset) & 1:
+          idx = ones
+          node = rights[node]
+        else:
+          idx -= ones
+          node = lefts[node]
+      return ~node,idx
+
+    # Copies of the flat rank queries that also count their work in probes, a list of [bitvector ranks, scanned bits],
+    # as the Instrumentation wrappers of the bitvector ranks do on the Node path. Instrumentation swaps them in while
+    # it records, so the queries it measures run the flat loops, and the uninstrumented loops stay free of counters
+    def _getRankCounted(self,charIdx,idx,probes):
+      self._checkRank(charIdx,idx)
+      mids,lefts,rights,words,superblocks,blocks = self._flat
+      words_per_superblock = self._words_per_superblock
+      low_bits = _LOW_BITS
+      node = 0
+      while node >= 0:
+        w = idx >> _WORD_SHIFT
+        probes[0] += 1
+        probes[1] += idx & _WORD_MASK
+        ones = superblocks[node][w // words_per_superblock] + blocks[node][w] + (words[node][w] & low_bits[idx & _WORD_MASK]).bit_count()
+        if charIdx < mids[node]:
+          idx -= ones
+          node = lefts[node]
+        else:
+          idx = ones
+          node = rights[node]
+      return idx
+
+    def _getRankPairCounted(self,charIdx,i,j,probes):
+      if i > j:
+        raise ValueError(f"Cannot get ranks at indexes {i},{j}. Need i <= j <= {self._size}")
+      self._checkRank(charIdx,j)
+      mids,lefts,rights,words,superblocks,blocks = self._flat
+      words_per_superblock = self._words_per_superblock
+      low_bits = _LOW_BITS
+      node = 0
+      while node >= 0:
+        node_words,superblock_ranks,block_ranks = words[node],superblocks[node],blocks[node]
+        probes[0] += 1
+        probes[1] += (i & _WORD_MASK) + (j & _WORD_MASK)
+        w = i >> _WORD_SHIFT
+        ones_i = superblock_ranks[w // words_per_superblock] + block_ranks[w] + (node_words[w] & low_bits[i & _WORD_MASK]).bit_count()
+        w = j >> _WORD_SHIFT
+        ones_j = superblock_ranks[w // words_per_superblock] + block_ranks[w] + (node_words[w] & low_bits[j & _WORD_MASK]).bit_count()
+        if charIdx < mids[node]:
+          i -= ones_i
+          j -= ones_j
+          node = lefts[node]
+        else:
+          i = ones_i
+          j = ones_j
+          node = rights[node]
+      return i,j
+
+    def _getRankAllCounted(self,idx,probes):
+      if idx > self._size:
+        raise ValueError(f"Cannot get rank at index {idx}. Idx can be at most {self._size}")
+      ranks = [0] * self._character_size
+      mids,lefts,rights,words,superblocks,blocks = self._flat
+      words_per_superblock = self._words_per_superblock
+      low_bits = _LOW_BITS
+      positions = [0] * len(mids)
+      positions[0] = idx
+      for node in range(len(mids)):
+        idx = positions[node]
+        w = idx >> _WORD_SHIFT
+        probes[0] += 1
+        probes[1] += idx & _WORD_MASK
+        ones = superblocks[node][w // words_per_superblock] + blocks[node][w] + (words[node][w] & low_bits[idx & _WORD_MASK]).bit_count()
+        left,right = lefts[node],rights[node]
+        if left < 0:
+          ranks[~left] = idx - ones
+        else:
+          positions[left] = idx - ones
+        if right < 0:
+          ranks[~right] = ones
+        else:
+          positions[right] = ones
+      return ranks
+
+    def _getCharAndRankCounted(self,idx,probes):
+      if idx < 0 or idx >= self._size:
+        raise ValueError(f"Cannot get character at index {idx}. Idx can be at most {self._size - 1}")
+      mids,lefts,rights,words,superblocks,blocks = self._flat
+      words_per_superblock = self._words_per_superblock
+      low_bits = _LOW_BITS
+      node = 0
+      while node >= 0:
+        w = idx >> _WORD_SHIFT
+        offset = idx & _WORD_MASK
+        probes[0] += 1
+        probes[1] += offset
+        word = words[node][w]
+        ones = superblocks[node][w // words_per_superblock] + blocks[node][w] + (word & low_bits[offset]).bit_count()
+        if (word >> offset) & 1:
+          idx = ones
+          node = rights[node]
+        else:
+          idx -= ones
+          node = lefts[node]
+      return ~node,idx
+
+    def access(self,idx):
+      return self.getCharAndRank(idx)[0]
+
+    def select(self,charIdx,k):
+      if charIdx < 0 or charIdx >= self._character_size:
+        raise ValueError(f"Cannot select char-{charIdx}. There are only {self._character_size} characters")
+      count = self._root.getRank(charIdx,self._size)
+      if k < 0 or k >= count:
+        raise ValueError(f"Cannot select occurrence {k} of char-{charIdx}. It occurs {count} times")
+      return self._root.select(charIdx,k)
+
+    def _checkRange(self,i,j):
+      if i < 0 or j > self._size or i > j:
+        raise ValueError(f"Invalid range [{i},{j}). Need 0 <= i <= j <= {self._size}")
+
+    def rangeQuantile(self,i,j,k):
+      self._checkRange(i,j)
+      if k < 0 or k >= j - i:
+        raise ValueError(f"Cannot get the {k}-th smallest of {j - i} characters")
+      return self._root.rangeQuantile(i,j,k)
+
+    def rangeTopK(self,i,j,k):
+      '''
+      Best-first search: nodes are expanded in decreasing order of the size of their range,
+      so leaves come out in decreasing order of frequency and the search stops after k of them
+      Ties are broken by character index. The nodes in the heap cover disjoint character ranges,
+      so (size, first character) is a unique key
+      '''
+      self._checkRange(i,j)
+      top = []
+      heap = [(i - j,0,i,j,self._root)] if j > i else []
+      while heap and len(top) < k:
+        size,_,i,j,node = heapq.heappop(heap)
+        if node.is_leaf:
+          top.append((node.val,-size))
+          continue
+        rank_i,rank_j = node.bit_vector.rank1Pair(i,j)
+        for child,ci,cj in ((node.left,i - rank_i,j - rank_j),(node.right,rank_i,rank_j)):
+          if cj > ci:
+            heapq.heappush(heap,(ci - cj,child.chrlo,ci,cj,child))
+      return top
+
+    def rangeCount(self,i,j,lo,hi):
+      self._checkRange(i,j)
+      return self._root.rangeCount(i,j,lo,hi)
+
+    def serialize(self,writer) -> dict:
+      return {"size": self._size, "character_size": self._character_size, "shape": self._shape, "root": self._root.serialize(writer)}
+
+    @classmethod
+    def deserialize(cls,state: dict,reader):
+      tree = cls.__new__(cls)
+      tree._size = state["size"]
+      tree._character_size = state["character_size"]
+      tree._shape = state.get("shape","balanced")
+      tree._root = Node.deserialize(state["root"],reader)
+      tree._flatten()
+      return tree
+
+    def getSpaceUsage(self) -> dict:
+      '''
+      Report the space used in bits by the tree's bitvectors
+        bits: n bits per level of the tree
+        payload_bits: bits in the packed words
+        directory_bits: bits in the superblock and block rank directories
+        overhead: directory bits per bit of the bitvectors
+      '''
+      usage = self._root.getSpaceUsage()
+      usage["overhead"] = usage["directory_bits"] / usage["bits"] if usage["bits"] else 0
+      return usage
 
     def __repr__(self) -> str:
       '''
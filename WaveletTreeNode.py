@@ -1,21 +1,25 @@
-from constants import MAX_VEC_PRINT_LENGTH, BIT_PACK_SIZE
+from constants import MAX_VEC_PRINT_LENGTH
+from BitVector import BitVector, deserialize_bit_vector
 import math
 
 class Node:
-    def __init__(self,chrlo:int,chrhi:int,bit_vector:list[int] = None,ranks: list[int] = [],size: int = 0,block_size:int = None,depth: int = 0) -> None:
+    __slots__ = ('_bit_vector','_size','_chrlo','_chrhi','_is_leaf','_mid','_left','_right','_depth')
+
+    def __init__(self,chrlo:int,chrhi:int,bit_vector:BitVector = None,size: int = 0,depth: int = 0,mid: int = None) -> None:
         '''
-        :param str A list of 0s and 1s [TODO] Change to accept a true bitvector
+        :param BitVector bit_vector: 1 at position i if the i-th character of the node goes to the right child
+        :param int mid: characters [chrlo,mid) go to the left child and [mid,chrhi) to the right one.
+          Defaults to the middle of the range
         '''
         self._bit_vector = bit_vector
         self._size = size
         self._chrlo = chrlo
         self._chrhi = chrhi
         self._is_leaf = chrhi - chrlo <= 1
+        self._mid = chrlo + math.ceil((chrhi - chrlo) / 2) if mid is None else mid
         self._left = None
         self._right = None
         self._depth = depth
-        self._block_size = block_size
-        self._ranks = ranks
 
     def __repr__(self) -> str:
       sentinel = "--"* 15
@@ -40,6 +44,22 @@ class Node:
     def depth(self):
       return self._depth
 
+    @property
+    def mid(self):
+      return self._mid
+
+    @property
+    def chrlo(self):
+      return self._chrlo
+
+    @property
+    def chrhi(self):
+      return self._chrhi
+
+    @property
+    def bit_vector(self):
+      return self._bit_vector
+
     @property
     def val(self):
       if self._is_leaf:
@@ -64,20 +84,12 @@ class Node:
       '''
       if (i >= self._size):
         raise SyntaxError(f'Cannot get bit at index {i}. Max index is {self._size - 1}')
-      
-      # print(f'getting bit {i}, vec: {self._bit_vector}')
-
-      packedIndex = i // BIT_PACK_SIZE
-      bitIndex = i % BIT_PACK_SIZE
-      packedInt = self._bit_vector[packedIndex]
-      return packedInt >> (BIT_PACK_SIZE - bitIndex - 1) & 1
+      return self._bit_vector.access(i)
 
     def getRank(self,charIdx,idx):
-      # print(f'getting rank of {charIdx} at {idx}.')
-      # print('my size:',self._size)
-      # print('ranks:',self._ranks,'block_size:',self._block_size)
       '''
       Recursively get the rank of the charIdx-th character in the character set at position idx in the current node
+      The rank of the 1s in the bitvector is answered in O(1) by its rank directory
       '''
       if self._is_leaf: return idx
       if idx > self._size:
@@ -88,34 +100,127 @@ class Node:
       # rank of any character is 0 at the first index
       if (idx == 0): return 0
 
-      mid = self._chrlo + math.ceil((self._chrhi - self._chrlo) / 2)
+      if charIdx < self._mid:
+        return self.left.getRank(charIdx,self._bit_vector.rank0(idx))
+      return self.right.getRank(charIdx,self._bit_vector.rank1(idx))
+
+    def getRankPair(self,charIdx,i,j):
+      '''
+      Ranks of the charIdx-th character at positions i and j, in a single descent of the tree
+      '''
+      if self._is_leaf: return i,j
+      if j > self._size or i > j:
+        raise ValueError(f"Cannot get ranks at indexes {i},{j}. Need i <= j <= {self._size}")
+      if charIdx < self._chrlo or charIdx >= self._chrhi:
+        raise ValueError(f"Cannot get rank of char-{charIdx}. There are only {self._chrhi - self._chrlo} characters in this node")
 
-      prevBoundaryIdxInText = -1
-      prevBoundaryRank = 0
+      # rank of any character is 0 at the first index
+      if j == 0: return 0,0
 
-      if self._block_size is not None:
-        prevBoundaryIdxInText = (idx - idx % self._block_size)
-        prevBoundaryIdxInRanks = prevBoundaryIdxInText // self._block_size
-        if (prevBoundaryIdxInRanks >= len(self._ranks)):
-          prevBoundaryRank = 0
-          prevBoundaryIdxInText = 0
-        else:
-          prevBoundaryRank = self._ranks[prevBoundaryIdxInRanks]
+      rank_i,rank_j = self._bit_vector.rank1Pair(i,j)
+      if charIdx < self._mid:
+        return self.left.getRankPair(charIdx,i - rank_i,j - rank_j)
+      return self.right.getRankPair(charIdx,rank_i,rank_j)
 
-      walkingRank = self._getWalkingRank(prevBoundaryIdxInText,idx)
+    def getRankAll(self,idx,ranks):
+      '''
+      Fill ranks[c] with the rank at idx of every character c in this node
+      Visits every node of the subtree once
+      '''
+      if self._is_leaf:
+        ranks[self._chrlo] = idx
+        return ranks
+      rank = self._bit_vector.rank1(idx)
+      self.left.getRankAll(idx - rank,ranks)
+      self.right.getRankAll(rank,ranks)
+      return ranks
+
+    def getRanks(self,charIdx,idxs):
+      '''
+      Vectorized getRank: rank of the charIdx-th character at every position of a numpy array
+      All positions follow the same root-to-leaf path, so each level costs one batched rank
+      '''
+      if self._is_leaf: return idxs
+      if charIdx < self._mid:
+        return self.left.getRanks(charIdx,self._bit_vector.rank0Many(idxs))
+      return self.right.getRanks(charIdx,self._bit_vector.rank1Many(idxs))
 
-      if charIdx < mid:
-        rank = (idx - walkingRank - prevBoundaryRank)
-      else:
-        rank = walkingRank + prevBoundaryRank
-      if charIdx < mid:
-        rank = self.left.getRank(charIdx,rank)
-      else:
-        rank = self.right.getRank(charIdx,rank)
-      return rank
+    def getCharAndRank(self,idx):
+      '''
+      Recursively find the character at position idx in the current node,
+      together with its rank at idx (the number of times it occurs before idx)
+      '''
+      if self._is_leaf: return self._chrlo,idx
+      if idx >= self._size:
+        raise ValueError(f"Cannot get character at index {idx}. Idx can be at most {self._size - 1}")
+      if self._bit_vector.access(idx):
+        return self.right.getCharAndRank(self._bit_vector.rank1(idx))
+      return self.left.getCharAndRank(self._bit_vector.rank0(idx))
+
+    def select(self,charIdx,k):
+      '''
+      Position in the current node of the k-th occurrence (counting from 0) of the charIdx-th character
+      Finds the position in the leaf, then maps it up through the bitvector of every node with select
+      '''
+      if self._is_leaf: return k
+      if charIdx < self._mid:
+        return self._bit_vector.select0(self.left.select(charIdx,k))
+      return self._bit_vector.select1(self.right.select(charIdx,k))
 
-    def _getWalkingRank(self,i,j):
+    def rangeQuantile(self,i,j,k):
       '''
-      Walk from i -> j and get the rank of 1 from bit_vector[i:j]
+      The k-th smallest (counting from 0) character index among the positions [i,j) of the current node
       '''
-      return sum([self._getBit(k) for k in range(i,j)])
\ No newline at end of file
+      node = self
+      while not node._is_leaf:
+        rank_i,rank_j = node._bit_vector.rank1Pair(i,j)
+        zeros = (j - i) - (rank_j - rank_i)
+        if k < zeros:
+          node,i,j = node.left,i - rank_i,j - rank_j
+        else:
+          node,i,j,k = node.right,rank_i,rank_j,k - zeros
+      return node._chrlo
+
+    def rangeCount(self,i,j,lo,hi):
+      '''
+      Number of positions in [i,j) of the current node whose character index is in [lo,hi)
+      Only descends into the nodes whose character range is partly inside [lo,hi)
+      '''
+      if i >= j or hi <= self._chrlo or lo >= self._chrhi:
+        return 0
+      if lo <= self._chrlo and self._chrhi <= hi:
+        return j - i
+      rank_i,rank_j = self._bit_vector.rank1Pair(i,j)
+      return self.left.rangeCount(i - rank_i,j - rank_j,lo,hi) + self.right.rangeCount(rank_i,rank_j,lo,hi)
+
+    def serialize(self,writer) -> dict:
+      state = {"chrlo": self._chrlo, "chrhi": self._chrhi, "size": self._size, "depth": self._depth}
+      if not self._is_leaf:
+        state["mid"] = self._mid
+        state["bit_vector"] = self._bit_vector.serialize(writer)
+        state["left"] = self.left.serialize(writer)
+        state["right"] = self.right.serialize(writer)
+      return state
+
+    @classmethod
+    def deserialize(cls,state: dict,reader):
+      bit_vector = None
+      if "bit_vector" in state:
+        bit_vector = deserialize_bit_vector(state["bit_vector"],reader)
+      node = cls(state["chrlo"],state["chrhi"],bit_vector=bit_vector,size=state["size"],depth=state["depth"],mid=state.get("mid"))
+      if not node.is_leaf:
+        node.left = cls.deserialize(state["left"],reader)
+        node.right = cls.deserialize(state["right"],reader)
+      return node
+
+    def getSpaceUsage(self) -> dict:
+      '''
+      Space used in bits by the bitvectors of this subtree
+      '''
+      usage = {"bits": 0, "payload_bits": 0, "directory_bits": 0}
+      if self._is_leaf:
+        return usage
+      for part in (self._bit_vector.getSpaceUsage(),self.left.getSpaceUsage(),self.right.getSpaceUsage()):
+        for key in usage:
+          usage[key] += part[key]
+      return usage
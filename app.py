@@ -1,45 +1,135 @@
-from flask import Flask, render_template, request
+from flask import Flask, render_template, request, jsonify
 from FMIndex import FMIndex
+from QueryService import QueryService
+from ShardedIndex import ShardedIndex, MANIFEST_NAME
+from IncrementalIndex import IncrementalIndex
+from benchmark import rankTrendByPosition, rankTrendByBlockSize
+from TextReader import read_text, read_documents
+import Instrumentation
 from time import time
+from threading import Lock
 import json
-from random import randint,choice
-from math import floor, log2
 import os
 
 
 META_CHAR = '$'
-text = ""
 BLOCK_SIZE = 100
+INDEX_PATH = f'index.b{BLOCK_SIZE}.fmi' # Built index is cached here between runs
+CACHE_SIZE = 10000 # Intervals of recently queried patterns kept by the index
+QUERY_WORKERS = os.cpu_count() # Processes answering queries, sharing the index file
+MAX_LINES = 4 # Lines of the sample data that are indexed
+REBUILD_OPTIONS = ['block_size','backend','sa_sample_rate','kmer_length','tree_shape','bitvector'] # Build options accepted by /api/rebuild
+INSTRUMENT = os.environ.get('FMINDEX_INSTRUMENT') == '1' # Record metrics from the start. Can be switched at /metrics
+SHARDED = os.environ.get('FMINDEX_SHARDED') == '1' # Also index all of the sample data, in shards, for /api/shards/count
+SHARD_DIR = f'shards.b{BLOCK_SIZE}' # Built shards are cached here between runs
+SHARD_CHUNK_SIZE = 1 << 20 # Characters per shard
+SHARD_OVERLAP = 1000 # Patterns of up to SHARD_OVERLAP + 1 characters are found across shard boundaries
+INCREMENTAL = os.environ.get('FMINDEX_INCREMENTAL') == '1' # Keep a growing copy of the text, appended to at /api/append
+INCREMENTAL_DIR = f'incremental.b{BLOCK_SIZE}' # Segments of the growing text are kept here between runs
 
 sample_data_path = '../sample-data/dna.50MB'
-if (os.path.isfile(sample_data_path)):
-    with open(sample_data_path) as f:
-        i = 0
-        for line in f.readlines()[:4]:
-            i+=1
-            line = line.strip()
-            print('read line:',i,'length:',len(line))
-            text += line
-text += META_CHAR
-sorted_chars = sorted(list(set(text+META_CHAR)))
-character_set = ''.join(sorted_chars)
+
+def isIndexStale(path=INDEX_PATH):
+    '''
+    The cached index has to be rebuilt if it is missing or older than the sample data
+    '''
+    if not os.path.isfile(path):
+        return True
+    return os.path.isfile(sample_data_path) and os.path.getmtime(path) < os.path.getmtime(sample_data_path)
+
+if INSTRUMENT:
+    Instrumentation.enable()
+
+def buildIndex():
+    '''
+    Stream the first lines of the sample data, dropping newlines and FASTA headers, and index them
+    The text buffer is encoded in place by the index, so no copy of the text outlives the build
+    '''
+    text_buffer,character_set = read_text(sample_data_path if os.path.isfile(sample_data_path) else [],meta_char=META_CHAR,max_lines=MAX_LINES)
+    print('read text of length:',len(text_buffer))
+    index = FMIndex(text_buffer,character_set=character_set,debug=True, block_size=BLOCK_SIZE, cache_size=CACHE_SIZE)
+    index.save(INDEX_PATH)
+    return index
 
 t1 = time()
-index = FMIndex(text,character_set=character_set,debug=True, block_size=BLOCK_SIZE)
-t2 = time()
-print(f'Index has been built on the text in {(t2-t1):.3f} seconds')
+index = None
+if not isIndexStale():
+    index = FMIndex.load(INDEX_PATH,cache_size=CACHE_SIZE)
+    try:
+        index.extract(0,1)
+        print(f'Index has been loaded from {INDEX_PATH} in {(time()-t1):.3f} seconds')
+    except ValueError:
+        # Indexes saved before extract was added cannot reproduce the text
+        index = None
+if index is None:
+    index = buildIndex()
+    print(f'Index has been built on the text in {(time()-t1):.3f} seconds')
+
+# The index reproduces the text with extract(), so the text itself is not kept in memory
+character_set = index.character_set
+sorted_chars = list(character_set)
+
+# Queries are answered by worker processes that memory-map INDEX_PATH
+service = QueryService(INDEX_PATH,workers=QUERY_WORKERS,cache_size=CACHE_SIZE,instrument=INSTRUMENT)
+# Generation of the service that index was loaded at. A finished rebuild replaces INDEX_PATH and bumps it
+index_generation = service.generation
+index_lock = Lock()
+
+def getIndex():
+    '''
+    The index of this process, loaded again from INDEX_PATH once a rebuild has been swapped in
+    '''
+    global index,index_generation,character_set,sorted_chars
+    with index_lock:
+        generation = service.generation
+        if generation != index_generation:
+            index = FMIndex.load(INDEX_PATH,cache_size=CACHE_SIZE)
+            index_generation = generation
+            character_set = index.character_set
+            sorted_chars = list(character_set)
+        return index
+
+def getText():
+    '''
+    The indexed text, META_CHAR included, extracted from the index
+    '''
+    current = getIndex()
+    return current.extract(0,current.text_size)
+
+# (index generation, single_text, block_size) -> id of the background job measuring that /trends plot
+trend_jobs = {}
+
+sharded_index = None
+if SHARDED:
+    t1 = time()
+    if isIndexStale(os.path.join(SHARD_DIR,MANIFEST_NAME)):
+        documents = read_documents(sample_data_path) if os.path.isfile(sample_data_path) else [('sample',getText()[:-1])]
+        sharded_index = ShardedIndex.build(documents,SHARD_DIR,chunk_size=SHARD_CHUNK_SIZE,overlap=SHARD_OVERLAP,workers=QUERY_WORKERS,meta_char=META_CHAR,block_size=BLOCK_SIZE)
+        print(f'{sharded_index.shards} shards have been built in {(time()-t1):.3f} seconds')
+    else:
+        sharded_index = ShardedIndex(SHARD_DIR,workers=QUERY_WORKERS,cache_size=CACHE_SIZE)
+        print(f'{sharded_index.shards} shards have been loaded from {SHARD_DIR} in {(time()-t1):.3f} seconds')
+
+incremental_index = None
+if INCREMENTAL:
+    incremental_index = IncrementalIndex(INCREMENTAL_DIR,block_size=BLOCK_SIZE,cache_size=CACHE_SIZE)
+    if not incremental_index.text_size:
+        incremental_index.append(getText()[:-1])
+    print(f'Incremental index of length {incremental_index.text_size} has been opened in {INCREMENTAL_DIR}')
 
 app = Flask(__name__)
 
 @app.route("/",methods=['GET','POST'])
 def main():
+    # Picks up the character set of a rebuilt index
+    getIndex()
     if request.method == 'GET':
         return render_template('index.html',character_set=' | '.join(sorted_chars))
     else:
         pattern = request.form.get('q')
         t1 = time()
         print('searching for...',pattern)
-        count = index.findMatchCount(pattern)
+        count = service.count(pattern)
         t2 = time()
         return render_template('index.html',count=count, query=pattern, t_span=t2-t1,character_set=' | '.join(sorted_chars))
 
@@ -51,81 +141,194 @@ def rank():
     except:
         return f"<p> Error: char_index and idx must be provided as query params </p>"
     t1 = time()
-    charRank = index._waveletTree.getRank(charIdx,idx)
+    try:
+        charRank = service.rank(charIdx,idx)
+    except ValueError as e:
+        return f"<p> Error: {e} </p>"
     t2 = time()
-    return f"<p>Rank: {index._waveletTree.getRank(charIdx,idx)}. Computed in {(t2-t1):.3f} seconds</p>"
+    return f"<p>Rank: {charRank}. Computed in {(t2-t1):.3f} seconds</p>"
+
+def apiError(message,status=400):
+    return jsonify({"error": message}),status
+
+@app.route("/api/count",methods=['GET','POST'])
+def apiCount():
+    pattern = request.args.get('q') if request.method == 'GET' else (request.get_json(silent=True) or {}).get('pattern')
+    if not isinstance(pattern,str):
+        return apiError("pattern must be provided as the q query param or the 'pattern' JSON field")
+    t1 = time()
+    count = service.count(pattern)
+    t2 = time()
+    return jsonify({"pattern": pattern, "count": count, "t_span": t2-t1})
+
+@app.route("/api/count_batch",methods=['POST'])
+def apiCountBatch():
+    patterns = (request.get_json(silent=True) or {}).get('patterns')
+    if not isinstance(patterns,list) or not all(isinstance(pattern,str) for pattern in patterns):
+        return apiError("'patterns' must be a JSON list of strings")
+    t1 = time()
+    counts = service.countBatch(patterns)
+    t2 = time()
+    return jsonify({"counts": counts, "t_span": t2-t1})
+
+@app.route("/api/rank",methods=['GET'])
+def apiRank():
+    try:
+        charIdx = int(request.args.get('char_idx'))
+        idx = int(request.args.get('idx'))
+    except (TypeError,ValueError):
+        return apiError("char_idx and idx must be provided as integer query params")
+    try:
+        charRank = service.rank(charIdx,idx)
+    except ValueError as e:
+        return apiError(str(e))
+    return jsonify({"char_idx": charIdx, "idx": idx, "rank": charRank})
+
+@app.route("/api/shards/count",methods=['GET'])
+def apiShardsCount():
+    '''
+    Count a pattern over all of the sample data, with the hits of every document
+    '''
+    if sharded_index is None:
+        return apiError("The sharded index is disabled. Start the app with FMINDEX_SHARDED=1",404)
+    pattern = request.args.get('q')
+    if not isinstance(pattern,str):
+        return apiError("pattern must be provided as the q query param")
+    t1 = time()
+    try:
+        documents = sharded_index.countByDocument(pattern)
+    except ValueError as e:
+        return apiError(str(e))
+    t2 = time()
+    return jsonify({"pattern": pattern, "count": sum(documents.values()), "documents": documents, "t_span": t2-t1})
+
+@app.route("/api/append",methods=['POST'])
+def apiAppend():
+    '''
+    Append text to the growing index. It is searchable right away and indexed in the background
+    '''
+    if incremental_index is None:
+        return apiError("The incremental index is disabled. Start the app with FMINDEX_INCREMENTAL=1",404)
+    text = (request.get_json(silent=True) or {}).get('text')
+    if not isinstance(text,str):
+        return apiError("'text' must be provided as a JSON string")
+    try:
+        incremental_index.append(text)
+    except ValueError as e:
+        return apiError(str(e))
+    return jsonify({"text_size": incremental_index.text_size, "segments": incremental_index.segments})
+
+@app.route("/api/incremental/count",methods=['GET'])
+def apiIncrementalCount():
+    if incremental_index is None:
+        return apiError("The incremental index is disabled. Start the app with FMINDEX_INCREMENTAL=1",404)
+    pattern = request.args.get('q')
+    if not isinstance(pattern,str):
+        return apiError("pattern must be provided as the q query param")
+    t1 = time()
+    try:
+        count = incremental_index.count(pattern)
+    except ValueError as e:
+        return apiError(str(e))
+    t2 = time()
+    return jsonify({"pattern": pattern, "count": count, "t_span": t2-t1})
+
+@app.route("/api/rebuild",methods=['POST'])
+def apiRebuild():
+    '''
+    Queue a rebuild of the index over the sample data. Queries keep using the current index until it is done
+    '''
+    options = request.get_json(silent=True) or {}
+    unknown = set(options).difference(REBUILD_OPTIONS)
+    if unknown:
+        return apiError(f"Unknown build options: {', '.join(sorted(unknown))}")
+    source = sample_data_path if os.path.isfile(sample_data_path) else [getText()[:-1]]
+    options['cache_size'] = 0
+    job_id = service.submitRebuild(source,meta_char=META_CHAR,max_lines=MAX_LINES,**options)
+    return jsonify(service.getJob(job_id)),202
+
+@app.route("/api/jobs",methods=['GET'])
+def apiJobs():
+    return jsonify(service.listJobs())
+
+@app.route("/api/jobs/<int:job_id>",methods=['GET'])
+def apiJob(job_id):
+    job = service.getJob(job_id)
+    if job is None:
+        return apiError(f"No job with id {job_id}",404)
+    return jsonify(job)
+
+@app.route("/metrics",methods=['GET','POST'])
+def metrics():
+    '''
+    GET: query metrics of the worker processes and build metrics of this process
+    POST: {"enabled": true|false} switches recording on or off, {"reset": true} clears the metrics
+    '''
+    if request.method == 'POST':
+        options = request.get_json(silent=True) or {}
+        if 'enabled' in options:
+            if not isinstance(options['enabled'],bool):
+                return apiError("'enabled' must be true or false")
+            if options['enabled']:
+                Instrumentation.enable()
+            else:
+                Instrumentation.disable()
+            service.setInstrumentation(options['enabled'])
+        if options.get('reset'):
+            Instrumentation.reset()
+            service.resetMetrics()
+    try:
+        workers = service.getMetrics()
+    except TimeoutError as e:
+        return apiError(str(e),503)
+    return jsonify({"workers": workers, "server": Instrumentation.getMetrics()})
 
 @app.route("/trends",methods=['GET'])
 def trends():
     '''
     Build a plot indicating how the WaveletTree getRank() method performs
     as a function of character size (Σ) and length of length of the indexed text (n)
+    The measurements rebuild indexes, so they run as a background job of the query service. Until the job
+    is done the page shows its status. Its results are kept for the current index, refresh=true measures again
     '''
+    single_text = request.args.get('single_text') in ['True','true']
+    block_size = request.args.get('block_size') if single_text else None
+    if block_size is not None:
+        try:
+            block_size = int(block_size)
+        except ValueError:
+            return apiError("block_size must be an integer")
+        if block_size < 1:
+            return apiError("block_size must be at least 1")
+    key = (service.generation,single_text,block_size)
+    job = service.getJob(trend_jobs[key]) if key in trend_jobs else None
+    if job is None or (request.args.get('refresh') in ['True','true'] and job['status'] in ['done','failed']):
+        if single_text:
+            trend_jobs[key] = service.submitTask('trends',rankTrendByPosition,INDEX_PATH,block_size=block_size)
+        else:
+            trend_jobs[key] = service.submitTask('trends',rankTrendByBlockSize,INDEX_PATH)
+        job = service.getJob(trend_jobs[key])
+    if job['status'] != 'done':
+        return render_template('trends.html',job=job),500 if job['status'] == 'failed' else 202
+
+    result = job['result']
     data = {
-        "text_length": len(text),
-        "block_size": BLOCK_SIZE,
+        "text_length": result['text_length'],
+        "block_size": BLOCK_SIZE if block_size is None else block_size,
         "y_label": "Run Time (s)",
         "x_label": "Pattern Length",
         "title": "",
         "plot_data":{
-            "ms": [],
-            "ts": []
+            "ms": result['ms'],
+            "ts": ["{:.7f}".format(t) for t in result['ts']]
         }
     }
     # Only vary the position of the rank query, not the text
-    if request.args.get('single_text') in ['True','true']:
+    if single_text:
         data['title'] =  "Query Time vs Query Index on DNA Dataset"
-        new_block_size = request.args.get('block_size')
-        if new_block_size is not None:
-            try:
-                newIndex = FMIndex(text,character_set=character_set,debug=True, block_size=int(new_block_size))
-                data['block_size'] = new_block_size
-            except:
-                print('Invalid block_size provided')
-
-        num_repeats = 5
-        shift = 10000
-        skip = 1
-        for i in range(0,min(1000,len(text)+1)):
-            time_elapsed = 0
-            for trail_num in range(num_repeats):
-                charIdx = randint(2,len(character_set)-1) # Exclude the META_CHAR from tests
-                textIdx = (shift+i)*skip
-                t1 = time()
-                if new_block_size is None:
-                    index._waveletTree.getRank(charIdx,textIdx)
-                else:
-                    newIndex._waveletTree.getRank(charIdx,textIdx)
-                t2 = time()
-                time_elapsed+= (t2-t1)
-            data['plot_data']['ms'].append(textIdx)
-            data['plot_data']['ts'].append("{:.7f}".format(time_elapsed/num_repeats))
-            print(f'Index: {i} for char: {charIdx}')
-
     # Vary block size and do random rank queries
     else:
         data['x_label'] = "Block Size"
         data['y_label'] =  "Query Time (s)"
-        n = len(text)
-        data['title'] =  f"Query Time vs Block Size on DNA Dataset (n={n})"
-        block_sizes = [log2(n),log2(n)**2,log2(n)**3]
-        num_repeats = 2
-        for i,b in enumerate(block_sizes):
-            b = int(b)
-            currIndex = FMIndex(text,character_set=character_set,debug=True, block_size=b)
-            time_elapsed = 0
-            for _ in range(num_repeats):
-                shift = randint(b,n-b)
-                deviation = randint(1,max(b//2,1))
-                probePos = shift + choice([-1,1]) * deviation
-                charIdx = randint(2,len(character_set)-1) # Exclude the META_CHAR from tests
-                t1 = time()
-                currIndex._waveletTree.getRank(charIdx,probePos)
-                t2 = time()
-                time_elapsed+= (t2-t1)
-            data['plot_data']['ms'].append(b)
-            data['plot_data']['ts'].append("{:.7f}time".format(time_elapsed/num_repeats))
-            print(f'Block #{i} / {len(block_sizes)} blocks')
-
-
+        data['title'] =  f"Query Time vs Block Size on DNA Dataset (n={result['text_length']})"
     return render_template('trends.html',jsonData=json.dumps(data))
\ No newline at end of file
@@ -0,0 +1,394 @@
+'''
+Headless, reproducible benchmarks for building and querying the FM Index
+Every measurement runs the unwrapped functions (no instrumentation wrappers) with warmup rounds,
+then repeats them and records perf_counter_ns statistics.
+
+Example use:
+  python benchmark.py --n 10000 100000 --sigma 4 16 --output results.json
+  python benchmark.py --n 10000 100000 --sigma 4 16 --output current.csv --compare results.json
+  python benchmark.py --n 100000 --text repetitive --bitvector plain rrr runlength
+  python benchmark.py --n 100000 --text repetitive --backend tree runlength
+  python benchmark.py --n 100000 --sigma 4 16 64 200 --backend tree
+The wavelet_build and rank results also report the size of the rank structure:
+bits_per_symbol (payload and directory bits per text character) and compression (bits stored per bit of the bitvectors)
+For the tree backend, rank_node times the same rank queries through the recursive Node methods
+The access, select and (for the tree backend) range_quantile, range_top_k and range_count results
+come with a *_naive result that answers the same queries by scanning the plain BWT
+The extract result is timed per extracted character and also reports chars_per_s
+The index_build result reports the build memory, measured in a fresh process:
+peak_rss_bytes and build_bytes_per_symbol (growth of the peak RSS during the build per text character)
+'''
+import argparse
+import csv
+import json
+import math
+import multiprocessing
+import platform
+import random
+import statistics
+from collections import Counter
+import subprocess
+import sys
+from concurrent.futures import ProcessPoolExecutor
+from time import perf_counter_ns, time
+from BitVector import BIT_VECTOR_TYPES
+from FMIndex import FMIndex, WAVELET_BACKENDS
+from SuffixArray import get_suffix_array_builder
+from utils import encodeText
+
+META_CHAR = '$'
+FIRST_CHAR = 'A' # Synthetic alphabets are the characters that follow this one
+REPETITIVE_COPIES = 50 # A repetitive text is this many mutated copies of one random text
+MUTATION_RATE = 0.001 # Fraction of the characters of every copy that are substituted
+NAIVE_QUERIES = 50 # Queries per repetition of the naive scans, which take O(n) or O(range) each
+TOP_K = 3 # Characters reported by the range_top_k queries
+# Values of the result fields that older result files do not have
+KEY_DEFAULTS = {"bitvector": "plain", "text": "random"}
+
+def unwrap(fn):
+    '''
+    Strip wrappers such as the Instrumentation timers so that their overhead is not measured
+    '''
+    while hasattr(fn,'__wrapped__'):
+        fn = fn.__wrapped__
+    return fn
+
+def generateText(n,sigma,seed=0,kind='random'):
+    '''
+    Text of n characters over sigma characters, terminated by META_CHAR
+    kind 'random' draws every character uniformly, 'repetitive' concatenates mutated copies of one random text
+    Returns the text and its character set
+    '''
+    if not 1 <= sigma <= 255 - ord(FIRST_CHAR):
+        raise ValueError(f'sigma must be between 1 and {255 - ord(FIRST_CHAR)}')
+    alphabet = ''.join(chr(ord(FIRST_CHAR) + i) for i in range(sigma))
+    rng = random.Random(seed)
+    if kind == 'random':
+        return ''.join(rng.choices(alphabet,k=n)) + META_CHAR, META_CHAR + alphabet
+    base = rng.choices(alphabet,k=max(1,n // REPETITIVE_COPIES))
+    chars = []
+    while len(chars) < n:
+        copy = list(base)
+        for _ in range(round(len(copy) * MUTATION_RATE)):
+            copy[rng.randrange(len(copy))] = rng.choice(alphabet)
+        chars.extend(copy)
+    return ''.join(chars[:n]) + META_CHAR, META_CHAR + alphabet
+
+def measure(fn,repeats,warmup,ops=1):
+    '''
+    Run fn warmup times, then time it repeats times
+    ops is the number of operations in one call of fn, used to report the time per operation
+    '''
+    for _ in range(warmup):
+        fn()
+    samples = []
+    for _ in range(repeats):
+        t1 = perf_counter_ns()
+        fn()
+        t2 = perf_counter_ns()
+        samples.append(t2-t1)
+    median = statistics.median(samples)
+    return {
+        "repeats": repeats,
+        "ops": ops,
+        "min_ns": min(samples),
+        "median_ns": median,
+        "mean_ns": statistics.fmean(samples),
+        "stdev_ns": statistics.stdev(samples) if len(samples) > 1 else 0.0,
+        "per_op_ns": median / ops,
+    }
+
+def getSpaceStats(structure,n):
+    usage = structure.getSpaceUsage()
+    stored = usage["payload_bits"] + usage["directory_bits"]
+    return {
+        "bits_per_symbol": stored / n,
+        "compression": stored / usage["bits"] if usage["bits"] else 0,
+    }
+
+def _buildIndexStats(text,character_set,options):
+    return FMIndex(text,character_set,**options).getBuildStats()
+
+def getBuildMemory(text,character_set,options):
+    '''
+    Peak RSS of an index build. The build runs in a fresh process, so earlier builds do not count
+    '''
+    with ProcessPoolExecutor(max_workers=1,mp_context=multiprocessing.get_context('spawn')) as executor:
+        stats = executor.submit(_buildIndexStats,text,character_set,options).result()
+    if stats is None:
+        return {}
+    peak_rss = stats["peak_rss"]
+    return {
+        "peak_rss_bytes": peak_rss["rank_structure"],
+        "build_bytes_per_symbol": (peak_rss["rank_structure"] - peak_rss["start"]) / stats["n"],
+    }
+
+def benchmarkWaveletQueries(structure,bwt,sigma,rng,args,record):
+    '''
+    Measure access, select and the range queries of a rank structure against naive scans of the BWT
+    '''
+    n = len(bwt)
+    def compare(operation,query,naive,queries):
+        naive_queries = queries[:NAIVE_QUERIES]
+        for args_ in naive_queries:
+            assert query(*args_) == naive(*args_), operation
+        record(operation,measure(lambda: [query(*args_) for args_ in queries],args.repeats,args.warmup,ops=len(queries)))
+        record(f'{operation}_naive',measure(lambda: [naive(*args_) for args_ in naive_queries],args.repeats,args.warmup,ops=len(naive_queries)))
+
+    access = unwrap(type(structure).access)
+    compare('access',lambda i: access(structure,i),lambda i: bwt[i],[(rng.randrange(n),) for _ in range(args.queries)])
+
+    counts = Counter(bwt)
+    def naiveSelect(charIdx,k):
+        position = -1
+        for _ in range(k + 1):
+            position = bwt.index(charIdx,position + 1)
+        return position
+    select = unwrap(type(structure).select)
+    occurring = sorted(counts)
+    select_queries = []
+    for _ in range(args.queries):
+        charIdx = rng.choice(occurring)
+        select_queries.append((charIdx,rng.randrange(counts[charIdx])))
+    compare('select',lambda charIdx,k: select(structure,charIdx,k),naiveSelect,select_queries)
+
+    if not hasattr(structure,'rangeQuantile'):
+        return
+    length = min(args.range_length,n)
+    ranges = []
+    for _ in range(args.queries):
+        i = rng.randint(0,n - length)
+        ranges.append((i,i + length))
+    compare('range_quantile',structure.rangeQuantile,lambda i,j,k: sorted(bwt[i:j])[k],[(i,j,rng.randrange(max(j - i,1))) for i,j in ranges if j > i])
+    compare('range_top_k',structure.rangeTopK,lambda i,j,k: sorted(Counter(bwt[i:j]).items(),key=lambda item: (-item[1],item[0]))[:k],[(i,j,TOP_K) for i,j in ranges])
+    bounds = []
+    for i,j in ranges:
+        lo = rng.randint(0,sigma)
+        bounds.append((i,j,lo,rng.randint(lo,sigma + 1)))
+    compare('range_count',structure.rangeCount,lambda i,j,lo,hi: sum(lo <= c < hi for c in bwt[i:j]),bounds)
+
+def benchmarkCase(n,sigma,backend_name,bitvector,args):
+    '''
+    Measure every phase of the build and the queries for one synthetic text
+    '''
+    text,character_set = generateText(n,sigma,seed=args.seed,kind=args.text)
+    rng = random.Random(args.seed)
+    case = {"n": n, "sigma": sigma, "backend": backend_name, "block_size": args.block_size, "sa_algorithm": args.sa_algorithm, "bitvector": bitvector, "text": args.text}
+    results = []
+    def record(operation,stats,**extra):
+        results.append({"operation": operation, **case, **stats, **extra})
+        print(f'{operation:>16} n={n} sigma={sigma} {backend_name}/{bitvector}: {stats["per_op_ns"]:.0f} ns/op (median of {stats["repeats"]})')
+
+    codes = encodeText(text,character_set)
+    build_suffix_array = unwrap(get_suffix_array_builder(args.sa_algorithm))
+    record('suffix_array',measure(lambda: build_suffix_array(codes),args.build_repeats,args.warmup))
+    sa = build_suffix_array(codes)
+
+    record('bwt',measure(lambda: FMIndex.bwtFromSuffixArray(codes,sa),args.build_repeats,args.warmup))
+    bwt = FMIndex.bwtFromSuffixArray(codes,sa)
+    del sa
+
+    backend = WAVELET_BACKENDS[backend_name]
+    build_backend = unwrap(backend.__init__)
+    build_wavelet = lambda: build_backend(backend.__new__(backend),bwt,character_set,block_size=args.block_size,bitvector=bitvector)
+    build_stats = measure(build_wavelet,args.build_repeats,args.warmup)
+    structure = backend(bwt,character_set,block_size=args.block_size,bitvector=bitvector)
+    space = getSpaceStats(structure,len(bwt))
+    record('wavelet_build',build_stats,**space)
+
+    get_rank = unwrap(backend.getRank)
+    rank_queries = [(rng.randrange(len(character_set)),rng.randint(0,len(bwt))) for _ in range(args.queries)]
+    def ranks():
+        for charIdx,idx in rank_queries:
+            get_rank(structure,charIdx,idx)
+    record('rank',measure(ranks,args.repeats,args.warmup,ops=len(rank_queries)),**space)
+    if hasattr(structure,'root'):
+        # Same queries through the recursive Node methods, which the tree's flat layout replaces
+        node_rank = unwrap(type(structure.root).getRank)
+        def nodeRanks():
+            for charIdx,idx in rank_queries:
+                node_rank(structure.root,charIdx,idx)
+        record('rank_node',measure(nodeRanks,args.repeats,args.warmup,ops=len(rank_queries)),**space)
+    benchmarkWaveletQueries(structure,bwt,sigma,rng,args,record)
+
+    options = {"block_size": args.block_size, "sa_algorithm": args.sa_algorithm, "backend": backend_name, "bitvector": bitvector, "isa_sample_rate": args.isa_sample_rate}
+    build_index = unwrap(FMIndex.__init__)
+    record('index_build',measure(lambda: build_index(FMIndex.__new__(FMIndex),text,character_set,**options),args.build_repeats,args.warmup),**getBuildMemory(text,character_set,options))
+    index = FMIndex(text,character_set,**options)
+    find_match_count = unwrap(FMIndex.findMatchCount)
+    m = min(args.pattern_length,n)
+    patterns = []
+    for _ in range(args.queries):
+        start = rng.randint(0,n-m)
+        patterns.append(text[start:start+m])
+    def counts():
+        for pattern in patterns:
+            find_match_count(index,pattern)
+    record('find_match_count',measure(counts,args.repeats,args.warmup,ops=len(patterns)))
+
+    extract = unwrap(FMIndex.extract)
+    length = min(args.extract_length,n)
+    starts = [rng.randint(0,n-length) for _ in range(max(1,args.queries // 10))]
+    def extracts():
+        for start in starts:
+            extract(index,start,length)
+    stats = measure(extracts,args.repeats,args.warmup,ops=len(starts) * length)
+    record('extract',stats,isa_sample_rate=args.isa_sample_rate,chars_per_s=1e9 / stats["per_op_ns"] if stats["per_op_ns"] else None)
+    return results
+
+def rankTrendByPosition(index_path,block_size=None,points=1000,repeats=5,shift=10000,seed=None):
+    '''
+    getRank latency of the index saved at index_path over consecutive positions, for the /trends page of app.py
+    :param int block_size: rebuild the index over its own text with this block size first. None keeps the saved one
+    returns: {"text_length", "ms": queried positions, "ts": mean seconds per query}
+    '''
+    rng = random.Random(seed)
+    index = FMIndex.load(index_path)
+    if block_size is not None:
+        index = FMIndex(index.extract(0,index.text_size),index.character_set,block_size=block_size)
+    structure = index._waveletTree
+    get_rank = unwrap(type(structure).getRank)
+    n = index.text_size
+    sigma = len(index.character_set)
+    ms,ts = [],[]
+    for i in range(min(points,n + 1)):
+        position = (shift + i) % (n + 1)
+        elapsed = 0
+        for _ in range(repeats):
+            charIdx = rng.randint(min(1,sigma - 1),sigma - 1) # Exclude the meta character from tests
+            t1 = perf_counter_ns()
+            get_rank(structure,charIdx,position)
+            elapsed += perf_counter_ns() - t1
+        ms.append(position)
+        ts.append(elapsed / repeats / 1e9)
+    return {"text_length": n, "ms": ms, "ts": ts}
+
+def rankTrendByBlockSize(index_path,repeats=2,seed=None):
+    '''
+    getRank latency at block sizes of lg(n), lg(n)^2 and lg(n)^3, each on an index rebuilt over the text of the index
+    saved at index_path, for the /trends page of app.py. Probes land within half a block of a random position
+    returns: {"text_length", "ms": block sizes, "ts": mean seconds per query}
+    '''
+    rng = random.Random(seed)
+    saved = FMIndex.load(index_path)
+    n = saved.text_size
+    text,character_set = saved.extract(0,n),saved.character_set
+    del saved
+    sigma = len(character_set)
+    ms,ts = [],[]
+    for exponent in (1,2,3):
+        b = max(int(math.log2(n) ** exponent),1)
+        structure = FMIndex(text,character_set,block_size=b)._waveletTree
+        get_rank = unwrap(type(structure).getRank)
+        elapsed = 0
+        for _ in range(repeats):
+            center = rng.randint(min(b,n),max(n - b,min(b,n)))
+            position = min(max(center + rng.choice([-1,1]) * rng.randint(1,max(b // 2,1)),0),n)
+            charIdx = rng.randint(min(1,sigma - 1),sigma - 1) # Exclude the meta character from tests
+            t1 = perf_counter_ns()
+            get_rank(structure,charIdx,position)
+            elapsed += perf_counter_ns() - t1
+        ms.append(b)
+        ts.append(elapsed / repeats / 1e9)
+    return {"text_length": n, "ms": ms, "ts": ts}
+
+def getCommit():
+    try:
+        return subprocess.run(['git','rev-parse','--short','HEAD'],capture_output=True,text=True,check=True).stdout.strip()
+    except (OSError,subprocess.CalledProcessError):
+        return None
+
+def writeResults(path,report):
+    if path.endswith('.csv'):
+        with open(path,'w',newline='') as f:
+            fieldnames = ['commit']
+            for row in report['results']:
+                fieldnames.extend(key for key in row if key not in fieldnames)
+            writer = csv.DictWriter(f,fieldnames=fieldnames,restval='')
+            writer.writeheader()
+            for row in report['results']:
+                writer.writerow({"commit": report['meta']['commit'],**row})
+    else:
+        with open(path,'w') as f:
+            json.dump(report,f,indent=2)
+
+def readResults(path):
+    if path.endswith('.csv'):
+        with open(path,newline='') as f:
+            return [{**row,"per_op_ns": float(row['per_op_ns'])} for row in csv.DictReader(f)]
+    with open(path) as f:
+        return json.load(f)['results']
+
+def resultKey(result):
+    # CSV files store None as an empty field
+    values = [result.get(key,KEY_DEFAULTS.get(key)) for key in ('operation','n','sigma','backend','block_size','sa_algorithm','bitvector','text')]
+    return tuple('' if value is None else str(value) for value in values)
+
+def compareResults(results,baseline,threshold):
+    '''
+    Print the change in time per operation against a baseline run
+    Returns the operations that got slower by more than threshold (a fraction)
+    '''
+    baseline = {resultKey(result): result for result in baseline}
+    regressions = []
+    for result in results:
+        previous = baseline.get(resultKey(result))
+        if previous is None:
+            continue
+        ratio = result['per_op_ns'] / previous['per_op_ns']
+        flag = ' REGRESSION' if ratio > 1 + threshold else ''
+        print(f'{result["operation"]:>16} n={result["n"]} sigma={result["sigma"]}: {previous["per_op_ns"]:.0f} -> {result["per_op_ns"]:.0f} ns/op (x{ratio:.2f}){flag}')
+        if flag:
+            regressions.append(result)
+    return regressions
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark FM Index builds and queries on synthetic texts')
+    parser.add_argument('--n',type=int,nargs='+',default=[10000,100000],help='text lengths')
+    parser.add_argument('--sigma',type=int,nargs='+',default=[4],help='alphabet sizes, not counting the meta character')
+    parser.add_argument('--backend',nargs='+',choices=list(WAVELET_BACKENDS),default=['tree'],help='rank structures built over the BWT')
+    parser.add_argument('--block-size',type=int,default=None)
+    parser.add_argument('--sa-algorithm',default='sais')
+    parser.add_argument('--bitvector',nargs='+',choices=list(BIT_VECTOR_TYPES),default=['plain'],help='bitvector encodings of the rank structure')
+    parser.add_argument('--text',choices=['random','repetitive'],default='random',help='kind of synthetic text')
+    parser.add_argument('--pattern-length',type=int,default=12)
+    parser.add_argument('--queries',type=int,default=1000,help='rank and count queries per repetition')
+    parser.add_argument('--extract-length',type=int,default=1000,help='characters per extract query')
+    parser.add_argument('--isa-sample-rate',type=int,default=32,help='inverse suffix array sample rate of the indexes')
+    parser.add_argument('--range-length',type=int,default=1000,help='length of the ranges of the range queries')
+    parser.add_argument('--repeats',type=int,default=5,help='repetitions of the query benchmarks')
+    parser.add_argument('--build-repeats',type=int,default=3,help='repetitions of the build benchmarks')
+    parser.add_argument('--warmup',type=int,default=1)
+    parser.add_argument('--seed',type=int,default=0)
+    parser.add_argument('--output',default='bench_results.json',help='.json or .csv file to write the results to')
+    parser.add_argument('--compare',default=None,help='results of an earlier run to compare against')
+    parser.add_argument('--threshold',type=float,default=0.1,help='slowdown that counts as a regression')
+    args = parser.parse_args()
+
+    results = []
+    for n in args.n:
+        for sigma in args.sigma:
+            for backend_name in args.backend:
+                for bitvector in args.bitvector:
+                    results.extend(benchmarkCase(n,sigma,backend_name,bitvector,args))
+
+    report = {
+        "meta": {
+            "commit": getCommit(),
+            "timestamp": time(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "args": vars(args),
+        },
+        "results": results,
+    }
+    writeResults(args.output,report)
+    print(f'Results written to {args.output}')
+
+    if args.compare is not None:
+        regressions = compareResults(results,readResults(args.compare),args.threshold)
+        if regressions:
+            print(f'{len(regressions)} operations regressed by more than {args.threshold:.0%}')
+            sys.exit(1)
+
+if __name__ == '__main__': main()
@@ -1,3 +1,9 @@
-BIT_PACK_SIZE = 32 # Use to pack bit-vectors
+BIT_PACK_SIZE = 64 # Bits per packed word of a BitVector
+DEFAULT_SUPERBLOCK_SIZE = 256 # Bits covered by one absolute rank sample of a BitVector when no block size is given. Its relative ranks fit in a byte
+MAX_SUPERBLOCK_SIZE = 1 << 16 # Relative ranks inside a superblock must fit in 16 bits
+RRR_BLOCK_SIZE = 15 # Bits per block of an RRRBitVector. Its decoding table has 2^15 entries
+RRR_SUPERBLOCK_SIZE = 512 # Bits covered by one rank sample of an RRRBitVector when no block size is given
+READ_CHUNK_SIZE = 1 << 22 # Bytes read at a time when streaming a text from disk
+ENCODE_CHUNK_SIZE = 1 << 20 # Bytes translated at a time when encoding a bytearray in place
 MAX_TREE_PRINT_DEPTH = 3 # Only print the first few levels of the tree
-MAX_VEC_PRINT_LENGTH = 15 # Only print the first few bits
\ No newline at end of file
+MAX_VEC_PRINT_LENGTH = 15 # Only print the first few bits
@@ -1,4 +1,6 @@
 from FMIndex import FMIndex
+from TextReader import read_text
+from ParallelBuild import build_tree_parallel, build_matrix_levels_parallel
 from time import time
 from random import randint,choice
 from math import floor, log2
@@ -7,26 +9,35 @@ from matplotlib import pyplot as plt
 import numpy as np
 
 META_CHAR = '$'
-text = ""
 BLOCK_SIZE = None
+INDEX_PATH = f'index.b{BLOCK_SIZE}.fmi' # Built index is cached here between runs
 
 sample_data_path = '../sample-data/dna.50MB'
-if (os.path.isfile(sample_data_path)):
-    with open(sample_data_path) as f:
-        i = 0
-        for line in f.readlines()[:3]:
-            i+=1
-            line = line.strip()
-            print('read line:',i,'length:',len(line))
-            text += line
-text += META_CHAR
-sorted_chars = sorted(list(set(text+META_CHAR)))
-character_set = ''.join(sorted_chars)
+# Stream the first lines of the sample data, dropping newlines and FASTA headers
+text_buffer,character_set = read_text(sample_data_path if os.path.isfile(sample_data_path) else [],meta_char=META_CHAR,max_lines=3)
+text = text_buffer.decode('latin-1')
+del text_buffer
+print('read text of length:',len(text))
+sorted_chars = list(character_set)
+
+def isIndexStale():
+    '''
+    The cached index has to be rebuilt if it is missing or older than the sample data
+    '''
+    if not os.path.isfile(INDEX_PATH):
+        return True
+    return os.path.isfile(sample_data_path) and os.path.getmtime(INDEX_PATH) < os.path.getmtime(sample_data_path)
 
 t1 = time()
-index = FMIndex(text,character_set=character_set,debug=True, block_size=BLOCK_SIZE)
-t2 = time()
-print(f'Index has been built on the text in {(t2-t1):.3f} seconds')
+if isIndexStale():
+    index = FMIndex(text,character_set=character_set,debug=True, block_size=BLOCK_SIZE)
+    index.save(INDEX_PATH)
+    t2 = time()
+    print(f'Index has been built on the text in {(t2-t1):.3f} seconds')
+else:
+    index = FMIndex.load(INDEX_PATH)
+    t2 = time()
+    print(f'Index has been loaded from {INDEX_PATH} in {(t2-t1):.3f} seconds')
 
 def plotByBlockSize():
     ms = []
@@ -121,6 +132,110 @@ def plotBlockVsNoBlock():
    
     plt.show()
 
+def plotBatchVsScalar():
+    '''
+    Compare the throughput of findMatchCounts against calling findMatchCount in a loop
+    '''
+    n = len(text)
+    pattern_length = 12
+    batch_sizes = [10,100,1000,5000]
+    scalar_rates = []
+    batch_rates = []
+    for batch_size in batch_sizes:
+        patterns = []
+        for _ in range(batch_size):
+            start = randint(0,max(n-pattern_length-1,0))
+            patterns.append(text[start:start+pattern_length])
+
+        t1 = time()
+        counts = [index.findMatchCount(pattern) for pattern in patterns]
+        t2 = time()
+        batch_counts = index.findMatchCounts(patterns)
+        t3 = time()
+        if list(batch_counts) != counts:
+            raise AssertionError('Batched counts differ from the scalar counts')
+
+        scalar_rates.append(batch_size/(t2-t1))
+        batch_rates.append(batch_size/(t3-t2))
+        print(f'Batch size: {batch_size}, scalar: {scalar_rates[-1]:.0f} patterns/s, batched: {batch_rates[-1]:.0f} patterns/s')
+
+    fig,(ax1) = plt.subplots()
+    fig.suptitle(f'Pattern Counting Throughput (m={pattern_length})')
+
+    ax1.plot(batch_sizes,scalar_rates,'x-',label='findMatchCount loop')
+    ax1.plot(batch_sizes,batch_rates,'o-',label='findMatchCounts')
+    ax1.set_xscale('log')
+    ax1.set_ylabel('Patterns / s')
+    ax1.set_xlabel('Batch Size')
+    ax1.legend()
+    plt.show()
+
+def plotBuildByWorkers(n=300_000_000,character_size=6):
+    '''
+    Wall-clock time of the numpy wavelet tree and wavelet matrix builds
+    over a synthetic text of n characters, for an increasing number of worker processes
+    '''
+    codes = np.random.randint(0,character_size,size=n,dtype=np.uint8)
+    height = (character_size-1).bit_length()
+    worker_counts = [w for w in [1,2,4,8,16] if w <= (os.cpu_count() or 1)]
+    tree_ts = []
+    matrix_ts = []
+    for workers in worker_counts:
+        t1 = time()
+        build_tree_parallel(codes,character_size,workers=workers)
+        t2 = time()
+        build_matrix_levels_parallel(codes,height,workers=workers)
+        t3 = time()
+        tree_ts.append(t2-t1)
+        matrix_ts.append(t3-t2)
+        print(f'Workers: {workers}, tree: {tree_ts[-1]:.2f}s (x{tree_ts[0]/tree_ts[-1]:.2f}), matrix: {matrix_ts[-1]:.2f}s (x{matrix_ts[0]/matrix_ts[-1]:.2f})')
+
+    fig,(ax1) = plt.subplots()
+    fig.suptitle(f'Build Time vs Workers (n={n}, Σ={character_size})')
+
+    ax1.plot(worker_counts,tree_ts,'x-',label='WaveletTree')
+    ax1.plot(worker_counts,matrix_ts,'o-',label='WaveletMatrix')
+    ax1.set_ylabel('Build Time (s)')
+    ax1.set_xlabel('Worker Processes')
+    ax1.legend()
+    plt.show()
+
+def plotKmerSpeedup(kmer_length=12):
+    '''
+    Average findMatchCount latency by pattern length, with and without a k-mer table
+    '''
+    n = len(text)
+    kmerIndex = FMIndex(text,character_set=character_set,block_size=BLOCK_SIZE,kmer_length=kmer_length)
+    num_repeats = 500
+    pattern_lengths = [kmer_length,kmer_length+4,2*kmer_length,4*kmer_length]
+    ts = []
+    kmer_ts = []
+    for m in pattern_lengths:
+        patterns = []
+        for _ in range(num_repeats):
+            start = randint(0,max(n-m-1,0))
+            patterns.append(text[start:start+m])
+        t1 = time()
+        for pattern in patterns:
+            index.findMatchCount(pattern)
+        t2 = time()
+        for pattern in patterns:
+            kmerIndex.findMatchCount(pattern)
+        t3 = time()
+        ts.append((t2-t1)*1000/num_repeats)
+        kmer_ts.append((t3-t2)*1000/num_repeats)
+        print(f'Pattern length: {m}, without table: {ts[-1]:.4f}ms, with table: {kmer_ts[-1]:.4f}ms')
+
+    fig,(ax1) = plt.subplots()
+    fig.suptitle(f'Query Time vs Pattern Length (k={kmer_length})')
+
+    ax1.plot(pattern_lengths,ts,'x-',label='backward search')
+    ax1.plot(pattern_lengths,kmer_ts,'o-',label='k-mer table + backward search')
+    ax1.set_ylabel('Query Time (ms)')
+    ax1.set_xlabel('Pattern Length')
+    ax1.legend()
+    plt.show()
+
 def main():
     plotByBlockSize()
 
@@ -0,0 +1,84 @@
+import random
+
+import pytest
+
+from BidirectionalFMIndex import BidirectionalFMIndex
+from FMIndex import FMIndex
+
+def hammingMatches(text,pattern,max_mismatches):
+  # Every window of the text before its terminator, with the mismatches of the pattern against it
+  matches = []
+  for start in range(len(text) - len(pattern)):
+    mismatches = sum(a != b for a,b in zip(pattern,text[start:start + len(pattern)]))
+    if mismatches <= max_mismatches:
+      matches.append((start,mismatches))
+  return matches
+
+def randomText(seed,n = 300):
+  rng = random.Random(seed)
+  return ''.join(rng.choices('acgt',weights=[40,30,20,10],k=n)) + '$'
+
+@pytest.mark.parametrize('backend',['tree','matrix','runlength'])
+def test_extensions_match_get_interval(backend):
+  rng = random.Random(23)
+  text = randomText(backend)
+  index = BidirectionalFMIndex(text,'$acgt',backend=backend,sa_sample_rate=4)
+  for _ in range(150):
+    length = rng.randint(0,8)
+    start = rng.randrange(len(text) - length)
+    pattern = text[start:start + length] if rng.random() < 0.7 else ''.join(rng.choices('acgt',k=length))
+    interval = index.getInterval(pattern)
+    positions = [i for i in range(len(text)) if text.startswith(pattern,i)]
+    assert interval[2] == len(positions)
+    for c in 'acgtn':
+      assert index.extendLeft(interval,c) == index.getInterval(c + pattern)
+      assert index.extendRight(interval,c) == index.getInterval(pattern + c)
+    if interval[2]:
+      assert index.extendLeftAll(interval) == {c: index.getInterval(c + pattern) for c in 'acgt' if index.getInterval(c + pattern)[2]}
+      assert index.extendRightAll(interval) == {c: index.getInterval(pattern + c) for c in 'acgt' if index.getInterval(pattern + c)[2]}
+      assert index.locate(interval) == positions
+  # Extending an empty interval stays empty
+  assert index.extendLeft((0,0,0),'a') == index.extendRight((0,0,0),'a') == (0,0,0)
+  assert index.extendLeftAll((0,0,0)) == index.extendRightAll((0,0,0)) == {}
+
+def test_extensions_in_any_order_reach_the_same_interval():
+  rng = random.Random(24)
+  text = randomText(24)
+  index = BidirectionalFMIndex(text,'$acgt')
+  for _ in range(50):
+    start = rng.randrange(len(text) - 10)
+    pattern = text[start:start + 10]
+    # Grow the pattern outwards from a middle seed, alternating sides
+    lo = hi = rng.randrange(10)
+    interval = index.getInterval()
+    while lo > 0 or hi < 10:
+      if hi < 10 and (lo == 0 or rng.random() < 0.5):
+        interval = index.extendRight(interval,pattern[hi])
+        hi += 1
+      else:
+        lo -= 1
+        interval = index.extendLeft(interval,pattern[lo])
+      assert interval == index.getInterval(pattern[lo:hi])
+
+@pytest.mark.parametrize('backend',['tree','runlength'])
+def test_approximate_search_matches_a_hamming_scan(backend):
+  rng = random.Random(25)
+  text = randomText(backend,250)
+  index = BidirectionalFMIndex(text,'$acgt',backend=backend,sa_sample_rate=3)
+  forward = FMIndex(text,'$acgt')
+  patterns = ['a','gn','nnn','acgt','tttt']
+  for _ in range(50):
+    length = rng.randint(1,10)
+    start = rng.randrange(len(text) - length)
+    pattern = list(text[start:start + length])
+    for _ in range(rng.randint(0,3)):
+      pattern[rng.randrange(length)] = rng.choice('acgtn')
+    patterns.append(''.join(pattern))
+  for pattern in patterns:
+    # Includes max_mismatches >= len(pattern), where every piece could mismatch
+    for max_mismatches in range(4):
+      expected = hammingMatches(text,pattern,max_mismatches)
+      matches = index.locateApproximate(pattern,max_mismatches)
+      assert len({position for position,_ in matches}) == len(matches)
+      assert matches == expected == forward.locateApproximate(pattern,max_mismatches)
+      assert index.findApproximateMatchCount(pattern,max_mismatches) == len(expected)
@@ -0,0 +1,96 @@
+import random
+
+import numpy as np
+import pytest
+
+from BitVector import BIT_VECTOR_TYPES
+from constants import RRR_BLOCK_SIZE
+
+def randomBits(rng,n,density):
+  return [int(rng.random() < density) for _ in range(n)]
+
+def runBits(rng,n,mean_run):
+  bits,bit = [],rng.randrange(2)
+  while len(bits) < n:
+    bits.extend([bit] * rng.randint(1,2 * mean_run))
+    bit ^= 1
+  return bits[:n]
+
+def checkAgainstList(bit_vector,bits):
+  n = len(bits)
+  assert len(bit_vector) == n
+  assert bit_vector.ones == sum(bits)
+  ranks = [0]
+  for bit in bits:
+    ranks.append(ranks[-1] + bit)
+  for i in range(n):
+    assert bit_vector.access(i) == bits[i]
+  for i in range(n + 1):
+    assert bit_vector.rank1(i) == ranks[i]
+    assert bit_vector.rank0(i) == i - ranks[i]
+  for i,j in ((0,n),(n // 3,n // 2),(n,n)):
+    assert bit_vector.rank1Pair(i,j) == (ranks[i],ranks[j])
+  ones = [i for i,bit in enumerate(bits) if bit]
+  zeros = [i for i,bit in enumerate(bits) if not bit]
+  assert [bit_vector.select1(k) for k in range(len(ones))] == ones
+  assert [bit_vector.select0(k) for k in range(len(zeros))] == zeros
+  for select,total in ((bit_vector.select1,len(ones)),(bit_vector.select0,len(zeros))):
+    with pytest.raises(ValueError):
+      select(total)
+  idxs = np.arange(n + 1)
+  assert bit_vector.rank1Many(idxs).tolist() == ranks
+  with pytest.raises(IndexError):
+    bit_vector.access(n)
+
+# Lengths around the RRR block, 4-block chunk and word boundaries
+LENGTHS = [0,1,RRR_BLOCK_SIZE - 1,RRR_BLOCK_SIZE,RRR_BLOCK_SIZE + 1,4 * RRR_BLOCK_SIZE + 7,63,64,65,1000,2049]
+
+@pytest.mark.parametrize('bitvector',list(BIT_VECTOR_TYPES))
+@pytest.mark.parametrize('superblock_size',[None,64,100,200,320,1000])
+def test_random_bits(bitvector,superblock_size):
+  rng = random.Random(f'{bitvector}{superblock_size}')
+  for n in LENGTHS:
+    for density in (0.05,0.5,0.95):
+      bits = randomBits(rng,n,density)
+      checkAgainstList(BIT_VECTOR_TYPES[bitvector](bits,superblock_size=superblock_size),bits)
+
+@pytest.mark.parametrize('bitvector',list(BIT_VECTOR_TYPES))
+@pytest.mark.parametrize('superblock_size',[None,100,320])
+def test_run_heavy_bits(bitvector,superblock_size):
+  rng = random.Random(f'{bitvector}{superblock_size}')
+  for n in LENGTHS:
+    for mean_run in (3,40,500):
+      bits = runBits(rng,n,mean_run)
+      checkAgainstList(BIT_VECTOR_TYPES[bitvector](bits,superblock_size=superblock_size),bits)
+
+@pytest.mark.parametrize('bitvector',list(BIT_VECTOR_TYPES))
+def test_constant_bits(bitvector):
+  for n in LENGTHS:
+    for bit in (0,1):
+      for superblock_size in (None,100):
+        bits = [bit] * n
+        checkAgainstList(BIT_VECTOR_TYPES[bitvector](bits,superblock_size=superblock_size),bits)
+
+@pytest.mark.parametrize('bitvector',list(BIT_VECTOR_TYPES))
+def test_from_numpy_matches_the_python_build(bitvector):
+  rng = random.Random(bitvector)
+  for n in LENGTHS:
+    bits = runBits(rng,n,5)
+    for superblock_size in (None,100):
+      bit_vector = BIT_VECTOR_TYPES[bitvector].fromNumpy(np.array(bits,dtype=bool),superblock_size=superblock_size)
+      checkAgainstList(bit_vector,bits)
+
+def test_default_rank_directory_is_a_quarter_of_the_bits():
+  rng = random.Random(2)
+  bits = randomBits(rng,100000,0.5)
+  for bit_vector in (BIT_VECTOR_TYPES['plain'](bits),BIT_VECTOR_TYPES['plain'].fromNumpy(np.array(bits,dtype=bool))):
+    # 32-bit superblock ranks every 256 bits and one byte per word
+    assert bit_vector._superblock_ranks.itemsize == 4 and bit_vector._block_ranks.itemsize == 1
+    assert bit_vector.getSpaceUsage()["directory_bits"] <= 0.26 * len(bits)
+  assert BIT_VECTOR_TYPES['rrr'](bits).getSpaceUsage()["directory_bits"] <= 0.3 * len(bits)
+
+def test_fm_index_uses_the_default_superblocks():
+  from FMIndex import FMIndex
+  from constants import DEFAULT_SUPERBLOCK_SIZE
+  index = FMIndex('acgtacgtaacc' * 100 + '$','$acgt')
+  assert index._waveletTree.root.bit_vector._words_per_superblock * 64 == DEFAULT_SUPERBLOCK_SIZE
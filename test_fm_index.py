@@ -0,0 +1,199 @@
+import random
+
+import pytest
+
+from FMIndex import FMIndex
+
+@pytest.mark.parametrize('backend',['tree','matrix','runlength'])
+@pytest.mark.parametrize('isa_sample_rate',[1,7,32])
+def test_extract(backend,isa_sample_rate):
+  rng = random.Random(isa_sample_rate)
+  text = ''.join(rng.choice('acgt') for _ in range(1000)) + '$'
+  index = FMIndex(text,'$acgt',backend=backend,isa_sample_rate=isa_sample_rate)
+  assert index.extract(0,len(text)) == text
+  # Short extracts near a sample take the forward (psi) walk, the others the backward (LF) walk
+  for start in range(0,len(text),5):
+    for length in (0,1,2,9,40):
+      if start + length <= len(text):
+        assert index.extract(start,length) == text[start:start + length]
+
+def test_extract_large_alphabet():
+  rng = random.Random(0)
+  text = ''.join(chr(300 + rng.randrange(5)) for _ in range(500)) + '$'
+  index = FMIndex(text,''.join(sorted(set(text))),isa_sample_rate=16)
+  for start in range(0,len(text),3):
+    assert index.extract(start,3) == text[start:start + 3]
+
+def test_extract_bounds():
+  index = FMIndex('acgt$','$acgt')
+  with pytest.raises(ValueError):
+    index.extract(3,3)
+
+@pytest.mark.parametrize('backend',['tree','matrix','runlength'])
+def test_count_only_index(tmp_path,backend):
+  text = 'acgtacgttgcaacgtaacc' * 30 + '$'
+  index = FMIndex(text,'$acgt',backend=backend,sa_sample_rate=None,isa_sample_rate=None)
+  index.save(tmp_path / 'index.fmi')
+  loaded = FMIndex.load(tmp_path / 'index.fmi')
+  for searcher in (index,loaded):
+    assert searcher.findMatchCount('acgt') == text.count('acgt')
+    with pytest.raises(ValueError):
+      searcher.locate('acgt')
+    with pytest.raises(ValueError):
+      searcher.extract(0,4)
+
+def test_sampled_rows_are_compressed_for_space():
+  text = 'acgtacgttgcaacgtaacc' * 30 + '$'
+  plain = FMIndex(text,'$acgt')
+  compressed = FMIndex(text,'$acgt',backend='runlength')
+  assert type(plain._sampled_rows).__name__ == 'BitVector'
+  assert type(compressed._sampled_rows).__name__ == 'RRRBitVector'
+  assert compressed.locate('cgtaa') == plain.locate('cgtaa') == [i for i in range(len(text)) if text.startswith('cgtaa',i)]
+
+def hammingMatches(text,pattern,max_mismatches):
+  # Every window of the text before its terminator, with the mismatches of the pattern against it
+  matches = []
+  for start in range(len(text) - len(pattern)):
+    mismatches = sum(a != b for a,b in zip(pattern,text[start:start + len(pattern)]))
+    if mismatches <= max_mismatches:
+      matches.append((start,mismatches))
+  return matches
+
+def randomPatterns(rng,text,alphabet,count):
+  patterns = []
+  for _ in range(count):
+    length = rng.randint(1,9)
+    start = rng.randrange(len(text) - length)
+    pattern = list(text[start:start + length])
+    # Mutate a few characters, sometimes into characters that are not in the alphabet
+    for _ in range(rng.randint(0,3)):
+      pattern[rng.randrange(length)] = rng.choice(alphabet + 'nN')
+    patterns.append(''.join(pattern))
+  return patterns + ['n','nn','anc','gNNt','acgtacgtac']
+
+@pytest.mark.parametrize('backend',['tree','matrix','runlength'])
+def test_approximate_search_matches_a_hamming_scan(backend):
+  rng = random.Random(18)
+  text = ''.join(rng.choices('acgt',weights=[40,30,20,10],k=400)) + '$'
+  index = FMIndex(text,'$acgt',backend=backend,sa_sample_rate=5)
+  for pattern in randomPatterns(rng,text,'acgt',60):
+    for max_mismatches in range(4):
+      expected = hammingMatches(text,pattern,max_mismatches)
+      assert index.locateApproximate(pattern,max_mismatches) == expected
+      assert index.findApproximateMatchCount(pattern,max_mismatches) == len(expected)
+      intervals = sorted((sp,ep) for sp,ep,_ in index._approximateSearch(pattern,max_mismatches))
+      assert all(ep > sp for sp,ep in intervals)
+      assert all(a[1] <= b[0] for a,b in zip(intervals,intervals[1:]))
+
+def test_mismatch_bounds_never_exceed_the_best_match():
+  rng = random.Random(19)
+  text = ''.join(rng.choices('acgt',k=300)) + '$'
+  index = FMIndex(text,'$acgt')
+  for pattern in randomPatterns(rng,text,'acgt',100):
+    bounds = index._getMismatchBounds(pattern)
+    assert len(bounds) == len(pattern) + 1 and bounds[0] == 0
+    assert bounds == sorted(bounds)
+    for i in range(1,len(pattern) + 1):
+      best = min(mismatches for _,mismatches in hammingMatches(text,pattern[:i],i))
+      assert bounds[i] <= best
+
+@pytest.mark.parametrize('bitvector',['plain','rrr'])
+@pytest.mark.parametrize('character_set',['$ab','$acgt','$' + ''.join(chr(97 + c) for c in range(20))])
+def test_matrix_and_tree_backends_agree(bitvector,character_set):
+  rng = random.Random(character_set)
+  for n in (1,64,500):
+    text = ''.join(rng.choices(character_set[1:],k=n)) + '$'
+    tree = FMIndex(text,character_set,bitvector=bitvector)
+    matrix = FMIndex(text,character_set,backend='matrix',bitvector=bitvector)
+    assert matrix._skip_count == tree._skip_count
+    size = len(text)
+    for idx in range(0,size + 1,max(size // 50,1)):
+      assert matrix._waveletTree.getRankAll(idx) == tree._waveletTree.getRankAll(idx)
+      for charIdx in range(len(character_set)):
+        assert matrix._waveletTree.getRank(charIdx,idx) == tree._waveletTree.getRank(charIdx,idx)
+        assert matrix._waveletTree.getRankPair(charIdx,idx // 2,idx) == tree._waveletTree.getRankPair(charIdx,idx // 2,idx)
+    for idx in range(size):
+      assert matrix._waveletTree.getCharAndRank(idx) == tree._waveletTree.getCharAndRank(idx)
+    for _ in range(50):
+      length = rng.randint(1,min(5,size))
+      start = rng.randrange(size - length + 1)
+      pattern = text[start:start + length]
+      assert matrix.findMatchCount(pattern) == tree.findMatchCount(pattern)
+      assert matrix.locate(pattern) == tree.locate(pattern)
+
+@pytest.mark.parametrize('backend',['tree','matrix','runlength'])
+@pytest.mark.parametrize('sa_sample_rate',[1,2,7,32,97])
+def test_locate_matches_a_naive_scan(backend,sa_sample_rate):
+  rng = random.Random(sa_sample_rate)
+  text = ''.join(rng.choices('acgt',weights=[40,30,20,10],k=300)) + '$'
+  index = FMIndex(text,'$acgt',backend=backend,sa_sample_rate=sa_sample_rate)
+  patterns = [text[:3],text[-4:],'$','a','acgtn','gggggggg']
+  for _ in range(60):
+    length = rng.randint(1,8)
+    start = rng.randrange(len(text) - length)
+    patterns.append(text[start:start + length] if rng.random() < 0.8 else ''.join(rng.choices('acgt',k=length)))
+  for pattern in patterns:
+    expected = [i for i in range(len(text)) if text.startswith(pattern,i)]
+    assert index.locate(pattern) == expected
+    assert sorted(index.iterLocate(pattern)) == expected
+  # Every row resolves to its own position, however far it is from a sample
+  assert sorted(index._getSuffixArrayEntry(row) for row in range(len(text))) == list(range(len(text)))
+
+def test_cached_counts_match_uncached_counts():
+  rng = random.Random(10)
+  text = ''.join(rng.choices('acgt',k=500)) + '$'
+  uncached = FMIndex(text,'$acgt')
+  cached = FMIndex(text,'$acgt',cache_size=8)
+  # Few distinct patterns, many of them suffixes of each other, so that hits, partial hits and evictions all happen
+  stems = [''.join(rng.choices('acgt',k=6)) for _ in range(5)]
+  patterns = [rng.choice('acgtn') * rng.randint(0,2) + stem[rng.randrange(6):] for stem in rng.choices(stems,k=400)]
+  for pattern in patterns:
+    assert cached.findMatchCount(pattern) == uncached.findMatchCount(pattern)
+    assert cached.locate(pattern) == uncached.locate(pattern)
+  stats = cached.getCacheStats()
+  assert stats["size"] == 8
+  assert stats["hits"] and stats["partial_hits"] and stats["evictions"]
+  # Every non-empty query looks the cache up once per findMatchCount and once per locate
+  assert stats["hits"] + stats["partial_hits"] + stats["misses"] == 2 * sum(map(bool,patterns))
+  assert uncached.getCacheStats() is None
+
+def test_interval_cache_evicts_the_least_recently_used_pattern():
+  from IntervalCache import IntervalCache
+  cache = IntervalCache(3)
+  for pattern in ('a','ca','gca'):
+    cache.put(pattern,(len(pattern),len(pattern) + 1))
+  # Looking 'a' up makes 'ca' the least recently used pattern
+  assert cache.getLongestSuffix('ta') == (1,(1,2))
+  cache.put('t',(7,8))
+  assert list(cache._intervals) == ['gca','a','t']
+  # Putting an existing pattern refreshes it without evicting anything
+  cache.put('gca',(3,5))
+  assert list(cache._intervals) == ['a','t','gca']
+  assert cache.getLongestSuffix('tgca') == (1,(3,5))
+  cache.put('c',(4,6))
+  assert list(cache._intervals) == ['t','gca','c']
+  assert cache.getLongestSuffix('ac') == (1,(4,6))
+  assert cache.getLongestSuffix('g') is None
+  assert cache.getStats() == {"capacity": 3,"size": 3,"hits": 0,"partial_hits": 3,"misses": 1,"evictions": 2}
+  with pytest.raises(ValueError):
+    IntervalCache(0)
+
+@pytest.mark.parametrize('kmer_length',[1,3,5])
+@pytest.mark.parametrize('cache_size',[0,4])
+def test_kmer_table_counts_match_plain_search(kmer_length,cache_size):
+  rng = random.Random(kmer_length)
+  text = ''.join(rng.choices('acgt',weights=[40,30,20,10],k=500)) + '$'
+  plain = FMIndex(text,'$acgt')
+  index = FMIndex(text,'$acgt',kmer_length=kmer_length,cache_size=cache_size)
+  # One entry per distinct k-mer of the text, the terminator included
+  assert len(index._kmer_table) == len({text[i:i + kmer_length] for i in range(len(text) - kmer_length + 1)})
+  patterns = ['',text[-kmer_length - 1:],text[-kmer_length:],'n' * kmer_length,'a' * (kmer_length - 1) + 'n']
+  # Patterns shorter than, as long as and longer than k
+  for length in (kmer_length - 1,kmer_length,kmer_length + 1,kmer_length + 4):
+    for _ in range(40):
+      start = rng.randrange(len(text) - length)
+      pattern = text[start:start + length] if rng.random() < 0.7 else ''.join(rng.choices('acgt',k=length))
+      patterns.extend((pattern,pattern[:-1] + 'n' if pattern else 'n','n' + pattern))
+  for pattern in patterns:
+    assert index.findMatchCount(pattern) == plain.findMatchCount(pattern)
+    assert index._backwardSearch(pattern) == plain._backwardSearch(pattern)
@@ -0,0 +1,39 @@
+import random
+from collections import Counter
+
+import pytest
+
+from IncrementalIndex import IncrementalIndex
+
+@pytest.mark.parametrize('workers',[0,1,2,3])
+@pytest.mark.parametrize('fanout',[2,3])
+def test_tiers_are_bounded_after_close(tmp_path,workers,fanout):
+  rng = random.Random(workers * 10 + fanout)
+  index = IncrementalIndex(str(tmp_path),overlap=4,flush_size=20,fanout=fanout,workers=workers)
+  corpus = ''
+  for _ in range(150):
+    text = ''.join(rng.choice('acgt') for _ in range(rng.randint(1,40)))
+    index.append(text)
+    corpus += text
+  index.close()
+  tiers = [segment["tier"] for segment in index.segments]
+  assert max(Counter(tiers).values()) <= fanout - 1
+  assert tiers == sorted(tiers,reverse=True)
+  assert all(segment["state"] == 'indexed' for segment in index.segments)
+  assert index.count('acg') == sum(corpus.startswith('acg',i) for i in range(len(corpus)))
+  assert index.locate('tta') == [i for i in range(len(corpus)) if corpus.startswith('tta',i)]
+
+  reopened = IncrementalIndex(str(tmp_path),workers=0)
+  try:
+    assert [segment["tier"] for segment in reopened.segments] == tiers
+    assert reopened.text_size == len(corpus)
+  finally:
+    reopened.close()
+
+def test_close_stops_workers_after_a_failed_build(tmp_path):
+  index = IncrementalIndex(str(tmp_path),flush_size=10,workers=1,backend='unknown')
+  index.append('acgtacgtacgt')
+  with pytest.raises(ValueError):
+    index.close()
+  with pytest.raises(RuntimeError):
+    index._executor.submit(len,'')
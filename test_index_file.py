@@ -0,0 +1,27 @@
+import pytest
+
+from BidirectionalFMIndex import BidirectionalFMIndex
+from FMIndex import FMIndex
+
+TEXT = 'acgtacgttgcaacgtaacc' * 30 + '$'
+CHARACTER_SET = '$acgt'
+
+@pytest.mark.parametrize('backend',['tree','matrix','runlength'])
+@pytest.mark.parametrize('bitvector',['plain','rrr','runlength'])
+def test_loaded_index_saves_again(tmp_path,backend,bitvector):
+  index = FMIndex(TEXT,CHARACTER_SET,backend=backend,bitvector=bitvector,kmer_length=3)
+  index.save(tmp_path / 'first.fmi')
+  FMIndex.load(tmp_path / 'first.fmi').save(tmp_path / 'second.fmi')
+  loaded = FMIndex.load(tmp_path / 'second.fmi')
+  for pattern in ('a','acg','gtt','cgtaa','ttt'):
+    assert loaded.findMatchCount(pattern) == index.findMatchCount(pattern)
+    assert loaded.locate(pattern) == index.locate(pattern)
+  assert loaded.extract(5,40) == TEXT[5:45]
+
+def test_loaded_bidirectional_index_saves_again(tmp_path):
+  index = BidirectionalFMIndex(TEXT,CHARACTER_SET)
+  index.save(tmp_path / 'first.fmi')
+  BidirectionalFMIndex.load(tmp_path / 'first.fmi').save(tmp_path / 'second.fmi')
+  loaded = BidirectionalFMIndex.load(tmp_path / 'second.fmi')
+  for pattern in ('acga','ttgc','cgtac'):
+    assert loaded.locateApproximate(pattern,1) == index.locateApproximate(pattern,1)
@@ -0,0 +1,71 @@
+import threading
+
+import pytest
+
+import Instrumentation
+from FMIndex import FMIndex
+
+TEXT = 'acgtacgttgcaacgtaacc' * 30 + '$'
+
+@pytest.fixture
+def instrumentation():
+  Instrumentation.enable()
+  try:
+    yield Instrumentation
+  finally:
+    Instrumentation.disable()
+    Instrumentation.reset()
+
+@pytest.mark.parametrize('backend,owner',[('tree','WaveletTree'),('matrix','WaveletMatrix'),('runlength','RunLengthBWT')])
+def test_only_outermost_rank_queries_are_recorded(instrumentation,backend,owner):
+  index = FMIndex(TEXT,'$acgt',backend=backend)
+  pattern = 'acgtt'
+  index.findMatchCount(pattern)
+  rank = instrumentation.getMetrics()["rank"]
+  # One rank pair per backward search step
+  assert set(rank) == {f'{owner}.getRankPair'}
+  assert rank[f'{owner}.getRankPair']["queries"] == len(pattern)
+  assert instrumentation.getMetrics()["operations"][f'{owner}.getRankPair']["count"] == len(pattern)
+
+def test_probes_are_counted_per_thread(instrumentation):
+  index = FMIndex(TEXT,'$acgt',backend='runlength')
+  pattern = 'acgtt'
+  index.findMatchCount(pattern)
+  single = instrumentation.getMetrics()["rank"]['RunLengthBWT.getRankPair']
+  instrumentation.reset()
+
+  # A rank query that is running in another thread does not hide the queries of this one
+  entered,release = threading.Event(),threading.Event()
+  blocked = instrumentation._rankTimed(lambda: (entered.set(),release.wait()),instrumentation.LatencyHistogram(),[0,0,0])
+  blocker = threading.Thread(target=blocked)
+  blocker.start()
+  entered.wait()
+  try:
+    threads = [threading.Thread(target=lambda: [index.findMatchCount(pattern) for _ in range(50)]) for _ in range(4)]
+    for thread in threads:
+      thread.start()
+    for thread in threads:
+      thread.join()
+  finally:
+    release.set()
+    blocker.join()
+  rank = instrumentation.getMetrics()["rank"]['RunLengthBWT.getRankPair']
+  assert rank["queries"] == 200 * single["queries"]
+  assert rank["nodes_visited"] == 200 * single["nodes_visited"]
+  assert rank["bits_scanned"] == 200 * single["bits_scanned"]
+
+def test_flat_queries_are_measured_as_they_run(instrumentation,monkeypatch):
+  from WaveletTree import WaveletTree
+  from WaveletTreeNode import Node
+  index = FMIndex(TEXT,'$acgt')
+  monkeypatch.setattr(WaveletTree,'flat_queries',False)
+  queries = lambda: (index.findMatchCount('acgtt'),index.locate('cgta'),index._waveletTree.getRankAll(100),index._waveletTree.getRank(2,300))
+  expected = queries()
+  node_rank = instrumentation.getMetrics()["rank"]
+  instrumentation.reset()
+  monkeypatch.setattr(WaveletTree,'flat_queries',True)
+  for method in ('getRank','getRankPair','getRankAll','getCharAndRank'):
+    monkeypatch.setattr(Node,method,lambda *args: pytest.fail('Node path used'))
+  assert queries() == expected
+  # Same ranks and scanned bits as the bitvector ranks of the Node path count
+  assert instrumentation.getMetrics()["rank"] == node_rank
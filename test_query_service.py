@@ -0,0 +1,46 @@
+import time
+
+import pytest
+
+from FMIndex import FMIndex
+from QueryService import QueryService
+
+def wait(service,job_id,timeout=60):
+  deadline = time.time() + timeout
+  while service.getJob(job_id)["status"] in ('queued','running'):
+    assert time.time() < deadline
+    time.sleep(0.05)
+  return service.getJob(job_id)
+
+def textSize(index_path,cache_size=0):
+  return FMIndex.load(index_path,cache_size=cache_size).text_size
+
+@pytest.fixture
+def service(tmp_path):
+  index_path = str(tmp_path / 'index.fmi')
+  FMIndex('acgtacgtta$','$acgt').save(index_path)
+  service = QueryService(index_path,workers=1)
+  try:
+    yield service
+  finally:
+    service.close()
+
+def test_task_result_is_kept(service):
+  job_id = service.submitTask('size',textSize,service._index_path,cache_size=4)
+  job = wait(service,job_id)
+  assert job["status"] == "done"
+  assert job["kind"] == "size"
+  assert job["options"] == {"cache_size": 4}
+  assert job["result"] == 11
+  assert service.count('acgt') == 2
+
+def test_failed_task_is_reported(service):
+  job = wait(service,service.submitTask('size',textSize,service._index_path + '.missing'))
+  assert job["status"] == "failed"
+  assert 'FileNotFoundError' in job["error"]
+
+def test_rebuild_swaps_the_index(service):
+  job = wait(service,service.submitRebuild(['acgtacgtacgt'],meta_char='$'))
+  assert job["status"] == "done"
+  assert service.generation == 1
+  assert service.count('acgt') == 3
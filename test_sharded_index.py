@@ -0,0 +1,29 @@
+import pytest
+
+from ShardedIndex import ShardedIndex
+from TextReader import read_documents
+
+@pytest.mark.parametrize('chunk_size,overlap',[(None,0),(3,3)])
+def test_empty_documents_have_no_shard(tmp_path,chunk_size,overlap):
+  documents = list(read_documents(['>a\n>b\nACGTACG\n>c\n>d\nGTAC\n']))
+  index = ShardedIndex.build(documents,str(tmp_path / 'shards'),chunk_size=chunk_size,overlap=overlap,workers=1)
+  try:
+    assert index.documents == [{"name": name, "length": len(text)} for name,text in documents]
+    assert index.count('GTA') == 2
+    assert index.countByDocument('AC') == {'b': 2, 'd': 1}
+    assert index.locate('TAC') == [('b',3),('d',1)]
+  finally:
+    index.close()
+
+def test_corpus_of_empty_documents(tmp_path):
+  index = ShardedIndex.build({'a': '', 'b': ''},str(tmp_path / 'shards'),workers=1)
+  try:
+    assert index.shards == 0
+    assert index.count('A') == 0
+    assert index.locate('A') == []
+  finally:
+    index.close()
+
+def test_duplicate_document_names(tmp_path):
+  with pytest.raises(ValueError):
+    ShardedIndex.build([('a','ACGT'),('a','')],str(tmp_path / 'shards'),workers=1)
@@ -0,0 +1,48 @@
+import random
+from array import array
+
+import pytest
+
+from SuffixArray import get_suffix_array_builder
+
+sais = get_suffix_array_builder('sais')
+doubling = get_suffix_array_builder('doubling')
+
+def naive_suffix_array(s):
+  return sorted(range(len(s)),key=lambda i: s[i:])
+
+def check(s):
+  expected = naive_suffix_array(s)
+  assert list(sais(s)) == expected
+  assert list(doubling(s)) == expected
+
+@pytest.mark.parametrize('alphabet',['ab','acgt','abcdefghijklmnopqrstuvwxyz'])
+@pytest.mark.parametrize('terminated',[True,False])
+def test_random_texts(alphabet,terminated):
+  rng = random.Random(len(alphabet) * 2 + terminated)
+  for _ in range(100):
+    text = ''.join(rng.choice(alphabet) for _ in range(rng.randint(1,200)))
+    check(text + '$' if terminated else text)
+
+@pytest.mark.parametrize('text',['a$','$','aaaaaaaaaaaa$','aaaaaaaaaaaa','abababababab$','abcabcabcabcab$','aabaabaabaab$','mississippi$','banana$'])
+def test_edge_cases(text):
+  check(text)
+
+def test_long_periodic_text():
+  check('acgtt' * 400 + '$')
+  check('a' * 2000 + '$')
+
+def test_integer_buffers():
+  rng = random.Random(0)
+  codes = [rng.randrange(1,5) for _ in range(500)] + [0]
+  check(codes)
+  assert list(sais(array('B',codes))) == list(sais(bytes(codes))) == naive_suffix_array(codes)
+
+@pytest.mark.parametrize('symbols',[257,1000,70000])
+def test_large_alphabets(symbols):
+  rng = random.Random(symbols)
+  codes = [rng.randrange(1,symbols) for _ in range(1000)] + [0]
+  check(codes)
+  periodic = list(range(symbols - 1,max(symbols - 300,0),-1)) * 3 + [0]
+  check(periodic)
+  check(''.join(chr(0x100 + code) for code in codes[:300]))
@@ -0,0 +1,131 @@
+import random
+
+import pytest
+
+from WaveletTree import WaveletTree
+
+def buildFlatTree(text,character_set,**options):
+  tree = WaveletTree(text,character_set,**options)
+  assert tree._flat is not None
+  return tree
+
+def queryAll(tree,monkeypatch,flat):
+  monkeypatch.setattr(WaveletTree,'flat_queries',flat)
+  n,sigma = tree._size,tree._character_size
+  positions = sorted({0,n,n // 2,*range(0,n + 1,max(n // 40,1))})
+  return (
+    [tree.getRank(charIdx,idx) for charIdx in range(sigma) for idx in positions],
+    [tree.getRankPair(charIdx,i,j) for charIdx in range(sigma) for i,j in zip(positions,positions[1:] + [n])],
+    [tree.getRankAll(idx) for idx in positions],
+    [tree.getCharAndRank(idx) for idx in range(n)],
+  )
+
+@pytest.mark.parametrize('shape',['balanced','huffman'])
+@pytest.mark.parametrize('sigma',[2,3,5,16,70])
+def test_flat_queries_match_the_node_path(monkeypatch,shape,sigma):
+  rng = random.Random(sigma)
+  character_set = ''.join(chr(40 + c) for c in range(sigma))
+  for n in (0,1,63,64,65,700):
+    # Skewed frequencies, so that huffman shapes differ from balanced ones
+    text = ''.join(rng.choices(character_set,weights=[c * c + 1 for c in range(sigma)],k=n))
+    for block_size in (64,512):
+      tree = buildFlatTree(text,character_set,shape=shape,block_size=block_size)
+      assert queryAll(tree,monkeypatch,True) == queryAll(tree,monkeypatch,False)
+
+@pytest.mark.parametrize('shape',['balanced','huffman'])
+def test_flat_queries_on_a_single_character_text(monkeypatch,shape):
+  for character_set in ('$a','$ac','$acgt'):
+    tree = buildFlatTree('a' * 200,character_set,shape=shape)
+    flat = queryAll(tree,monkeypatch,True)
+    assert flat == queryAll(tree,monkeypatch,False)
+    assert tree.getRank(1,150) == 150
+    assert tree.getCharAndRank(99) == (1,99)
+
+def test_flat_queries_check_their_arguments():
+  tree = WaveletTree('acgt','$acgt')
+  for query in (lambda: tree.getRank(1,5),lambda: tree.getRank(5,1),lambda: tree.getRankPair(1,3,2),lambda: tree.getCharAndRank(4),lambda: tree.getRankAll(5)):
+    with pytest.raises(ValueError):
+      query()
+
+def optimalAlphabeticCost(frequencies):
+  # Reference O(Σ³) dynamic program, without Knuth's bound on the split points
+  sigma = len(frequencies)
+  cost = {(i,i + 1): 0 for i in range(sigma)}
+  for width in range(2,sigma + 1):
+    for i in range(sigma - width + 1):
+      j = i + width
+      cost[(i,j)] = sum(frequencies[i:j]) + min(cost[(i,m)] + cost[(m,j)] for m in range(i + 1,j))
+  return cost[(0,sigma)]
+
+def splitsCost(splits,frequencies):
+  # Total code length of the tree described by splits: every character costs its depth per occurrence
+  total = 0
+  ranges = [(0,len(frequencies),0)]
+  while ranges:
+    i,j,depth = ranges.pop()
+    if j - i == 1:
+      total += frequencies[i] * depth
+    else:
+      mid = splits[(i,j)]
+      assert i < mid < j
+      ranges.extend(((i,mid,depth + 1),(mid,j,depth + 1)))
+  return total
+
+def test_alphabetic_splits_are_optimal():
+  rng = random.Random(15)
+  for sigma in range(2,12):
+    for _ in range(25):
+      frequencies = [rng.choice((0,1,2,rng.randrange(100),rng.randrange(10000))) for _ in range(sigma)]
+      splits = WaveletTree.getAlphabeticSplits(frequencies)
+      assert len(splits) == sigma - 1
+      assert splitsCost(splits,frequencies) == optimalAlphabeticCost(frequencies)
+
+def test_huffman_tree_stores_the_optimal_number_of_bits():
+  rng = random.Random(16)
+  character_set = '$abcdefg'
+  text = ''.join(rng.choices(character_set[1:],weights=[50,20,10,8,6,4,2],k=3000)) + '$'
+  tree = WaveletTree(text,character_set,shape='huffman')
+  frequencies = [text.count(c) for c in character_set]
+  nodes,bits = [tree.root],0
+  while nodes:
+    node = nodes.pop()
+    if not node.is_leaf:
+      bits += len(node.bit_vector)
+      nodes.extend((node.left,node.right))
+  assert bits == optimalAlphabeticCost(frequencies)
+
+@pytest.mark.parametrize('bitvector',['plain','rrr','runlength'])
+def test_huffman_and_balanced_shapes_agree(monkeypatch,bitvector):
+  rng = random.Random(17)
+  character_set = '$acgtnx'
+  text = ''.join(rng.choices(character_set[1:],weights=[40,30,15,10,4,1],k=1500))
+  balanced = WaveletTree(text,character_set,bitvector=bitvector)
+  huffman = WaveletTree(text,character_set,shape='huffman',bitvector=bitvector)
+  for flat in (True,False):
+    assert queryAll(huffman,monkeypatch,flat) == queryAll(balanced,monkeypatch,flat)
+  for i,j in ((0,1500),(100,900),(700,701),(5,5)):
+    assert huffman.rangeCount(i,j,1,4) == balanced.rangeCount(i,j,1,4)
+    assert huffman.rangeTopK(i,j,3) == balanced.rangeTopK(i,j,3)
+
+def test_huffman_and_balanced_indexes_count_alike():
+  from FMIndex import FMIndex
+  rng = random.Random(18)
+  character_set = '$acgt'
+  text = ''.join(rng.choices('acgt',weights=[60,25,10,5],k=2000)) + '$'
+  balanced = FMIndex(text,character_set)
+  huffman = FMIndex(text,character_set,tree_shape='huffman')
+  for _ in range(200):
+    length = rng.randint(1,8)
+    start = rng.randrange(len(text) - length)
+    for pattern in (text[start:start + length],''.join(rng.choices('acgt',k=length))):
+      occurrences = sum(text.startswith(pattern,i) for i in range(len(text)))
+      assert huffman.findMatchCount(pattern) == balanced.findMatchCount(pattern) == occurrences
+
+@pytest.mark.parametrize('workers',[2,5])
+@pytest.mark.parametrize('shape',['balanced','huffman'])
+def test_parallel_build_matches_the_python_build(monkeypatch,workers,shape):
+  rng = random.Random(workers)
+  character_set = '$acgtnx'
+  text = ''.join(rng.choices(character_set[1:],weights=[40,30,15,10,4,1],k=800)) + '$'
+  expected = queryAll(WaveletTree(text,character_set,shape=shape),monkeypatch,False)
+  assert queryAll(WaveletTree(text,character_set,shape=shape,workers=workers),monkeypatch,False) == expected
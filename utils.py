@@ -1,22 +1,64 @@
-from time import time
+import sys
+try:
+  import resource
+except ImportError: # resource is only available on Unix
+  resource = None
+from constants import ENCODE_CHUNK_SIZE
 
-def timer_func(func):
-    # This function shows the execution time of
-    # the function object passed
-    def wrap_func(*args, **kwargs):
-        t1 = time()
-        result = func(*args, **kwargs)
-        t2 = time()
-        if 'debug' in kwargs and kwargs['debug']:
-          print(f'Function {func.__name__!r} executed in {(t2-t1):.4f}s')
-        return result
-    return wrap_func
+def selectInWord(word: int, k: int) -> int:
+  '''
+  Position of the k-th 1 (counting from 0) of a word of up to 64 bits, bit 0 first
+  Halves the word by popcount, so it takes 6 steps instead of one per bit
+  '''
+  position = 0
+  for width in (32,16,8,4,2,1):
+    low = (word & ((1 << width) - 1)).bit_count()
+    if k >= low:
+      k -= low
+      word >>= width
+      position += width
+  return position
+
+def encodeText(text, character_set: str):
+  '''
+  Map every character of text to its index in the character set
+  text can be a str, or a bytes-like object whose bytes are latin-1 characters
+  A bytearray is encoded in place, chunk by chunk, so no second copy of the text is made
+  Returns bytes-like codes for character sets of up to 256 characters, a list of ints otherwise
+  Raises ValueError if text has a character that is not in the character set
+  '''
+  charToIdx = dict(zip(character_set,range(len(character_set))))
+  if isinstance(text,str):
+    invalid = set(text).difference(charToIdx)
+    if invalid:
+      raise ValueError(f"Text has characters that are not in the character set: {''.join(sorted(invalid))!r}")
+    if len(character_set) > 256:
+      return [charToIdx[c] for c in text]
+    return text.translate({ord(c): i for c,i in charToIdx.items()}).encode('latin-1')
+
+  byte_chars = bytes(ord(c) for c in character_set if ord(c) < 256)
+  invalid = text.translate(None,byte_chars)
+  if invalid:
+    raise ValueError(f"Text has characters that are not in the character set: {bytes(sorted(set(invalid)))!r}")
+  if len(character_set) > 256:
+    return [charToIdx[chr(b)] for b in text]
+  table = bytearray(range(256))
+  for c,i in charToIdx.items():
+    if ord(c) < 256:
+      table[ord(c)] = i
+  table = bytes(table)
+  if isinstance(text,bytearray):
+    for k in range(0,len(text),ENCODE_CHUNK_SIZE):
+      text[k:k + ENCODE_CHUNK_SIZE] = text[k:k + ENCODE_CHUNK_SIZE].translate(table)
+    return text
+  return bytes(text).translate(table)
 
-def getIntFromBits(bit_array):
+def getPeakRSS():
   '''
-  Convert an array of 1s and 0s to its integer representation
+  Peak resident set size of this process so far, in bytes. None where it cannot be measured
   '''
-  out_num = 0
-  for bit in bit_array:
-    out_num = (out_num << 1) | bit
-  return out_num
\ No newline at end of file
+  if resource is None:
+    return None
+  peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+  # Linux reports kilobytes, macOS bytes
+  return peak if sys.platform == 'darwin' else peak * 1024